@@ -12,6 +12,7 @@ from loguru import logger
 from app.config import config
 from app.models.exception import HttpException
 from app.router import root_api_router
+from app.services import media_cache, render, subtitle, tts_service
 from app.utils import utils
 
 
@@ -75,8 +76,13 @@ app.mount("/", StaticFiles(directory=public_dir, html=True), name="")
 @app.on_event("shutdown")
 def shutdown_event():
     logger.info("shutdown event")
+    render.shutdown()
+    tts_service.edge_service.shutdown()
+    media_cache.cache.shutdown()
 
 
 @app.on_event("startup")
 def startup_event():
     logger.info("startup event")
+    subtitle.preload()
+    media_cache.start()
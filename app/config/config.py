@@ -49,6 +49,8 @@ hostname = socket.gethostname()
 log_level = _cfg.get("log_level", "DEBUG")
 listen_host = _cfg.get("listen_host", "0.0.0.0")
 listen_port = _cfg.get("listen_port", 8080)
+# Số process uvicorn; > 1 cần state_backend = "sqlite" hoặc Redis để dùng chung trạng thái task
+listen_workers = _cfg.get("listen_workers", 1)
 project_name = _cfg.get("project_name", "AutoVideo")
 project_description = _cfg.get(
     "project_description",
@@ -1,6 +1,8 @@
 import threading
 from typing import Any, Callable, Dict
 
+from app.services import stage
+
 
 class TaskManager:
     def __init__(self, max_concurrent_tasks: int):
@@ -33,10 +35,16 @@ class TaskManager:
         try:
             with self.lock:
                 self.current_tasks += 1
-            func(*args, **kwargs)  # gọi hàm ở đây, truyền *args và **kwargs.
+            # Tác vụ đang chờ/chạy render trả chỗ để tác vụ khác chạy stage I/O
+            with stage.task_slot(self.task_done, self._reacquire):
+                func(*args, **kwargs)  # gọi hàm ở đây, truyền *args và **kwargs.
         finally:
             self.task_done()
 
+    def _reacquire(self):
+        with self.lock:
+            self.current_tasks += 1
+
     def check_queue(self):
         with self.lock:
             if (
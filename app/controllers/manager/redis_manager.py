@@ -1,56 +1,237 @@
 import json
-from typing import Dict
+import time
+from typing import Any, Callable, Dict, List
 
 import redis
+from loguru import logger
+from pydantic import BaseModel
 
+from app.config import config
 from app.controllers.manager.base_manager import TaskManager
-from app.models.schema import VideoParams
+from app.models import const
+from app.models.schema import VideoParams, VideoPodcastParams
+from app.services import state as sm
 from app.services import task as tm
+from app.utils import utils
 
+# Các loại job có thể đưa vào hàng đợi: tên hàm -> hàm xử lý
 FUNC_MAP = {
     "start": tm.start,
+    "start_podcast": tm.start_podcast,
     # 'start_test': tm.start_test
 }
 
+# Kiểu params của từng loại job, dùng để khôi phục params khi lấy job ra
+PARAMS_MAP = {
+    "start": VideoParams,
+    "start_podcast": VideoPodcastParams,
+}
+
+
+def get_redis_url() -> str:
+    redis_host = config.app.get("redis_host", "localhost")
+    redis_port = config.app.get("redis_port", 6379)
+    redis_db = config.app.get("redis_db", 0)
+    redis_password = config.app.get("redis_password", None)
+    return f"redis://:{redis_password}@{redis_host}:{redis_port}/{redis_db}"
+
 
 class RedisTaskManager(TaskManager):
-    def __init__(self, max_concurrent_tasks: int, redis_url: str):
+    def __init__(
+        self, max_concurrent_tasks: int, redis_url: str, external_workers: bool = False
+    ):
         self.redis_client = redis.Redis.from_url(redis_url)
+        # external_workers: API chỉ đưa job vào hàng đợi, việc chạy do app.worker đảm nhận
+        self.external_workers = external_workers
+        # Job bị worker nhận mà không gia hạn lease sau lease_timeout giây sẽ
+        # được đưa lại hàng đợi; quá max_attempts lần thì chuyển sang dead-letter
+        self.lease_timeout = config.app.get("redis_lease_timeout", 60)
+        self.max_attempts = config.app.get("redis_max_attempts", 3)
         super().__init__(max_concurrent_tasks)
 
     def create_queue(self):
         return "task_queue"
 
+    @property
+    def workers_key(self):
+        return f"{self.queue}:workers"
+
+    @property
+    def leases_key(self):
+        # sorted set: job_id -> thời điểm hết hạn lease
+        return f"{self.queue}:leases"
+
+    @property
+    def dead_letter_key(self):
+        return f"{self.queue}:dead"
+
+    def processing_key(self, worker_id: str):
+        return f"{self.queue}:processing:{worker_id}"
+
+    def add_task(self, func: Callable, *args: Any, **kwargs: Any):
+        if self.external_workers:
+            print(f"enqueue task: {func.__name__}, external workers")
+            self.enqueue({"func": func, "args": args, "kwargs": kwargs})
+            return
+        super().add_task(func, *args, **kwargs)
+
     def enqueue(self, task: Dict):
         task_with_serializable_params = task.copy()
+        task_with_serializable_params["kwargs"] = task["kwargs"].copy()
 
         if "params" in task["kwargs"] and isinstance(
-            task["kwargs"]["params"], VideoParams
+            task["kwargs"]["params"], BaseModel
         ):
             task_with_serializable_params["kwargs"]["params"] = task["kwargs"][
                 "params"
-            ].dict()
+            ].model_dump(mode="json")
 
         # chuyển đổi đối tượng hàm thành tên hàm
-        task_with_serializable_params["func"] = task["func"].__name__
+        func_name = task["func"].__name__
+        if func_name not in FUNC_MAP:
+            raise ValueError(f"Loại job không được hỗ trợ: {func_name}")
+        task_with_serializable_params["func"] = func_name
+        task_with_serializable_params["job_id"] = utils.get_uuid(remove_hyphen=True)
+        task_with_serializable_params["attempts"] = 0
         self.redis_client.rpush(self.queue, json.dumps(task_with_serializable_params))
 
-    def dequeue(self):
-        task_json = self.redis_client.lpop(self.queue)
+    def dequeue(self, timeout: int = None):
+        # timeout: số giây chờ job mới (BLPOP), None = không chờ
+        if timeout is None:
+            task_json = self.redis_client.lpop(self.queue)
+        else:
+            item = self.redis_client.blpop([self.queue], timeout=timeout)
+            task_json = item[1] if item else None
         if task_json:
-            task_info = json.loads(task_json)
-            # chuyển đổi tên hàm thành đối tượng hàm
-            task_info["func"] = FUNC_MAP[task_info["func"]]
-
-            if "params" in task_info["kwargs"] and isinstance(
-                task_info["kwargs"]["params"], dict
-            ):
-                task_info["kwargs"]["params"] = VideoParams(
-                    **task_info["kwargs"]["params"]
-                )
-
-            return task_info
+            return self.decode_task(task_json)
         return None
 
+    def claim(self, worker_id: str, timeout: int) -> Dict | None:
+        """
+        Nhận một job cho worker: chuyển nguyên tử job từ hàng đợi sang danh sách
+        processing của worker (BLMOVE, cần Redis >= 6.2) rồi cấp lease cho job.
+        Nếu worker chết trước khi cấp lease, requeue_expired sẽ cấp lease thay
+        và job được trả lại hàng đợi khi lease hết hạn.
+        """
+        task_json = self.redis_client.blmove(
+            self.queue, self.processing_key(worker_id), timeout, "LEFT", "RIGHT"
+        )
+        if not task_json:
+            return None
+        task_info = self.decode_task(task_json)
+        if task_info.get("job_id"):
+            self.redis_client.zadd(
+                self.leases_key, {task_info["job_id"]: time.time() + self.lease_timeout}
+            )
+        return task_info
+
+    def ack(self, worker_id: str, task_info: Dict):
+        # Job đã chạy xong (thành công hoặc lỗi): bỏ khỏi processing và xóa lease
+        pipe = self.redis_client.pipeline()
+        pipe.lrem(self.processing_key(worker_id), 1, task_info["raw"])
+        if task_info.get("job_id"):
+            pipe.zrem(self.leases_key, task_info["job_id"])
+        pipe.execute()
+
+    def extend_leases(self, job_ids: List[str]):
+        if not job_ids:
+            return
+        expire_at = time.time() + self.lease_timeout
+        # XX: không tạo lại lease cho job đã bị requeue
+        self.redis_client.zadd(
+            self.leases_key, {job_id: expire_at for job_id in job_ids}, xx=True
+        )
+
+    def requeue_expired(self) -> int:
+        """
+        Đưa các job có lease hết hạn (worker chết, bị OOM kill...) về hàng đợi.
+        Job đã thử quá max_attempts lần được chuyển sang dead-letter.
+        """
+        now = time.time()
+        requeued = 0
+        for worker_id in self.redis_client.smembers(self.workers_key):
+            worker_id = worker_id.decode("utf-8")
+            processing_key = self.processing_key(worker_id)
+            jobs = self.redis_client.lrange(processing_key, 0, -1)
+            if not jobs:
+                if not self.redis_client.exists(f"worker:{worker_id}"):
+                    self.redis_client.srem(self.workers_key, worker_id)
+                continue
+
+            for raw in jobs:
+                job = json.loads(raw)
+                job_id = job.get("job_id")
+                if not job_id:
+                    # Job cũ không có lease: chỉ thu hồi khi worker đã chết
+                    if self.redis_client.exists(f"worker:{worker_id}"):
+                        continue
+                else:
+                    expire_at = self.redis_client.zscore(self.leases_key, job_id)
+                    if expire_at is None:
+                        # Job chưa có lease (worker chết ngay sau BLMOVE): cấp lease mới
+                        self.redis_client.zadd(
+                            self.leases_key, {job_id: now + self.lease_timeout}, nx=True
+                        )
+                        continue
+                    if expire_at > now:
+                        continue
+
+                if self._requeue(processing_key, raw, job):
+                    requeued += 1
+        return requeued
+
+    def _requeue(self, processing_key: str, raw: bytes, job: Dict) -> bool:
+        job["attempts"] = job.get("attempts", 0) + 1
+        dead = job["attempts"] >= self.max_attempts
+        with self.redis_client.pipeline() as pipe:
+            try:
+                # WATCH để hai worker không cùng requeue một job
+                pipe.watch(processing_key)
+                if raw not in pipe.lrange(processing_key, 0, -1):
+                    return False
+                pipe.multi()
+                pipe.lrem(processing_key, 1, raw)
+                if dead:
+                    pipe.rpush(self.dead_letter_key, json.dumps(job))
+                else:
+                    pipe.lpush(self.queue, json.dumps(job))
+                if job.get("job_id"):
+                    pipe.zrem(self.leases_key, job["job_id"])
+                pipe.execute()
+            except redis.WatchError:
+                return False
+
+        task_id = job.get("kwargs", {}).get("task_id", "")
+        if dead:
+            logger.error(
+                f"Job {job.get('job_id')} (task: {task_id}) thất bại {job['attempts']} lần, chuyển sang dead-letter"
+            )
+            if task_id:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        else:
+            logger.warning(
+                f"Lease của job {job.get('job_id')} (task: {task_id}) hết hạn, đưa lại hàng đợi, lần thử: {job['attempts']}"
+            )
+        return True
+
+    @staticmethod
+    def decode_task(task_json) -> Dict:
+        task_info = json.loads(task_json)
+        # giữ nguyên chuỗi JSON gốc để xóa khỏi danh sách processing khi ack
+        task_info["raw"] = task_json
+        func_name = task_info["func"]
+        # chuyển đổi tên hàm thành đối tượng hàm
+        task_info["func"] = FUNC_MAP[func_name]
+
+        params_cls = PARAMS_MAP.get(func_name, VideoParams)
+        if "params" in task_info["kwargs"] and isinstance(
+            task_info["kwargs"]["params"], dict
+        ):
+            task_info["kwargs"]["params"] = params_cls(
+                **task_info["kwargs"]["params"]
+            )
+
+        return task_info
+
     def is_queue_empty(self):
         return self.redis_client.llen(self.queue) == 0
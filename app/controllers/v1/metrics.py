@@ -0,0 +1,32 @@
+from fastapi import Request
+
+from app.controllers.v1.base import new_router
+from app.services import media_cache, search_cache, stage, subtitle, tts_cache, tts_service
+from app.services import state as sm
+from app.utils import utils
+
+# authentication dependency
+# router = new_router(dependencies=[Depends(base.verify_token)])
+router = new_router()
+
+
+@router.get("/metrics", summary="Số liệu các pool và cache của process này")
+def get_metrics(request: Request):
+    response = {
+        "stages": {
+            "io": stage.io_pool.stats(),
+            "render": stage.render_pool.stats(),
+        },
+        "tts": {
+            "edge": tts_service.edge_service.stats(),
+            "cache": tts_cache.cache.stats() if tts_cache.cache else None,
+        },
+        "whisper": subtitle.pool.stats(),
+        "materials": {
+            "cache": media_cache.cache.stats(),
+            "search_cache": search_cache.cache.stats() if search_cache.cache else None,
+        },
+    }
+    if hasattr(sm.state, "stats"):
+        response["state"] = sm.state.stats()
+    return utils.get_response(200, response)
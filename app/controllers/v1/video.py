@@ -1,19 +1,34 @@
+import asyncio
 import glob
+import json
 import os
 import pathlib
 import shutil
-from typing import Union
-
-from fastapi import BackgroundTasks, Depends, Path, Request, UploadFile, Body
+import time
+from typing import Optional, Union
+
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    Path,
+    Request,
+    UploadFile,
+    Body,
+    WebSocket,
+    WebSocketDisconnect,
+)
 from fastapi.params import File
 from fastapi.responses import FileResponse, StreamingResponse
 from loguru import logger
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
 
 from app.config import config
 from app.controllers import base
 from app.controllers.manager.memory_manager import InMemoryTaskManager
-from app.controllers.manager.redis_manager import RedisTaskManager
+from app.controllers.manager.redis_manager import RedisTaskManager, get_redis_url
 from app.controllers.v1.base import new_router
+from app.models import const
 from app.models.exception import HttpException
 from app.models.schema import (
     AudioRequest,
@@ -37,17 +52,20 @@ from app.utils import utils
 router = new_router()
 
 _enable_redis = config.app.get("enable_redis", False)
-_redis_host = config.app.get("redis_host", "localhost")
-_redis_port = config.app.get("redis_port", 6379)
-_redis_db = config.app.get("redis_db", 0)
-_redis_password = config.app.get("redis_password", None)
+# Khi bật, API chỉ đưa job vào Redis, các worker (python -m app.worker) sẽ chạy job
+_redis_external_workers = config.app.get("redis_external_workers", False)
+# Số tác vụ được nhận chạy đồng thời; bên trong tác vụ, stage I/O và stage
+# nặng CPU (render, Whisper) còn bị giới hạn bởi stage.io_pool và stage.render_pool.
+# Tác vụ đang chờ/chạy trong render_pool trả chỗ (stage.task_slot)
 _max_concurrent_tasks = config.app.get("max_concurrent_tasks", 5)
 
-redis_url = f"redis://:{_redis_password}@{_redis_host}:{_redis_port}/{_redis_db}"
+redis_url = get_redis_url()
 # Chọn task manager phù hợp dựa trên cấu hình
 if _enable_redis:
     task_manager = RedisTaskManager(
-        max_concurrent_tasks=_max_concurrent_tasks, redis_url=redis_url
+        max_concurrent_tasks=_max_concurrent_tasks,
+        redis_url=redis_url,
+        external_workers=_redis_external_workers,
     )
 else:
     task_manager = InMemoryTaskManager(max_concurrent_tasks=_max_concurrent_tasks)
@@ -110,9 +128,14 @@ def create_task(
 from fastapi import Query
 
 @router.get("/tasks", response_model=TaskQueryResponse, summary="Lấy tất cả tác vụ")
-def get_all_tasks(request: Request, page: int = Query(1, ge=1), page_size: int = Query(10, ge=1)):
+def get_all_tasks(
+    request: Request,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1),
+    state: Optional[int] = Query(None, description="Lọc theo trạng thái tác vụ"),
+):
     request_id = base.get_task_id(request)
-    tasks, total = sm.state.get_all_tasks(page, page_size)
+    tasks, total = sm.state.get_all_tasks(page, page_size, state=state)
 
     response = {
         "tasks": tasks,
@@ -124,49 +147,128 @@ def get_all_tasks(request: Request, page: int = Query(1, ge=1), page_size: int =
 
 
 
+def _task_with_uris(connection: HTTPConnection, task: dict) -> dict:
+    # Đổi đường dẫn file trong thư mục tasks thành URL truy cập được
+    endpoint = config.app.get("endpoint", "")
+    if not endpoint:
+        endpoint = str(connection.base_url)
+    endpoint = endpoint.rstrip("/")
+    task_dir = utils.task_dir()
+
+    def file_to_uri(file):
+        if not file.startswith(endpoint):
+            _uri_path = file.replace(task_dir, "tasks").replace("\\", "/")
+            _uri_path = f"{endpoint}/{_uri_path}"
+        else:
+            _uri_path = file
+        return _uri_path
+
+    task = dict(task)
+    for key in ("videos", "combined_videos"):
+        if key in task:
+            task[key] = [file_to_uri(v) for v in task[key]]
+    return task
+
+
 @router.get("/tasks/{task_id}", response_model=TaskQueryResponse, summary="Lấy trạng thái tác vụ")
 def get_task(
     request: Request,
     task_id: str = Path(..., description="Task ID"),
     query: TaskQueryRequest = Depends(),
 ):
-    endpoint = config.app.get("endpoint", "")
-    if not endpoint:
-        endpoint = str(request.base_url)
-    endpoint = endpoint.rstrip("/")
-
     request_id = base.get_task_id(request)
     task = sm.state.get_task(task_id)
     if task:
-        task_dir = utils.task_dir()
-
-        def file_to_uri(file):
-            if not file.startswith(endpoint):
-                _uri_path = v.replace(task_dir, "tasks").replace("\\", "/")
-                _uri_path = f"{endpoint}/{_uri_path}"
-            else:
-                _uri_path = file
-            return _uri_path
-
-        if "videos" in task:
-            videos = task["videos"]
-            urls = []
-            for v in videos:
-                urls.append(file_to_uri(v))
-            task["videos"] = urls
-        if "combined_videos" in task:
-            combined_videos = task["combined_videos"]
-            urls = []
-            for v in combined_videos:
-                urls.append(file_to_uri(v))
-            task["combined_videos"] = urls
-        return utils.get_response(200, task)
+        return utils.get_response(200, _task_with_uris(request, task))
 
     raise HttpException(
         task_id=task_id, status_code=404, message=f"{request_id}: task không tồn tại"
     )
 
 
+# Stream tiến độ: chỉ đọc lại task khi state backend báo có thay đổi
+# (task_version), đồng thời đọc lại định kỳ để nhận cập nhật từ process khác
+# khi backend không có kênh thông báo (SQLite).
+_EVENT_POLL_INTERVAL = 0.2
+_EVENT_RESYNC_INTERVAL = 2.0
+_EVENT_KEEPALIVE_INTERVAL = 15.0
+_FINAL_STATES = (const.TASK_STATE_COMPLETE, const.TASK_STATE_FAILED)
+
+
+def _dumps(data) -> str:
+    # params có thể chứa Enum: chuyển về chuỗi thay vì lỗi
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+async def _watch_task(connection: HTTPConnection, task_id: str):
+    """Sinh (event, data) mỗi khi task thay đổi; data = None là keepalive."""
+    version = -1
+    last = None
+    read_at = 0.0
+    sent_at = time.monotonic()
+    while True:
+        now = time.monotonic()
+        current = sm.state.task_version(task_id)
+        if current != version or now - read_at >= _EVENT_RESYNC_INTERVAL:
+            version = current
+            read_at = now
+            task = await run_in_threadpool(sm.state.get_task, task_id)
+            if not task:
+                yield "deleted", {"task_id": task_id}
+                return
+            task = _task_with_uris(connection, task)
+            if task != last:
+                last = task
+                sent_at = now
+                yield "task", task
+                if task.get("state") in _FINAL_STATES:
+                    return
+        if now - sent_at >= _EVENT_KEEPALIVE_INTERVAL:
+            sent_at = now
+            yield "ping", None
+        await asyncio.sleep(_EVENT_POLL_INTERVAL)
+
+
+@router.get("/tasks/{task_id}/events", summary="Stream tiến độ tác vụ (SSE)")
+async def stream_task_events(
+    request: Request, task_id: str = Path(..., description="Task ID")
+):
+    request_id = base.get_task_id(request)
+    if not await run_in_threadpool(sm.state.get_task, task_id):
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task không tồn tại"
+        )
+
+    async def event_stream():
+        async for event, data in _watch_task(request, task_id):
+            if await request.is_disconnected():
+                return
+            if data is None:
+                yield ": ping\n\n"
+                continue
+            yield f"event: {event}\ndata: {_dumps(data)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/tasks/{task_id}/ws")
+async def task_events_websocket(websocket: WebSocket, task_id: str):
+    await websocket.accept()
+    try:
+        async for event, data in _watch_task(websocket, task_id):
+            if data is None:
+                await websocket.send_text(_dumps({"event": "ping"}))
+                continue
+            await websocket.send_text(_dumps({"event": event, "data": data}))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
 @router.delete(
     "/tasks/{task_id}",
     response_model=TaskDeletionResponse,
@@ -179,6 +281,8 @@ def delete_video(request: Request, task_id: str = Path(..., description="Task ID
         tasks_dir = utils.task_dir()
         current_task_dir = os.path.join(tasks_dir, task_id)
         if os.path.exists(current_task_dir):
+            # Tài liệu trong thư mục tác vụ là hardlink tới kho media dùng chung:
+            # chỉ link bị xóa, bản trong kho do sweeper của media_cache quản lý
             shutil.rmtree(current_task_dir)
 
         sm.state.delete_task(task_id)
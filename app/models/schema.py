@@ -131,6 +131,8 @@ class VideoPodcastParams(BaseModel):
     custom_position: float = 70.0
     font_name: Optional[str] = "Charm-Bold.ttf"
     text_fore_color: Optional[str] = "#FFFFFF"
+    # Màu chữ phụ đề khi host2 nói, để trống thì dùng text_fore_color
+    text_fore_color2: Optional[str] = ""
     text_background_color: Union[bool, str] = True
     type_subtitle: Optional[str] = "normal"
     font_size: int = 60
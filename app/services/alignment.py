@@ -0,0 +1,263 @@
+import json
+import os
+import re
+import unicodedata
+from typing import List
+from xml.sax.saxutils import unescape
+
+import numpy as np
+
+# Căn thời gian dòng phụ đề theo khoảng lặng trong audio: tính năng lượng
+# (RMS) của PCM theo từng khung 10ms, tìm các khoảng lặng rồi đặt ranh giới
+# giữa các dòng vào khoảng lặng gần vị trí ước tính theo số ký tự nhất.
+
+_FRAME_MS = 10
+
+
+class PCMEnvelope:
+    """Tính dần năng lượng RMS theo khung từ luồng PCM s16le mono."""
+
+    def __init__(self, sample_rate: int = 24000):
+        self.sample_rate = sample_rate
+        self.frame_size = sample_rate * _FRAME_MS // 1000
+        self._pending = b""
+        self._frames = []
+
+    def feed(self, data: bytes):
+        data = self._pending + data
+        frame_bytes = self.frame_size * 2
+        usable = len(data) - len(data) % frame_bytes
+        self._pending = data[usable:]
+        if not usable:
+            return
+        samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32)
+        frames = samples.reshape(-1, self.frame_size)
+        self._frames.append(np.sqrt(np.mean(frames * frames, axis=1)))
+
+    @property
+    def rms(self) -> np.ndarray:
+        if not self._frames:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self._frames)
+
+
+def find_pauses(rms: np.ndarray, min_pause: float = 0.12):
+    """Trả về danh sách (bắt đầu, kết thúc) của các khoảng lặng, đơn vị giây."""
+    if not len(rms):
+        return []
+    db = 20 * np.log10(np.maximum(rms, 1.0))
+    floor = np.percentile(db, 10)
+    speech = np.percentile(db, 90)
+    if speech - floor < 6:
+        # Không phân biệt được tiếng nói và khoảng lặng
+        return []
+    silent = db < floor + (speech - floor) * 0.3
+
+    # Tìm các đoạn liên tiếp khung lặng
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    frame = _FRAME_MS / 1000
+    min_frames = max(1, int(min_pause / frame))
+    return [
+        (float(s * frame), float(e * frame))
+        for s, e in zip(starts, ends)
+        if e - s >= min_frames
+    ]
+
+
+def align_lines(
+    lines: List[str], rms: np.ndarray, duration: float, max_shift: float = 1.5
+) -> List[tuple]:
+    """
+    Trả về (bắt đầu, kết thúc) theo giây cho từng dòng. Ranh giới giữa hai
+    dòng được đặt vào khoảng lặng gần vị trí ước tính theo số ký tự nhất
+    (trong phạm vi max_shift giây); không có khoảng lặng phù hợp thì giữ vị
+    trí ước tính. Vị trí ước tính được tính lại sau mỗi ranh giới để sai số
+    không dồn về cuối.
+    """
+    if not lines:
+        return []
+    pauses = find_pauses(rms)
+    chars = [max(1, len(line)) for line in lines]
+
+    # Bỏ khoảng lặng ở đầu và cuối audio
+    speech_start, speech_end = 0.0, duration
+    if pauses and pauses[0][0] <= 0:
+        speech_start = min(pauses[0][1], duration)
+        pauses = pauses[1:]
+    if pauses and pauses[-1][1] >= duration - _FRAME_MS / 1000:
+        speech_end = max(pauses[-1][0], speech_start)
+        pauses = pauses[:-1]
+
+    timings = []
+    start = speech_start
+    next_pause = 0
+    for i in range(len(lines) - 1):
+        remaining = sum(chars[i:])
+        expected = start + (speech_end - start) * chars[i] / remaining
+
+        best = None
+        for j in range(next_pause, len(pauses)):
+            p_start, p_end = pauses[j]
+            if p_start <= start:
+                continue
+            middle = (p_start + p_end) / 2
+            if middle - expected > max_shift:
+                break
+            distance = abs(middle - expected)
+            if distance <= max_shift and (best is None or distance < best[0]):
+                best = (distance, j)
+
+        if best is not None:
+            j = best[1]
+            timings.append((start, pauses[j][0]))
+            start = pauses[j][1]
+            next_pause = j + 1
+        else:
+            timings.append((start, expected))
+            start = expected
+    timings.append((start, max(start, speech_end)))
+    return timings
+
+
+# Căn các từ của SubMaker (WordBoundary) với kịch bản: chuẩn hóa cả hai
+# thành chuỗi ký tự chữ/số viết thường rồi so khớp tuần tự trong một lượt.
+# Từ của SubMaker không khớp ngay được tìm trong cửa sổ ký tự phía trước
+# (bỏ qua phần kịch bản không được đọc); không tìm thấy thì bỏ qua từ đó.
+# Từ kịch bản không có thời gian được nội suy từ các từ bên cạnh.
+
+_SEARCH_WINDOW = 64
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\W+", "", unicodedata.normalize("NFC", text).lower())
+
+
+def align_words(lines: List[str], words: List[str], offsets: List[tuple]):
+    """
+    lines: các dòng kịch bản; words, offsets: subs và offset của SubMaker.
+    Trả về (timing của từng dòng, timing của từng từ), thời gian tính theo
+    đơn vị của offsets. Timing từ: (chỉ số dòng, từ, bắt đầu, kết thúc).
+    """
+    tokens = []  # (chỉ số dòng, từ, vị trí ký tự đầu, vị trí ký tự cuối)
+    chars = []
+    for line_index, line in enumerate(lines):
+        for token in line.split():
+            norm = _normalize(token)
+            tokens.append((line_index, token, len(chars), len(chars) + len(norm)))
+            chars.extend(norm)
+    script = "".join(chars)
+    char_start = [None] * len(script)
+    char_end = [None] * len(script)
+
+    pos = 0
+    for word, (start, end) in zip(words, offsets):
+        norm = _normalize(unescape(word))
+        if not norm:
+            continue
+        if script.startswith(norm, pos):
+            found = pos
+        else:
+            # Từ ngắn dễ khớp nhầm: thu hẹp cửa sổ tìm kiếm theo độ dài từ
+            window = min(_SEARCH_WINDOW, 8 * len(norm))
+            found = script.find(norm, pos, pos + window + len(norm))
+            if found < 0:
+                continue
+        # Chia thời gian của từ cho từng ký tự
+        step = (end - start) / len(norm)
+        for i in range(len(norm)):
+            char_start[found + i] = start + step * i
+            char_end[found + i] = start + step * (i + 1)
+        pos = found + len(norm)
+
+    word_timings = []
+    for line_index, token, a, b in tokens:
+        timed = [c for c in range(a, b) if char_start[c] is not None]
+        if timed:
+            word_timings.append([line_index, token, char_start[timed[0]], char_end[timed[-1]]])
+        else:
+            word_timings.append([line_index, token, None, None])
+
+    # Nội suy cho các từ liên tiếp không có thời gian
+    total_end = offsets[-1][1] if offsets else 0
+    i = 0
+    while i < len(word_timings):
+        if word_timings[i][2] is not None:
+            i += 1
+            continue
+        j = i
+        while j < len(word_timings) and word_timings[j][2] is None:
+            j += 1
+        left = word_timings[i - 1][3] if i > 0 else 0
+        right = word_timings[j][2] if j < len(word_timings) else max(left, total_end)
+        step = (right - left) / (j - i)
+        for k in range(i, j):
+            word_timings[k][2] = left + step * (k - i)
+            word_timings[k][3] = left + step * (k - i + 1)
+        i = j
+
+    bounds = {}
+    for line_index, _, start, end in word_timings:
+        if line_index not in bounds:
+            bounds[line_index] = [start, end]
+        bounds[line_index][1] = end
+    line_timings = []
+    for line_index in range(len(lines)):
+        if line_index in bounds:
+            line_timings.append(tuple(bounds[line_index]))
+        else:
+            # Dòng không có từ nào
+            previous = line_timings[-1][1] if line_timings else 0
+            line_timings.append((previous, previous))
+    return line_timings, [tuple(w) for w in word_timings]
+
+
+def word_timing_file(subtitle_file: str) -> str:
+    # File timing từng từ đi kèm file phụ đề: subtitle.srt -> subtitle.words.json
+    return os.path.splitext(subtitle_file)[0] + ".words.json"
+
+
+def save_word_timings(subtitle_file: str, word_timings: List[tuple]):
+    """word_timings: (chỉ số dòng, từ, bắt đầu, kết thúc), thời gian theo giây."""
+    items = [
+        {"line": line, "word": word, "start": round(start, 3), "end": round(end, 3)}
+        for line, word, start, end in word_timings
+    ]
+    with open(word_timing_file(subtitle_file), "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False)
+
+
+def load_word_timings(subtitle_file: str) -> List[dict]:
+    path = word_timing_file(subtitle_file)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def speaker_timing_file(audio_file: str) -> str:
+    # Timing từng lượt thoại podcast đi kèm file audio: audio.mp3 -> audio.speakers.json
+    return os.path.splitext(audio_file)[0] + ".speakers.json"
+
+
+def save_speaker_timings(audio_file: str, turns: List[dict]):
+    """turns: [{"host", "speaker", "start", "end", "text"}], thời gian theo giây."""
+    with open(speaker_timing_file(audio_file), "w", encoding="utf-8") as f:
+        json.dump(turns, f, ensure_ascii=False)
+
+
+def remove_speaker_timings(audio_file: str):
+    # Audio được tạo lại không theo lượt thoại: timing cũ không còn đúng
+    try:
+        os.remove(speaker_timing_file(audio_file))
+    except FileNotFoundError:
+        pass
+
+
+def load_speaker_timings(audio_file: str) -> List[dict]:
+    path = speaker_timing_file(audio_file)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
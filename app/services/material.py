@@ -2,19 +2,65 @@ import os
 import random
 import gc
 import shutil # Added for shutil.copy in combine_videos
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from typing import List
 from urllib.parse import urlencode
 
 import requests
 from loguru import logger
 from moviepy.video.io.VideoFileClip import VideoFileClip
+from requests.adapters import HTTPAdapter
 
 from app.config import config
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services import media_cache, search_cache
 from app.utils import utils
 
 requested_count = 0
 
+# Số video tải xuống đồng thời trong một tác vụ
+download_concurrency = max(1, int(config.app.get("material_download_concurrency", 4)))
+
+_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
+
+_session = None
+_session_lock = threading.Lock()
+
+# Tải theo khối 1 MB vào file .part, thử lại tối đa _DOWNLOAD_ATTEMPTS lần
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+_DOWNLOAD_ATTEMPTS = 3
+# Ghi sha256 của mỗi video tải về vào file .sha256 đi kèm
+download_checksum = bool(config.app.get("material_download_checksum", False))
+
+# Khóa theo đường dẫn để hai tác vụ không cùng ghi một file .part: trong
+# process là đường dẫn -> [khóa, số tác vụ đang giữ/chờ] (xóa khi không còn
+# ai dùng), giữa các process là file khóa của media_cache
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Session dùng chung cho tìm kiếm và tải tài liệu: giữ kết nối keep-alive
+    theo từng host thay vì mở kết nối mới cho mỗi request.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Đủ kết nối cho mọi tác vụ chạy đồng thời cùng tải từ một host
+                pool_size = download_concurrency * max(1, int(config.app.get("max_concurrent_tasks", 5)))
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = _USER_AGENT
+                _session = session
+    return _session
+
 
 def get_api_key(cfg_key: str):
     api_keys = config.app.get(cfg_key)
@@ -33,7 +79,7 @@ def get_api_key(cfg_key: str):
     return api_keys[requested_count % len(api_keys)]
 
 
-def search_videos_pexels(
+def _search_videos_pexels(
     search_term: str,
     minimum_duration: int,
     video_aspect: VideoAspect = VideoAspect.portrait,
@@ -42,17 +88,14 @@ def search_videos_pexels(
     video_orientation = aspect.name
     video_width, video_height = aspect.to_resolution()
     api_key = get_api_key("pexels_api_keys")
-    headers = {
-        "Authorization": api_key,
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
-    }
+    headers = {"Authorization": api_key}
     # Build URL
     params = {"query": search_term, "per_page": 20, "orientation": video_orientation}
     query_url = f"https://api.pexels.com/videos/search?{urlencode(params)}"
     logger.info(f"Đang tìm kiếm video: {query_url}, với proxy: {config.proxy}")
 
     try:
-        r = requests.get(
+        r = get_session().get(
             query_url,
             headers=headers,
             proxies=config.proxy,
@@ -90,7 +133,7 @@ def search_videos_pexels(
     return []
 
 
-def search_videos_pixabay(
+def _search_videos_pixabay(
     search_term: str,
     minimum_duration: int,
     video_aspect: VideoAspect = VideoAspect.portrait,
@@ -111,7 +154,7 @@ def search_videos_pixabay(
     logger.info(f"Đang tìm kiếm video: {query_url}, với proxy: {config.proxy}")
 
     try:
-        r = requests.get(
+        r = get_session().get(
             query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
         )
         response = r.json()
@@ -146,12 +189,152 @@ def search_videos_pixabay(
     return []
 
 
-def save_video(video_url: str, save_dir: str = "") -> str:
-    if not save_dir:
-        save_dir = utils.storage_dir("cache_videos")
+def _cached_search(search, provider, search_term, minimum_duration, video_aspect):
+    if search_cache.cache is None:
+        return search(search_term, minimum_duration, video_aspect)
+
+    key = search_cache.cache.make_key(
+        provider, search_term, VideoAspect(video_aspect).value, minimum_duration
+    )
+
+    def fetch():
+        items = search(search_term, minimum_duration, video_aspect)
+        return [{"provider": i.provider, "url": i.url, "duration": i.duration} for i in items]
+
+    video_items = []
+    for cached in search_cache.cache.search(key, fetch):
+        item = MaterialInfo()
+        item.provider = cached["provider"]
+        item.url = cached["url"]
+        item.duration = cached["duration"]
+        video_items.append(item)
+    return video_items
+
+
+def search_videos_pexels(
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    return _cached_search(
+        _search_videos_pexels, "pexels", search_term, minimum_duration, video_aspect
+    )
+
+
+def search_videos_pixabay(
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    return _cached_search(
+        _search_videos_pixabay, "pixabay", search_term, minimum_duration, video_aspect
+    )
 
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
+
+@contextmanager
+def _path_lock(path: str):
+    with _path_locks_lock:
+        entry = _path_locks.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0], media_cache.cache.lock(path):
+            yield
+    finally:
+        with _path_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _path_locks[path]
+
+
+def _expected_size(response: requests.Response, offset: int) -> int:
+    # Tổng kích thước file theo Content-Range (206) hoặc Content-Length (200), 0 = không rõ
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else 0
+    length = response.headers.get("Content-Length", "")
+    if length.isdigit():
+        return int(length) + (offset if response.status_code == 206 else 0)
+    return 0
+
+
+def _download_to_part(video_url: str, part_path: str, cancel_event=None) -> bool:
+    """
+    Tải video theo từng khối vào file .part. Lỗi giữa chừng thì thử lại và
+    tải tiếp từ byte đã có bằng HTTP Range (kể cả .part còn lại từ lần chạy
+    trước). Trả về True khi đã tải đủ.
+    """
+    for attempt in range(1, _DOWNLOAD_ATTEMPTS + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with get_session().get(
+                video_url,
+                headers=headers,
+                proxies=config.proxy,
+                verify=False,
+                timeout=(60, 240),
+                stream=True,
+            ) as r:
+                if r.status_code == 416:
+                    # Range bắt đầu ở cuối file: .part đã đủ nếu kích thước
+                    # khớp với Content-Range "bytes */<tổng>"
+                    content_range = r.headers.get("Content-Range", "")
+                    if offset and content_range.startswith("bytes */") and _expected_size(r, offset) == offset:
+                        return True
+                    # Phần đã tải không khớp với file trên server: tải lại từ đầu
+                    os.remove(part_path)
+                    continue
+                r.raise_for_status()
+                if offset and r.status_code != 206:
+                    # Server không hỗ trợ Range: ghi đè từ đầu
+                    offset = 0
+                expected = _expected_size(r, offset)
+                if offset:
+                    logger.info(f"Tiếp tục tải video từ byte {offset}: {video_url}")
+                with open(part_path, "ab" if offset else "wb") as f:
+                    for chunk in r.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+                        if cancel_event is not None and cancel_event.is_set():
+                            # Giữ lại .part để lần sau tải tiếp
+                            logger.info(f"Dừng tải video: {video_url}")
+                            return False
+                        f.write(chunk)
+            size = os.path.getsize(part_path)
+            if expected and size != expected:
+                if size > expected:
+                    # Dư byte: .part hỏng, tải lại từ đầu ở lần thử sau
+                    os.remove(part_path)
+                raise IOError(f"nhận được {size}/{expected} byte")
+            return size > 0
+        except Exception as e:
+            if attempt >= _DOWNLOAD_ATTEMPTS:
+                raise
+            logger.warning(f"Tải video thất bại, thử: {attempt}, lỗi: {str(e)}")
+            time.sleep(attempt)
+    return False
+
+
+def _write_checksum(video_path: str, digest: str):
+    # Ghi sha256 của video vào file đi kèm: vid-xxx.mp4 -> vid-xxx.mp4.sha256
+    with open(f"{video_path}.sha256", "w", encoding="utf-8") as f:
+        f.write(f"{digest}  {os.path.basename(video_path)}\n")
+
+
+def save_video(video_url: str, save_dir: str = "", cancel_event=None) -> str:
+    """
+    Video luôn được tải vào kho media dùng chung (media_cache); nếu save_dir
+    là thư mục khác (ví dụ thư mục tác vụ) thì trả về hardlink trong save_dir.
+    """
+    video_path = _store_video(video_url, cancel_event)
+    if not video_path or not save_dir:
+        return video_path
+    if os.path.realpath(save_dir) == media_cache.cache.cache_dir:
+        return video_path
+    return media_cache.cache.link_into(video_path, save_dir)
+
+
+def _store_video(video_url: str, cancel_event=None) -> str:
+    save_dir = media_cache.cache.cache_dir
 
     url_without_query = video_url.split("?")[0]
     url_hash = utils.md5(url_without_query)
@@ -161,39 +344,41 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     # if video already exists, return the path
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         logger.info(f"Video đã tồn tại: {video_path}")
+        media_cache.cache.record_hit(video_path)
         return video_path
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
-    }
+    with _path_lock(video_path):
+        # Tác vụ khác vừa tải xong cùng video trong lúc chờ khóa
+        if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
+            logger.info(f"Video đã tồn tại: {video_path}")
+            media_cache.cache.record_hit(video_path)
+            return video_path
 
-    # if video does not exist, download it
-    with open(video_path, "wb") as f:
-        f.write(
-            requests.get(
-                video_url,
-                headers=headers,
-                proxies=config.proxy,
-                verify=False,
-                timeout=(60, 240),
-            ).content
-        )
+        part_path = f"{video_path}.part"
+        if not _download_to_part(video_url, part_path, cancel_event):
+            return ""
 
-    if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
-            clip = VideoFileClip(video_path)
+            clip = VideoFileClip(part_path)
             duration = clip.duration
             fps = clip.fps
             clip.close()
-            if duration > 0 and fps > 0:
-                return video_path
+            if not (duration > 0 and fps > 0):
+                raise ValueError(f"duration: {duration}, fps: {fps}")
         except Exception as e:
             try:
-                os.remove(video_path)
+                os.remove(part_path)
             except Exception:
                 pass
             logger.warning(f"Tệp video không hợp lệ: {video_path} => {str(e)}")
-    return ""
+            return ""
+
+        # Đổi tên nguyên tử: video_path chỉ xuất hiện khi đã tải đủ và hợp lệ
+        digest = media_cache.cache.commit(part_path, video_path)
+        if download_checksum:
+            _write_checksum(video_path, digest)
+        media_cache.cache.record_download(video_path)
+    return video_path
 
 
 def download_videos(
@@ -229,8 +414,6 @@ def download_videos(
     logger.info(
         f"Tổng số video tìm thấy: {len(valid_video_items)}, thời lượng yêu cầu: {audio_duration} giây, thời lượng tìm thấy: {found_duration} giây"
     )
-    video_paths = []
-
     material_directory = config.app.get("material_directory", "").strip()
     if material_directory == "task":
         material_directory = utils.task_dir(task_id)
@@ -240,25 +423,68 @@ def download_videos(
     if video_contact_mode.value == VideoConcatMode.random.value:
         random.shuffle(valid_video_items)
 
+    # Tải song song tối đa download_concurrency video theo thứ tự danh sách.
+    # Chỉ lên lịch thêm khi thời lượng đã tải cộng thời lượng đang tải chưa
+    # vượt thời lượng audio; đủ thời lượng thì hủy các video còn lại.
+    saved = {}  # vị trí trong danh sách -> đường dẫn video
     total_duration = 0.0
-    for item in valid_video_items:
-        try:
-            logger.info(f"Đang tải xuống video: {item.url}")
-            saved_video_path = save_video(
-                video_url=item.url, save_dir=material_directory
-            )
-            if saved_video_path:
-                logger.info(f"Video đã lưu: {saved_video_path}")
-                video_paths.append(saved_video_path)
+    pending_duration = 0.0
+    pending = {}
+    next_index = 0
+    cancel_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=download_concurrency)
+    try:
+        while True:
+            while (
+                next_index < len(valid_video_items)
+                and len(pending) < download_concurrency
+                and total_duration + pending_duration <= audio_duration
+            ):
+                item = valid_video_items[next_index]
+                logger.info(f"Đang tải xuống video: {item.url}")
+                future = executor.submit(
+                    save_video,
+                    video_url=item.url,
+                    save_dir=material_directory,
+                    cancel_event=cancel_event,
+                )
                 seconds = min(max_clip_duration, item.duration)
-                total_duration += seconds
-                if total_duration > audio_duration:
-                    logger.info(
-                        f"Tổng thời lượng video đã tải: {total_duration} giây, bỏ qua tải thêm"
-                    )
-                    break
-        except Exception as e:
-            logger.error(f"Tải xuống video thất bại: {utils.to_json(item)} => {str(e)}")
+                pending[future] = (next_index, item, seconds)
+                pending_duration += seconds
+                next_index += 1
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item, seconds = pending.pop(future)
+                pending_duration -= seconds
+                try:
+                    saved_video_path = future.result()
+                except Exception as e:
+                    logger.error(f"Tải xuống video thất bại: {utils.to_json(item)} => {str(e)}")
+                    continue
+                if saved_video_path:
+                    logger.info(f"Video đã lưu: {saved_video_path}")
+                    saved[index] = saved_video_path
+                    total_duration += seconds
+
+            if total_duration > audio_duration:
+                logger.info(
+                    f"Tổng thời lượng video đã tải: {total_duration} giây, bỏ qua tải thêm"
+                )
+                break
+    finally:
+        # Dừng các video đang tải dở mà không chờ: phần đã tải được giữ trong
+        # file .part để lần sau tải tiếp
+        cancel_event.set()
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Giữ thứ tự của danh sách (quan trọng với chế độ ghép tuần tự)
+    video_paths = [saved[index] for index in sorted(saved)]
     logger.success(f"Đã tải xuống {len(video_paths)} video")
     return video_paths
 
@@ -0,0 +1,387 @@
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ khóa trong process
+    fcntl = None
+
+from app.config import config
+from app.utils import utils
+
+
+# Kho video tài liệu dùng chung (storage/cache_videos hoặc material_directory):
+# mỗi mục là "vid-<md5 url>.mp4" cùng các file đi kèm (.sha256, .part), và
+# "by-hash/<sha256 nội dung>.mp4" là hardlink theo nội dung để hai URL của
+# cùng một video chỉ giữ một bản trên đĩa. Thư mục tác vụ nhận hardlink
+# (hoặc reflink) tới kho thay vì bản sao, nên xóa tác vụ chỉ xóa link.
+# ".locks/<tên>.lock" là file khóa (flock) giữa các process khi tải một mục.
+#
+# Thời điểm dùng gần nhất là mtime, được cập nhật mỗi lần dùng lại nên chia
+# sẻ được giữa các process. Sweeper chạy nền xóa mục ít dùng nhất tới khi
+# tổng dung lượng về dưới ngân sách, bỏ qua file đang được tác vụ trong
+# process ghim và file vừa dùng trong pin_seconds giây (tác vụ đang chạy ở
+# worker khác).
+class MediaCache:
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 0,
+        sweep_interval: int = 600,
+        pin_seconds: int = 3600,
+    ):
+        self.cache_dir = os.path.realpath(cache_dir)
+        self.max_bytes = max(0, int(max_bytes))  # 0 = không giới hạn
+        self.sweep_interval = max(1, int(sweep_interval))
+        self.pin_seconds = max(0, int(pin_seconds))
+
+        self._lock = threading.Lock()
+        self._pins = {}  # đường dẫn -> số tác vụ đang dùng
+        self._stop = threading.Event()
+        self._thread = None
+        self.size_bytes = None  # tính ở lần quét đầu tiên
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.deduplicated = 0
+        self.bytes_deduplicated = 0
+        self.hash_dir = os.path.join(self.cache_dir, "by-hash")
+        os.makedirs(self.hash_dir, exist_ok=True)
+        self.lock_dir = os.path.join(self.cache_dir, ".locks")
+
+    def manages(self, path: str) -> bool:
+        return os.path.dirname(os.path.realpath(path)) == self.cache_dir
+
+    def record_hit(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            # cập nhật mtime để mục vừa dùng bị xóa sau cùng
+            os.utime(path)
+        except OSError:
+            return
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+
+    def record_download(self, path: str):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            self.misses += 1
+            self.bytes_downloaded += size
+            if self.size_bytes is not None and self.manages(path):
+                self.size_bytes += size
+
+    def commit(self, part_path: str, video_path: str) -> str:
+        """
+        Đưa file đã tải xong (part_path) vào kho dưới tên video_path. Nếu kho
+        đã có video cùng nội dung (URL khác) thì video_path trỏ tới bản đó và
+        part_path bị xóa. Trả về sha256 của nội dung.
+        """
+        digest = file_sha256(part_path)
+        blob_path = os.path.join(self.hash_dir, f"{digest}.mp4")
+        try:
+            if os.path.exists(blob_path):
+                size = os.path.getsize(part_path)
+                tmp_path = f"{video_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                os.link(blob_path, tmp_path)
+                os.replace(tmp_path, video_path)
+                os.remove(part_path)
+                with self._lock:
+                    self.deduplicated += 1
+                    self.bytes_deduplicated += size
+                logger.info(f"Video trùng nội dung với {blob_path}, dùng lại bản trong kho")
+                return digest
+        except OSError as e:
+            logger.warning(f"Không thể dùng lại video trùng nội dung: {str(e)}")
+
+        os.replace(part_path, video_path)
+        try:
+            os.link(video_path, blob_path)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            logger.warning(f"Không thể tạo hardlink theo nội dung: {str(e)}")
+        return digest
+
+    def link_into(self, path: str, target_dir: str) -> str:
+        """
+        Tạo bản của video trong kho vào thư mục tác vụ: hardlink, nếu không
+        được (khác ổ đĩa...) thì reflink, cuối cùng mới sao chép.
+        """
+        os.makedirs(target_dir, exist_ok=True)
+        target_path = os.path.join(target_dir, os.path.basename(path))
+        if os.path.exists(target_path) and os.path.getsize(target_path) > 0:
+            return target_path
+        tmp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            if not _reflink(path, tmp_path):
+                shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target_path)
+        return target_path
+
+    @contextmanager
+    def lock(self, path: str):
+        """
+        Khóa độc quyền giữa các process (worker, nhiều process uvicorn) cho
+        một mục của kho, ví dụ trong lúc tải vào file .part của nó.
+        """
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        lock_path = os.path.join(self.lock_dir, f"{os.path.basename(path)}.lock")
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # File khóa bị sweeper dọn trong lúc chờ: khóa lại trên file mới
+                if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+        try:
+            yield
+        finally:
+            os.close(fd)
+
+    def _remove_stale_locks(self):
+        # File khóa không ai giữ và lâu không dùng
+        if fcntl is None or not os.path.isdir(self.lock_dir):
+            return
+        recent = time.time() - self.pin_seconds
+        for name in os.listdir(self.lock_dir):
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if os.path.getmtime(path) >= recent:
+                    continue
+                fd = os.open(path, os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+    @contextmanager
+    def pin(self, paths: List[str] = ()):
+        """
+        Ghim các file trong lúc tác vụ dùng chúng để sweeper không xóa.
+        Trả về hàm add(paths) để ghim thêm file (ví dụ ngay khi tải xong),
+        mọi file đã ghim được bỏ ghim khi ra khỏi khối with.
+        """
+        held = []
+
+        def add(more: List[str]):
+            more = [os.path.realpath(p) for p in more if p]
+            with self._lock:
+                for path in more:
+                    self._pins[path] = self._pins.get(path, 0) + 1
+                held.extend(more)
+
+        add(paths)
+        try:
+            yield add
+        finally:
+            with self._lock:
+                for path in held:
+                    self._pins[path] -= 1
+                    if self._pins[path] <= 0:
+                        del self._pins[path]
+
+    def _entries(self):
+        # Gom file chính và file đi kèm theo tên mục: vid-xxx.mp4(.sha256|.part).
+        # Các URL cùng nội dung dùng chung một inode nên được gom thành một mục.
+        files = []
+        for name in os.listdir(self.cache_dir):
+            # material_directory có thể chứa file khác: chỉ quản lý video do save_video tải về
+            if not name.startswith("vid-"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                files.append((name, path, stat))
+
+        keys = {}
+        for name, _, stat in files:
+            if name.endswith(".mp4"):
+                keys[name[: -len(".mp4")]] = (stat.st_dev, stat.st_ino)
+
+        entries = {}
+        inodes = set()
+        for name, path, stat in files:
+            entry_name = name.split(".mp4", 1)[0]
+            key = keys.get(entry_name, entry_name)
+            entry = entries.setdefault(key, {"paths": [], "size": 0, "last_used": 0})
+            entry["paths"].append(path)
+            if (stat.st_dev, stat.st_ino) not in inodes:
+                inodes.add((stat.st_dev, stat.st_ino))
+                entry["size"] += stat.st_size
+            if not name.endswith(".sha256"):
+                # mtime của file checksum không đổi khi video được dùng lại
+                entry["last_used"] = max(entry["last_used"], stat.st_mtime)
+        return list(entries.values())
+
+    def _remove_orphans(self):
+        # Bản theo nội dung không còn tên URL hay thư mục tác vụ nào trỏ tới
+        for name in os.listdir(self.hash_dir):
+            path = os.path.join(self.hash_dir, name)
+            try:
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def sweep(self) -> int:
+        """Xóa mục ít dùng nhất tới 90% ngân sách, trả về số byte đã xóa."""
+        self._remove_orphans()
+        self._remove_stale_locks()
+        entries = self._entries()
+        size = sum(e["size"] for e in entries)
+        with self._lock:
+            self.size_bytes = size
+            pinned = set(self._pins)
+        if not self.max_bytes or size <= self.max_bytes:
+            return 0
+
+        target = self.max_bytes * 0.9
+        recent = time.time() - self.pin_seconds
+        removed = 0
+        for entry in sorted(entries, key=lambda e: e["last_used"]):
+            if size <= target:
+                break
+            if entry["last_used"] >= recent or pinned.intersection(entry["paths"]):
+                continue
+            for path in entry["paths"]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            size -= entry["size"]
+            removed += entry["size"]
+            with self._lock:
+                self.evicted += 1
+                self.evicted_bytes += entry["size"]
+
+        self._remove_orphans()
+        with self._lock:
+            self.size_bytes = size
+        if size > self.max_bytes:
+            logger.warning(
+                f"Cache video vẫn vượt ngân sách sau khi dọn: {size} / {self.max_bytes} byte (các file còn lại đang được dùng)"
+            )
+        logger.info(f"Đã dọn cache video: xóa {removed} byte, còn {size} byte")
+        return removed
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Dọn cache video thất bại: {str(e)}")
+            if self._stop.wait(self.sweep_interval):
+                return
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._sweep_loop, name="media-cache-sweeper", daemon=True
+            )
+            self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "cache_dir": self.cache_dir,
+                "max_bytes": self.max_bytes,
+                "size_bytes": self.size_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / requests, 3) if requests else None,
+                "bytes_saved": self.bytes_saved,
+                "bytes_downloaded": self.bytes_downloaded,
+                "evicted": self.evicted,
+                "evicted_bytes": self.evicted_bytes,
+                "deduplicated": self.deduplicated,
+                "bytes_deduplicated": self.bytes_deduplicated,
+                "pinned": len(self._pins),
+            }
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _reflink(src: str, dst: str) -> bool:
+    # Reflink (copy-on-write) qua ioctl FICLONE, chỉ có trên Linux với btrfs/xfs
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+
+    FICLONE = 0x40049409
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def cache_dir() -> str:
+    # Cùng quy tắc với material.download_videos: material_directory nếu là thư mục hợp lệ
+    material_directory = config.app.get("material_directory", "").strip()
+    if material_directory and material_directory != "task" and os.path.isdir(material_directory):
+        return material_directory
+    return utils.storage_dir("cache_videos", create=True)
+
+
+cache = MediaCache(
+    cache_dir=cache_dir(),
+    max_bytes=int(config.app.get("material_cache_max_mb", 0)) * 1024 * 1024,
+    sweep_interval=config.app.get("material_cache_sweep_interval", 600),
+    pin_seconds=config.app.get("material_cache_pin_seconds", 3600),
+)
+
+
+def start():
+    """Chạy sweeper nền khi khởi động API hoặc worker nếu có ngân sách dung lượng."""
+    if cache.max_bytes:
+        cache.start()
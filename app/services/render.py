@@ -0,0 +1,143 @@
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from loguru import logger
+
+from app.config import config
+from app.services import stage
+
+# Các stage render nặng CPU (tên hàm trong app.services.video).
+# Khi render_mode = "process", chúng chạy trong process pool riêng để không
+# tranh chấp GIL với API và các tác vụ khác.
+RENDER_FUNCS = ("combine_videos", "generate_video")
+
+render_mode = config.app.get("render_mode", "process").strip().lower()
+# Số process tối đa; số render chạy thực sự do stage.render_pool quyết định
+render_workers = int(config.app.get("render_workers", 0) or os.cpu_count() or 2)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Tiến độ render từ process con gửi về qua một queue dùng chung:
+# (call_id, info) -> callback của lần gọi run tương ứng
+_progress_manager = None
+_progress_queue = None
+_progress_callbacks = {}
+_progress_ids = itertools.count(1)
+
+
+def _run_in_child(func_name: str, kwargs: dict, progress=None):
+    # Chạy trong process con: import video tại đây để process cha không cần
+    # nạp moviepy chỉ để gửi tác vụ.
+    from app.services import video
+
+    if progress is not None:
+        if callable(progress):
+            callback = progress
+        else:
+            queue, call_id = progress
+            callback = lambda info: queue.put((call_id, info))  # noqa: E731
+        kwargs = dict(kwargs, progress_logger=video.RenderProgressLogger(callback))
+    return getattr(video, func_name)(**kwargs)
+
+
+def _dispatch_progress(queue):
+    while True:
+        try:
+            call_id, info = queue.get()
+        except (EOFError, OSError):
+            # Manager đã bị tắt trong shutdown()
+            return
+        callback = _progress_callbacks.get(call_id)
+        if callback is None:
+            continue
+        try:
+            callback(info)
+        except Exception as e:
+            logger.warning(f"Xử lý tiến độ render thất bại: {str(e)}")
+
+
+def _get_progress_queue():
+    global _progress_manager, _progress_queue
+    with _pool_lock:
+        if _progress_queue is None:
+            # Queue của Manager pickle được nên truyền được vào process con spawn
+            _progress_manager = multiprocessing.get_context("spawn").Manager()
+            _progress_queue = _progress_manager.Queue()
+            threading.Thread(
+                target=_dispatch_progress, args=(_progress_queue,), daemon=True
+            ).start()
+        return _progress_queue
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # "spawn" để process con không kế thừa lock/thread của uvicorn
+            ctx = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=render_workers, mp_context=ctx)
+            logger.info(f"Khởi tạo render process pool, số worker: {render_workers}")
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def run(func_name: str, cost: tuple = (1, 0), on_progress=None, **kwargs):
+    """
+    Chạy một stage render và trả về kết quả (đường dẫn file đầu ra).
+    Tham số và đường dẫn artifact phải pickle được để truyền giữa các process.
+    cost: (số core, MB bộ nhớ) ước tính, xem stage.estimate_render_cost.
+    on_progress: callback({"frame", "total", "fps"}) gọi trong process cha.
+    """
+    if func_name not in RENDER_FUNCS:
+        raise ValueError(f"Stage render không hợp lệ: {func_name}")
+
+    cores, memory_mb = cost
+    with stage.render_pool.slot(cores=cores, memory_mb=memory_mb):
+        return _run(func_name, kwargs, on_progress)
+
+
+def _run(func_name: str, kwargs: dict, on_progress=None):
+    if render_mode != "process":
+        return _run_in_child(func_name, kwargs, on_progress)
+
+    progress = None
+    if on_progress is not None:
+        call_id = next(_progress_ids)
+        _progress_callbacks[call_id] = on_progress
+        progress = (_get_progress_queue(), call_id)
+
+    pool = get_pool()
+    try:
+        return pool.submit(_run_in_child, func_name, kwargs, progress).result()
+    except BrokenProcessPool:
+        # Process con bị kill (ví dụ OOM): tạo lại pool cho các tác vụ sau
+        logger.error(f"Render process pool bị hỏng khi chạy {func_name}, khởi tạo lại")
+        _reset_pool(pool)
+        raise
+    finally:
+        if progress is not None:
+            _progress_callbacks.pop(progress[1], None)
+
+
+def shutdown():
+    global _pool, _progress_manager, _progress_queue
+    with _pool_lock:
+        pool, _pool = _pool, None
+        manager, _progress_manager, _progress_queue = _progress_manager, None, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if manager is not None:
+        # Dừng server process của Manager (đã khởi động cùng queue tiến độ)
+        manager.shutdown()
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+
+# Cache kết quả tìm kiếm video (Pexels/Pixabay) có TTL, key = sha256 của
+# (provider, từ khóa đã chuẩn hóa, tỷ lệ khung hình, thời lượng tối thiểu).
+# Các tác vụ cùng tìm một từ khóa chỉ gửi một request (single-flight): trong
+# một process qua Future dùng chung, giữa các worker qua khóa Redis.
+class SearchCache(ABC):
+    def __init__(self, ttl: int):
+        self.ttl = max(1, int(ttl))
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future của lần tìm kiếm đang chạy
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # số lần dùng lại kết quả của lần tìm kiếm đang chạy
+
+    @staticmethod
+    def make_key(provider: str, search_term: str, video_aspect: str, minimum_duration: int) -> str:
+        raw = json.dumps(
+            [provider, " ".join(search_term.lower().split()), video_aspect, int(minimum_duration)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @abstractmethod
+    def get(self, key: str):
+        pass
+
+    @abstractmethod
+    def set(self, key: str, items: list):
+        pass
+
+    def _fetch(self, key: str, search):
+        return search()
+
+    def search(self, key: str, search) -> list:
+        """
+        search: hàm không tham số gọi provider, trả về list dict có thể ghi JSON.
+        Kết quả rỗng (không tìm thấy hoặc lỗi) không được lưu cache.
+        """
+        items = self.get(key)
+        if items is not None:
+            with self._lock:
+                self.hits += 1
+            return items
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.shared += 1
+        if not owner:
+            return future.result()
+
+        try:
+            items = self._fetch(key, search)
+            if items:
+                self.set(key, items)
+            future.set_result(items)
+            return items
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "inflight": len(self._inflight),
+            }
+
+
+class DiskSearchCache(SearchCache):
+    backend = "disk"
+
+    def __init__(self, cache_dir: str, ttl: int):
+        super().__init__(ttl)
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        # Xóa mục hết hạn khi khởi động và sau đó tối đa một lần mỗi TTL (trong set)
+        self._last_purge = 0.0
+        self._maybe_purge()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, items: list):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Ghi cache tìm kiếm thất bại: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._maybe_purge()
+
+    def _maybe_purge(self):
+        with self._lock:
+            now = time.time()
+            if now - self._last_purge < self.ttl:
+                return
+            self._last_purge = now
+        try:
+            removed = self.purge()
+        except OSError as e:
+            logger.warning(f"Dọn cache tìm kiếm thất bại: {str(e)}")
+            return
+        if removed:
+            logger.info(f"Đã xóa {removed} mục cache tìm kiếm hết hạn")
+
+    def purge(self) -> int:
+        # Xóa các mục đã hết hạn
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+class RedisSearchCache(SearchCache):
+    backend = "redis"
+
+    # Xóa khóa chỉ khi giá trị vẫn là token của mình. KEYS: khóa; ARGV: token
+    _LUA_UNLOCK = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        db: int,
+        password: str,
+        ttl: int,
+        prefix: str = "search",
+        lock_timeout: int = 90,
+    ):
+        super().__init__(ttl)
+        import redis # Import redis ở đây để tránh lỗi nếu redis không được cài đặt và không dùng
+
+        self._redis = redis.StrictRedis(host=host, port=port, db=db, password=password)
+        self._prefix = prefix
+        self._unlock = self._redis.register_script(self._LUA_UNLOCK)
+        # Lâu hơn thời gian chờ tối đa của một lần tìm kiếm (timeout=(30, 60))
+        self.lock_timeout = lock_timeout
+
+    def _key(self, key: str) -> str:
+        return f"{self._prefix}:{key}"
+
+    def get(self, key: str):
+        try:
+            value = self._redis.get(self._key(key))
+        except Exception as e:
+            logger.warning(f"Đọc cache tìm kiếm từ Redis thất bại: {str(e)}")
+            return None
+        return json.loads(value) if value else None
+
+    def set(self, key: str, items: list):
+        try:
+            self._redis.set(self._key(key), json.dumps(items, ensure_ascii=False), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Ghi cache tìm kiếm vào Redis thất bại: {str(e)}")
+
+    def _fetch(self, key: str, search):
+        # Single-flight giữa các worker: worker giữ khóa gọi provider, các
+        # worker khác chờ kết quả xuất hiện trong cache hoặc khóa được trả.
+        lock_key = f"{self._key(key)}:lock"
+        token = utils.get_uuid(remove_hyphen=True)
+        try:
+            acquired = self._redis.set(lock_key, token, nx=True, ex=self.lock_timeout)
+        except Exception as e:
+            logger.warning(f"Lấy khóa tìm kiếm trên Redis thất bại: {str(e)}")
+            return search()
+
+        if not acquired:
+            deadline = time.time() + self.lock_timeout
+            while time.time() < deadline:
+                time.sleep(0.5)
+                items = self.get(key)
+                if items is not None:
+                    with self._lock:
+                        self.shared += 1
+                    return items
+                if not self._redis.exists(lock_key):
+                    break
+            return search()
+
+        try:
+            return search()
+        finally:
+            # Chỉ xóa khóa của chính mình (khóa có thể đã hết hạn và bị worker
+            # khác lấy), so sánh và xóa trong một lệnh Lua
+            try:
+                self._unlock(keys=[lock_key], args=[token])
+            except Exception as e:
+                logger.warning(f"Trả khóa tìm kiếm trên Redis thất bại: {str(e)}")
+
+
+cache = None
+if config.app.get("search_cache_enabled", True):
+    _ttl = config.app.get("search_cache_ttl", 21600)
+    if config.app.get("enable_redis", False):
+        cache = RedisSearchCache(
+            host=config.app.get("redis_host", "localhost"),
+            port=config.app.get("redis_port", 6379),
+            db=config.app.get("redis_db", 0),
+            password=config.app.get("redis_password", None),
+            ttl=_ttl,
+        )
+    else:
+        cache = DiskSearchCache(
+            cache_dir=config.app.get("search_cache_dir", "") or utils.storage_dir("cache_search", create=True),
+            ttl=_ttl,
+        )
@@ -0,0 +1,218 @@
+import functools
+import os
+import threading
+from contextlib import contextmanager
+
+from loguru import logger
+
+from app.config import config
+from app.models.schema import VideoAspect
+
+
+# Pool giới hạn số stage I/O (LLM, TTS, tải tài liệu...) chạy đồng thời
+class StagePool:
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = max(1, int(size))
+        self._semaphore = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            self.waiting += 1
+        self._semaphore.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": self.size,
+                "active": self.active,
+                "waiting": self.waiting,
+            }
+
+
+# Chỗ tác vụ (max_concurrent_tasks) của thread đang chạy tác vụ: trong lúc
+# chờ hoặc chạy stage render, tác vụ trả chỗ để tác vụ khác được nhận và chạy
+# các stage I/O (LLM, TTS, tải tài liệu) thay vì chờ sau hàng đợi render.
+_task = threading.local()
+
+
+@contextmanager
+def task_slot(release, reacquire):
+    """
+    Gắn chỗ tác vụ cho thread hiện tại. release(): trả chỗ khi vào
+    render_pool; reacquire(): lấy lại chỗ (không chờ) khi render xong, nên
+    số tác vụ có thể tạm vượt giới hạn với các tác vụ vừa render xong.
+    """
+    _task.slot = (release, reacquire)
+    try:
+        yield
+    finally:
+        _task.slot = None
+
+
+@contextmanager
+def _task_slot_released():
+    slot = getattr(_task, "slot", None)
+    if slot is None:
+        yield
+        return
+    release, reacquire = slot
+    # render lồng nhau (Whisper trong render...) chỉ trả chỗ một lần
+    _task.slot = None
+    release()
+    try:
+        yield
+    finally:
+        reacquire()
+        _task.slot = slot
+
+
+class TaskSlots:
+    """Số tác vụ worker nhận đồng thời, hỗ trợ lấy lại chỗ không chờ (task_slot)."""
+
+    def __init__(self, size: int):
+        self.size = max(1, int(size))
+        self._cond = threading.Condition()
+        self.active = 0
+
+    def acquire(self, timeout: float = None) -> bool:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.active < self.size, timeout):
+                return False
+            self.active += 1
+            return True
+
+    def reacquire(self):
+        with self._cond:
+            self.active += 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+# Admission cho stage render dựa trên số core và bộ nhớ còn trống
+class ResourcePool:
+    def __init__(self, name: str, cores: int, memory_mb: int = 0):
+        self.name = name
+        self.cores = max(1, int(cores))
+        self.memory_mb = max(0, int(memory_mb))  # 0 = không giới hạn bộ nhớ
+        self._cond = threading.Condition()
+        self.used_cores = 0
+        self.used_memory_mb = 0
+        self.active = 0
+        self.waiting = 0
+
+    def _fits(self, cores: int, memory_mb: int) -> bool:
+        # Luôn cho phép một job chạy khi pool trống, kể cả khi ước tính vượt
+        # ngân sách, để job lớn không bị chờ mãi mãi.
+        if self.active == 0:
+            return True
+        if self.used_cores + cores > self.cores:
+            return False
+        if self.memory_mb and self.used_memory_mb + memory_mb > self.memory_mb:
+            return False
+        return True
+
+    @contextmanager
+    def slot(self, cores: int = 1, memory_mb: int = 0):
+        with _task_slot_released(), self._slot(cores, memory_mb):
+            yield
+
+    @contextmanager
+    def _slot(self, cores: int, memory_mb: int):
+        cores = max(1, min(int(cores), self.cores))
+        memory_mb = max(0, int(memory_mb))
+        with self._cond:
+            self.waiting += 1
+            if not self._fits(cores, memory_mb):
+                logger.info(
+                    f"Pool {self.name} đã đầy, chờ tài nguyên: {cores} core, {memory_mb} MB"
+                )
+            self._cond.wait_for(lambda: self._fits(cores, memory_mb))
+            self.waiting -= 1
+            self.active += 1
+            self.used_cores += cores
+            self.used_memory_mb += memory_mb
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self.used_cores -= cores
+                self.used_memory_mb -= memory_mb
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "name": self.name,
+                "cores": self.cores,
+                "memory_mb": self.memory_mb,
+                "used_cores": self.used_cores,
+                "used_memory_mb": self.used_memory_mb,
+                "active": self.active,
+                "waiting": self.waiting,
+            }
+
+
+def _total_memory_mb() -> int:
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 / 1024)
+    except (AttributeError, ValueError, OSError):
+        # Windows không có sysconf: không giới hạn theo bộ nhớ
+        return 0
+
+
+def estimate_render_cost(
+    video_aspect: VideoAspect, duration: float, threads: int = 2, clip_duration: int = 5
+):
+    """
+    Ước tính (số core, MB bộ nhớ) cho một lần render từ độ phân giải và thời lượng.
+    - moviepy/ffmpeg giữ khoảng vài chục frame RGB trong bộ đệm
+    - mỗi subclip mở một reader ffmpeg riêng
+    """
+    width, height = VideoAspect(video_aspect).to_resolution()
+    frame_mb = width * height * 3 / 1024 / 1024
+    readers = max(1, int(duration / max(1, clip_duration or 1)) + 1)
+    memory_mb = 256 + frame_mb * 40 + readers * 24
+    return max(1, int(threads or 1)), int(memory_mb)
+
+
+_cpu_count = os.cpu_count() or 2
+_max_concurrent_tasks = config.app.get("max_concurrent_tasks", 5)
+
+max_io_stages = int(config.app.get("max_io_stages", 0) or _max_concurrent_tasks)
+render_cores = int(config.app.get("render_cores", 0) or _cpu_count)
+render_memory_mb = int(
+    config.app.get("render_memory_mb", 0) or _total_memory_mb() * 0.8
+)
+
+io_pool = StagePool("io", max_io_stages)
+render_pool = ResourcePool("render", render_cores, render_memory_mb)
+
+
+def io_stage(func):
+    """Decorator: chạy stage trong io_pool."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with io_pool.slot():
+            return func(*args, **kwargs)
+
+    return wrapper
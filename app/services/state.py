@@ -1,12 +1,55 @@
 import ast
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from loguru import logger
 
 from app.config import config
 from app.models import const # Đảm bảo import const
+from app.utils import utils
+
+
+# Đếm số lần thay đổi của từng task trong process, dùng cho stream tiến độ
+# (SSE/WebSocket) để biết khi nào cần đọc lại task mà không phải poll backend.
+class TaskNotifier:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def notify(self, task_id: str):
+        with self._lock:
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+
+    def version(self, task_id: str) -> int:
+        with self._lock:
+            return self._versions.get(task_id, 0)
+
+    def notify_all(self):
+        with self._lock:
+            for task_id in self._versions:
+                self._versions[task_id] += 1
+
+    def forget(self, task_id: str):
+        with self._lock:
+            self._versions.pop(task_id, None)
 
 
 # Lớp cơ sở cho quản lý trạng thái
 class BaseState(ABC):
+    _notifier = None
+
+    def task_version(self, task_id: str) -> int:
+        """Số lần task thay đổi mà process này được biết, tăng sau mỗi cập nhật."""
+        if self._notifier is None:
+            return 0
+        return self._notifier.version(task_id)
+
     @abstractmethod
     def update_task(self, task_id: str, state: int, progress: int = 0, **kwargs):
         pass
@@ -16,7 +59,7 @@ class BaseState(ABC):
         pass
 
     @abstractmethod
-    def get_all_tasks(self, page: int, page_size: int):
+    def get_all_tasks(self, page: int, page_size: int, state: int = None):
         pass
     
     @abstractmethod
@@ -25,16 +68,51 @@ class BaseState(ABC):
 
 
 # Quản lý trạng thái trong bộ nhớ
+# Task đã hoàn thành/thất bại bị xóa sau ttl giây, hoặc sớm hơn (cũ nhất trước)
+# khi số task vượt quá max_tasks. Task đang xử lý không bao giờ bị xóa.
 class MemoryState(BaseState):
-    def __init__(self):
-        self._tasks = {} # Từ điển để lưu trữ các tác vụ
-
-    def get_all_tasks(self, page: int, page_size: int):
+    def __init__(self, max_tasks: int = 0, ttl: float = 0):
+        self._tasks = OrderedDict() # Từ điển lưu các tác vụ theo thứ tự tạo
+        self._finished = OrderedDict() # task_id -> thời điểm kết thúc, theo thứ tự kết thúc
+        self._max_tasks = max_tasks # 0 = không giới hạn
+        self._ttl = ttl # 0 = không hết hạn
+        self._lock = threading.RLock()
+        self._notifier = TaskNotifier()
+        self.evicted_ttl = 0
+        self.evicted_size = 0
+
+    def _evict(self):
+        if self._ttl:
+            expire_before = time.time() - self._ttl
+            while self._finished:
+                task_id, finished_at = next(iter(self._finished.items()))
+                if finished_at > expire_before:
+                    break
+                self._finished.popitem(last=False)
+                self._tasks.pop(task_id, None)
+                self._notifier.forget(task_id)
+                self.evicted_ttl += 1
+
+        if self._max_tasks:
+            while len(self._tasks) > self._max_tasks and self._finished:
+                task_id, _ = self._finished.popitem(last=False)
+                self._tasks.pop(task_id, None)
+                self._notifier.forget(task_id)
+                self.evicted_size += 1
+
+    def get_all_tasks(self, page: int, page_size: int, state: int = None):
         start = (page - 1) * page_size
         end = start + page_size
-        tasks = list(self._tasks.values())
-        total = len(tasks)
-        return tasks[start:end], total
+        with self._lock:
+            self._evict()
+            if state is None:
+                total = len(self._tasks)
+                tasks = list(itertools.islice(self._tasks.values(), start, end))
+            else:
+                matched = [t for t in self._tasks.values() if t.get("state") == state]
+                total = len(matched)
+                tasks = matched[start:end]
+        return tasks, total
 
     def update_task(
         self,
@@ -47,85 +125,213 @@ class MemoryState(BaseState):
         if progress > 100:
             progress = 100
 
-        self._tasks[task_id] = {
-            "task_id": task_id,
-            "state": state,
-            "progress": progress,
-            **kwargs,
-        }
+        with self._lock:
+            self._tasks[task_id] = {
+                "task_id": task_id,
+                "state": state,
+                "progress": progress,
+                **kwargs,
+            }
+            if state in (const.TASK_STATE_COMPLETE, const.TASK_STATE_FAILED):
+                self._finished.pop(task_id, None)
+                self._finished[task_id] = time.time()
+            else:
+                self._finished.pop(task_id, None)
+            self._evict()
+        self._notifier.notify(task_id)
 
     def get_task(self, task_id: str):
-        return self._tasks.get(task_id, None)
+        with self._lock:
+            self._evict()
+            return self._tasks.get(task_id, None)
 
     def delete_task(self, task_id: str):
-        if task_id in self._tasks:
-            del self._tasks[task_id]
+        with self._lock:
+            self._tasks.pop(task_id, None)
+            self._finished.pop(task_id, None)
+        # Bỏ bộ đếm của task đã xóa; version về 0 nên stream đang chờ vẫn
+        # thấy thay đổi và đọc lại
+        self._notifier.forget(task_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tasks": len(self._tasks),
+                "finished": len(self._finished),
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_size": self.evicted_size,
+            }
 
 
 # Quản lý trạng thái Redis
+# - mỗi task là một hash "{prefix}:{task_id}"
+# - "{prefix}s:created": sorted set task_id theo thời điểm tạo, dùng để phân trang
+# - "{prefix}s:state:{state}": sorted set task_id theo trạng thái
+# - "{prefix}s:events": kênh pub/sub, mỗi lần task thay đổi publish "{process}:{task_id}"
+# Giá trị được lưu dạng JSON; mỗi lần cập nhật chỉ gửi các trường thay đổi
+# trong một script Lua, cập nhật chỉ có progress được gộp theo progress_interval.
 class RedisState(BaseState):
-    def __init__(self, host="localhost", port=6379, db=0, password=None):
+    # Số task tối đa giữ bản ghi giá trị đã ghi (để tính delta) trong process
+    _written_cache_size = 1024
+    # Thời gian chờ (giây) trước khi kết nối lại pub/sub: ban đầu, tối đa
+    _listen_backoff = (0.5, 30.0)
+
+    # Đọc state cũ, ghi hash và chuyển task giữa các chỉ mục trạng thái trong
+    # một lệnh nguyên tử, vì API, worker và requeue cùng ghi một task.
+    # Mọi key được truyền qua KEYS (không ghép tên key trong Lua) để chạy được
+    # trên Redis Cluster; khi đó prefix cần có hash tag, ví dụ "{task}".
+    # KEYS: hash của task, chỉ mục created, các chỉ mục trạng thái
+    # ARGV: task_id, thời điểm, tiền tố chỉ mục trạng thái, kênh sự kiện, nội dung sự kiện, field, value, ...
+    _LUA_STATE_KEY = """
+        local function state_key(prefix, state)
+            local name = prefix .. state
+            for i = 3, #KEYS do
+                if KEYS[i] == name then
+                    return KEYS[i]
+                end
+            end
+        end
+    """
+    _LUA_UPDATE = _LUA_STATE_KEY + """
+        local old = redis.call('HGET', KEYS[1], 'state')
+        redis.call('HSET', KEYS[1], unpack(ARGV, 6))
+        redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[1])
+        local new = redis.call('HGET', KEYS[1], 'state')
+        if old and old ~= new and state_key(ARGV[3], old) then
+            redis.call('ZREM', state_key(ARGV[3], old), ARGV[1])
+        end
+        if state_key(ARGV[3], new) then
+            redis.call('ZADD', state_key(ARGV[3], new), 'NX', ARGV[2], ARGV[1])
+        end
+        redis.call('PUBLISH', ARGV[4], ARGV[5])
+    """
+    # KEYS: hash của task, chỉ mục created, các chỉ mục trạng thái
+    # ARGV: task_id, tiền tố chỉ mục trạng thái, kênh sự kiện, nội dung sự kiện
+    _LUA_DELETE = _LUA_STATE_KEY + """
+        local old = redis.call('HGET', KEYS[1], 'state')
+        redis.call('DEL', KEYS[1])
+        redis.call('ZREM', KEYS[2], ARGV[1])
+        if old and state_key(ARGV[2], old) then
+            redis.call('ZREM', state_key(ARGV[2], old), ARGV[1])
+        end
+        redis.call('PUBLISH', ARGV[3], ARGV[4])
+    """
+    # Các trạng thái có chỉ mục; state khác được ghi sẽ được thêm khi gọi script
+    _STATES = (const.TASK_STATE_FAILED, const.TASK_STATE_COMPLETE, const.TASK_STATE_PROCESSING)
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        password=None,
+        prefix="task",
+        progress_interval=1.0,
+    ):
         import redis # Import redis ở đây để tránh lỗi nếu redis không được cài đặt và không dùng
 
         self._redis = redis.StrictRedis(host=host, port=port, db=db, password=password)
+        self._prefix = prefix
+        self._progress_interval = progress_interval
+        self._lock = threading.Lock()
+        # task_id -> {field: giá trị đã mã hóa} đã ghi lên Redis bởi process này
+        self._written = OrderedDict()
+        # task_id -> thời điểm ghi progress gần nhất
+        self._progress_written_at = {}
+        # task_id -> progress (đã mã hóa) chờ ghi khi hết progress_interval
+        self._pending_progress = {}
+        self._notifier = TaskNotifier()
+        # Định danh process trong sự kiện, để bỏ qua sự kiện do chính mình ghi
+        self._origin = uuid.uuid4().hex
+        self._update_script = self._redis.register_script(self._LUA_UPDATE)
+        self._delete_script = self._redis.register_script(self._LUA_DELETE)
+
+        # Nghe sự kiện ngay từ đầu: cache _written phải được làm mới khi
+        # process khác ghi task, không chỉ khi có stream tiến độ
+        self._listener = threading.Thread(target=self._listen_events, daemon=True)
+        self._listener.start()
+        # progress_interval <= 0: không gộp progress nên không cần luồng ghi
+        if self._progress_interval > 0:
+            flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            flusher.start()
+
+    def _task_key(self, task_id: str):
+        return f"{self._prefix}:{task_id}"
+
+    @property
+    def _events_channel(self):
+        return f"{self._prefix}s:events"
+
+    def _event(self, task_id: str) -> str:
+        return f"{self._origin}:{task_id}"
+
+    def _listen_events(self):
+        # Một kết nối pub/sub cho cả process, nhận thay đổi từ mọi worker.
+        # Mất kết nối thì đăng ký lại, chờ lâu dần giữa các lần thử.
+        delay, max_delay = self._listen_backoff
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self._events_channel)
+                self._resync()
+                delay = self._listen_backoff[0]
+                for message in pubsub.listen():
+                    self._on_event(message["data"].decode("utf-8"))
+            except Exception as e:
+                logger.warning(f"Mất kết nối pub/sub Redis: {e}, kết nối lại sau {delay}s")
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    def _resync(self):
+        # Có thể đã lỡ sự kiện trong lúc chưa đăng ký: bỏ cache delta và báo
+        # mọi task đã thay đổi để stream tiến độ đọc lại
+        with self._lock:
+            self._written.clear()
+        self._notifier.notify_all()
+
+    def _on_event(self, data: str):
+        origin, _, task_id = data.partition(":")
+        if origin != self._origin:
+            # Process khác đã ghi task: giá trị trong cache có thể đã cũ, lần
+            # cập nhật sau của process này phải ghi đầy đủ thay vì tính delta
+            with self._lock:
+                self._written.pop(task_id, None)
+        self._notifier.notify(task_id)
+
+    @property
+    def _created_key(self):
+        return f"{self._prefix}s:created"
+
+    def _state_key(self, state):
+        return f"{self._prefix}s:state:{state}"
+
+    def _decode_task(self, task_data):
+        return {
+            k.decode("utf-8"): self._convert_to_original_type(v)
+            for k, v in task_data.items()
+        }
 
-    def get_all_tasks(self, page: int, page_size: int):
+    def get_all_tasks(self, page: int, page_size: int, state: int = None):
         start = (page - 1) * page_size
-        # end = start + page_size # Không dùng trực tiếp end ở đây vì scan không đảm bảo thứ tự
-        tasks = []
-        cursor = 0
-        total_keys_scanned = 0 # Tổng số keys đã scan được (không phải tổng số keys trong DB)
-        retrieved_count = 0 # Số lượng tasks đã retrieve cho trang hiện tại
+        end = start + page_size - 1
+        index_key = self._created_key if state is None else self._state_key(state)
 
-        # Lặp cho đến khi duyệt hết database hoặc lấy đủ số lượng tasks cho trang hiện tại
-        while True:
-            # Lấy một lô khóa từ Redis
-            # Count ở đây chỉ là gợi ý, không đảm bảo số lượng khóa trả về chính xác
-            cursor, keys_bytes = self._redis.scan(cursor, match='*', count=page_size * 2) 
-            
-            # Decode các khóa từ bytes sang utf-8
-            keys = [k.decode('utf-8') for k in keys_bytes]
-
-            total_keys_scanned += len(keys)
-
-            # Lọc và lấy tasks cho trang hiện tại
-            # Logic này phức tạp hơn để đảm bảo lấy đúng tasks cho trang đó
-            for key in keys:
-                if retrieved_count >= page_size:
-                    break # Đã lấy đủ cho trang hiện tại
-
-                # Kiểm tra xem task này có nằm trong phạm vi của trang hiện tại không
-                # Đây là một giải pháp đơn giản, không lý tưởng cho phân trang thực sự trên tập lớn
-                # vì SCAN không có thứ tự. Một giải pháp tốt hơn là sử dụng SORTED SETs.
-                if start <= len(tasks) + retrieved_count < start + page_size:
-                    task_data = self._redis.hgetall(key)
-                    task = {
-                        k.decode("utf-8"): self._convert_to_original_type(v) for k, v in task_data.items()
-                    }
-                    tasks.append(task)
-                    retrieved_count += 1
-                
-            if cursor == 0: # Đã scan hết database
-                break
-            if retrieved_count >= page_size: # Đã lấy đủ tasks cho trang hiện tại
-                break
-
-        # Để có tổng số chính xác của tất cả các tasks trong Redis, cần một cách khác
-        # hoặc chấp nhận tổng số chỉ là số keys đã scan được cho đến khi đủ page_size
-        # hoặc scan toàn bộ để lấy tổng số thực tế (có thể chậm).
-        # Ở đây, tôi sẽ ước tính tổng số dựa trên số keys đã scan được cho đến khi đủ dữ liệu cho trang.
-        # Đối với một hệ thống quản lý tác vụ đơn giản, điều này có thể chấp nhận được.
-        # Nếu cần tổng số chính xác, cần xem xét lại cách lưu trữ tasks trong Redis (ví dụ: dùng set các task_id)
-        
-        # Tuy nhiên, để khớp với hành vi của MemoryState (trả về tổng số tasks hiện có)
-        # chúng ta cần lấy tất cả các keys và đếm chúng.
-        # Cách tối ưu hơn cho Redis để có tổng số là duy trì một counter hoặc một set các task_id.
-        # Trong ví dụ này, để giữ đơn giản và tương tự bản gốc:
-        all_keys = self._redis.keys('*')
-        total_tasks_in_db = len(all_keys)
+        # Task mới nhất trước, O(log n + page_size)
+        task_ids = self._redis.zrevrange(index_key, start, end)
+        total = self._redis.zcard(index_key)
+        if not task_ids:
+            return [], total
 
-        # Trả về các tasks đã lấy được và tổng số tasks trong DB
-        return tasks, total_tasks_in_db
+        pipe = self._redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(self._task_key(task_id.decode("utf-8")))
+        tasks = [self._decode_task(data) for data in pipe.execute() if data]
+        return tasks, total
 
     def update_task(
         self,
@@ -144,35 +350,126 @@ class RedisState(BaseState):
             "progress": progress,
             **kwargs,
         }
-
-        for field, value in fields.items():
-            # Redis HSET chỉ chấp nhận bytes, strings, ints, floats
-            # Các kiểu phức tạp hơn như list, dict cần được tuần tự hóa (ví dụ: JSON)
-            # Trong bản gốc, dường như chúng được lưu dưới dạng str() và được ast.literal_eval() khi đọc
-            self._redis.hset(task_id, field, str(value))
+        encoded = {field: self._encode(value) for field, value in fields.items()}
+
+        now = time.time()
+        with self._lock:
+            written = self._written.get(task_id)
+            if written is not None:
+                self._written.move_to_end(task_id)
+            changed = {
+                field: value
+                for field, value in encoded.items()
+                if written is None or written.get(field) != value
+            }
+            # Chỉ progress thay đổi và vừa ghi progress trong progress_interval:
+            # giữ giá trị mới nhất, _flush_loop sẽ ghi khi hết khoảng thời gian
+            if written is not None and changed.keys() == {"progress"}:
+                if now - self._progress_written_at.get(task_id, 0) < self._progress_interval:
+                    self._pending_progress[task_id] = changed["progress"]
+                    return
+
+            # Cập nhật đầy đủ thay thế progress đang chờ; luôn ghi state (kể cả
+            # khi không khác cache: process khác có thể vừa đổi state mà sự kiện
+            # chưa tới) để hash và chỉ mục theo trạng thái không lệch nhau
+            self._pending_progress.pop(task_id, None)
+            changed["state"] = encoded["state"]
+            if written is None:
+                written = {}
+                self._written[task_id] = written
+                while len(self._written) > self._written_cache_size:
+                    evicted, _ = self._written.popitem(last=False)
+                    self._progress_written_at.pop(evicted, None)
+                    self._pending_progress.pop(evicted, None)
+            written.update(changed)
+            if "progress" in changed:
+                self._progress_written_at[task_id] = now
+
+        self._write(task_id, changed, now)
+
+    def _write(self, task_id: str, changed: dict, now: float):
+        args = [task_id, now, f"{self._prefix}s:state:", self._events_channel, self._event(task_id)]
+        for field, value in changed.items():
+            args.extend((field, value))
+        self._update_script(keys=self._script_keys(task_id, changed.get("state")), args=args)
+
+    def _script_keys(self, task_id: str, state: str = None):
+        states = [str(s) for s in self._STATES]
+        if state is not None and state not in states:
+            states.append(state)
+        return [self._task_key(task_id), self._created_key] + [self._state_key(s) for s in states]
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._progress_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ghi progress đang chờ lên Redis thất bại")
+
+    def flush(self):
+        """Ghi các progress đang chờ đã quá progress_interval kể từ lần ghi trước."""
+        now = time.time()
+        with self._lock:
+            due = {
+                task_id: progress
+                for task_id, progress in self._pending_progress.items()
+                if now - self._progress_written_at.get(task_id, 0) >= self._progress_interval
+            }
+            for task_id in due:
+                del self._pending_progress[task_id]
+                self._progress_written_at[task_id] = now
+        for task_id, progress in due.items():
+            try:
+                self._write(task_id, {"progress": progress}, now)
+            except Exception:
+                # Giữ lại để lần sau ghi lại, trừ khi đã có giá trị mới hơn
+                with self._lock:
+                    self._pending_progress.setdefault(task_id, progress)
+                raise
 
     def get_task(self, task_id: str):
-        task_data = self._redis.hgetall(task_id)
+        task_data = self._redis.hgetall(self._task_key(task_id))
         if not task_data:
             return None
 
-        task = {
-            key.decode("utf-8"): self._convert_to_original_type(value)
-            for key, value in task_data.items()
-        }
+        task = self._decode_task(task_data)
+        with self._lock:
+            pending = self._pending_progress.get(task_id)
+        if pending is not None:
+            task["progress"] = json.loads(pending)
         return task
 
     def delete_task(self, task_id: str):
-        self._redis.delete(task_id)
+        with self._lock:
+            self._written.pop(task_id, None)
+            self._progress_written_at.pop(task_id, None)
+            self._pending_progress.pop(task_id, None)
+        # Xóa hiếm khi xảy ra: đọc state hiện tại để có cả chỉ mục của state
+        # ngoài các hằng số
+        current = self._redis.hget(self._task_key(task_id), "state")
+        self._delete_script(
+            keys=self._script_keys(task_id, current.decode("utf-8") if current else None),
+            args=[task_id, f"{self._prefix}s:state:", self._events_channel, self._event(task_id)],
+        )
+
+    @staticmethod
+    def _encode(value) -> str:
+        return json.dumps(value, ensure_ascii=False, default=str)
 
     @staticmethod
     def _convert_to_original_type(value):
         """
         Chuyển đổi giá trị từ chuỗi byte sang kiểu dữ liệu gốc của nó.
-        Có thể mở rộng phương thức này để xử lý các kiểu dữ liệu khác khi cần.
+        Giá trị mới được lưu dạng JSON; các giá trị cũ lưu bằng str() vẫn được đọc.
         """
         value_str = value.decode("utf-8")
 
+        try:
+            return json.loads(value_str)
+        except ValueError:
+            pass
+
         try:
             # Cố gắng chuyển đổi chuỗi byte thành list/dict nếu có thể
             return ast.literal_eval(value_str)
@@ -196,21 +493,241 @@ class RedisState(BaseState):
         return value_str
 
 
+# Quản lý trạng thái SQLite (WAL): nhiều process uvicorn trên cùng một máy
+# dùng chung trạng thái và lịch sử task được giữ lại sau khi khởi động lại.
+# Cập nhật chỉ có progress được gom lại và ghi theo lô mỗi progress_interval giây.
+class SQLiteState(BaseState):
+    _SQL_CREATE = (
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            state INTEGER NOT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL DEFAULT '{}',
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_state_created ON tasks (state, created_at)",
+    )
+    _SQL_SELECT_DATA = "SELECT data FROM tasks WHERE task_id = ?"
+    _SQL_UPSERT = """
+        INSERT INTO tasks (task_id, state, progress, data, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (task_id) DO UPDATE SET
+            state = excluded.state,
+            progress = excluded.progress,
+            data = excluded.data,
+            updated_at = excluded.updated_at
+    """
+    # updated_at <= ?: không ghi đè một cập nhật mới hơn đã được ghi trực tiếp
+    _SQL_UPDATE_PROGRESS = """
+        UPDATE tasks SET state = ?, progress = ?, updated_at = ?
+        WHERE task_id = ? AND updated_at <= ?
+    """
+    _SQL_SELECT_TASK = "SELECT task_id, state, progress, data FROM tasks WHERE task_id = ?"
+    _SQL_SELECT_PAGE = """
+        SELECT task_id, state, progress, data FROM tasks
+        ORDER BY created_at DESC LIMIT ? OFFSET ?
+    """
+    _SQL_SELECT_PAGE_BY_STATE = """
+        SELECT task_id, state, progress, data FROM tasks WHERE state = ?
+        ORDER BY created_at DESC LIMIT ? OFFSET ?
+    """
+    _SQL_COUNT = "SELECT COUNT(*) FROM tasks"
+    _SQL_COUNT_BY_STATE = "SELECT COUNT(*) FROM tasks WHERE state = ?"
+    _SQL_DELETE = "DELETE FROM tasks WHERE task_id = ?"
+
+    def __init__(self, path: str, progress_interval: float = 1.0):
+        import sqlite3
+
+        self._sqlite3 = sqlite3
+        self._path = path
+        self._progress_interval = progress_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # task_id -> (state, progress, updated_at) chờ ghi theo lô
+        self._pending_progress = {}
+        # Chỉ thấy thay đổi trong process này; stream tiến độ tự đọc lại định kỳ
+        # để nhận thay đổi từ các worker khác
+        self._notifier = TaskNotifier()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for sql in self._SQL_CREATE:
+            conn.execute(sql)
+
+        # progress_interval <= 0: ghi progress trực tiếp, không cần luồng ghi theo lô
+        if self._progress_interval > 0:
+            flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            flusher.start()
+
+    def _conn(self):
+        # Mỗi thread một kết nối; sqlite3 tự cache prepared statement theo câu SQL
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._sqlite3.connect(
+                self._path, timeout=30, isolation_level=None, cached_statements=64
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_task(row):
+        task_id, state, progress, data = row
+        return {"task_id": task_id, "state": state, "progress": progress, **json.loads(data)}
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self._progress_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ghi progress đang chờ vào SQLite thất bại, sẽ thử lại")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending_progress = self._pending_progress, {}
+        if not pending:
+            return
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    self._SQL_UPDATE_PROGRESS,
+                    [
+                        (state, progress, updated_at, task_id, updated_at)
+                        for task_id, (state, progress, updated_at) in pending.items()
+                    ],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception:
+            # Giữ lại để lần sau ghi lại (DB bị khóa, đầy đĩa...), trừ các task
+            # đã có giá trị mới hơn hoặc đã được ghi trực tiếp trong lúc đó
+            with self._lock:
+                for task_id, entry in pending.items():
+                    self._pending_progress.setdefault(task_id, entry)
+            raise
+
+    def update_task(
+        self,
+        task_id: str,
+        state: int = const.TASK_STATE_PROCESSING,
+        progress: int = 0,
+        **kwargs,
+    ):
+        progress = int(progress)
+        if progress > 100:
+            progress = 100
+        now = time.time()
+
+        # Cập nhật chỉ có progress của task đã tồn tại: gom lại để ghi theo lô.
+        # Truy vấn _exists chạy ngoài _lock để không chặn các thread khác.
+        if not kwargs and state == const.TASK_STATE_PROCESSING and self._progress_interval > 0:
+            with self._lock:
+                batched = task_id in self._pending_progress
+            if batched or self._exists(task_id):
+                with self._lock:
+                    self._pending_progress[task_id] = (state, progress, now)
+                self._notifier.notify(task_id)
+                return
+        with self._lock:
+            self._pending_progress.pop(task_id, None)
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(self._SQL_SELECT_DATA, (task_id,)).fetchone()
+            data = json.loads(row[0]) if row else {}
+            data.update(kwargs)
+            conn.execute(
+                self._SQL_UPSERT,
+                (
+                    task_id,
+                    state,
+                    progress,
+                    json.dumps(data, ensure_ascii=False, default=str),
+                    now,
+                    now,
+                ),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._notifier.notify(task_id)
+
+    def _exists(self, task_id: str) -> bool:
+        return self._conn().execute(self._SQL_SELECT_DATA, (task_id,)).fetchone() is not None
+
+    def get_task(self, task_id: str):
+        row = self._conn().execute(self._SQL_SELECT_TASK, (task_id,)).fetchone()
+        if not row:
+            return None
+        task = self._row_to_task(row)
+        with self._lock:
+            pending = self._pending_progress.get(task_id)
+        if pending:
+            task["state"], task["progress"] = pending[0], pending[1]
+        return task
+
+    def get_all_tasks(self, page: int, page_size: int, state: int = None):
+        start = (page - 1) * page_size
+        conn = self._conn()
+        if state is None:
+            rows = conn.execute(self._SQL_SELECT_PAGE, (page_size, start)).fetchall()
+            total = conn.execute(self._SQL_COUNT).fetchone()[0]
+        else:
+            rows = conn.execute(
+                self._SQL_SELECT_PAGE_BY_STATE, (state, page_size, start)
+            ).fetchall()
+            total = conn.execute(self._SQL_COUNT_BY_STATE, (state,)).fetchone()[0]
+        return [self._row_to_task(row) for row in rows], total
+
+    def delete_task(self, task_id: str):
+        with self._lock:
+            self._pending_progress.pop(task_id, None)
+        self._conn().execute(self._SQL_DELETE, (task_id,))
+        self._notifier.notify(task_id)
+
+
 # Trạng thái toàn cục
 _enable_redis = config.app.get("enable_redis", False)
 _redis_host = config.app.get("redis_host", "localhost")
 _redis_port = config.app.get("redis_port", 6379)
 _redis_db = config.app.get("redis_db", 0)
 _redis_password = config.app.get("redis_password", None)
-
-# Khởi tạo đối tượng state tùy thuộc vào cấu hình Redis
-state = (
-    RedisState(
-        host=_redis_host, port=_redis_port, db=_redis_db, password=_redis_password
+_redis_key_prefix = config.app.get("redis_key_prefix", "task")
+_redis_progress_interval = config.app.get("redis_progress_interval", 1.0)
+_memory_state_max_tasks = config.app.get("memory_state_max_tasks", 1000)
+_memory_state_ttl = config.app.get("memory_state_ttl", 86400)
+# "memory" (mặc định) hoặc "sqlite"; enable_redis = true luôn dùng Redis
+_state_backend = config.app.get("state_backend", "memory").strip().lower()
+_sqlite_path = config.app.get("sqlite_path", "") or utils.storage_dir("state.db", create=False)
+_sqlite_progress_interval = config.app.get("sqlite_progress_interval", 1.0)
+
+# Khởi tạo đối tượng state tùy thuộc vào cấu hình
+if _enable_redis:
+    state = RedisState(
+        host=_redis_host,
+        port=_redis_port,
+        db=_redis_db,
+        password=_redis_password,
+        prefix=_redis_key_prefix,
+        progress_interval=_redis_progress_interval,
     )
-    if _enable_redis
-    else MemoryState()
-)
+elif _state_backend == "sqlite":
+    os.makedirs(os.path.dirname(_sqlite_path), exist_ok=True)
+    state = SQLiteState(path=_sqlite_path, progress_interval=_sqlite_progress_interval)
+else:
+    state = MemoryState(max_tasks=_memory_state_max_tasks, ttl=_memory_state_ttl)
 
 
 if __name__ == "__main__":
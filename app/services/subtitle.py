@@ -1,141 +1,368 @@
 import json
 import os.path
 import re
+import threading
+from contextlib import contextmanager
 from timeit import default_timer as timer
 
-from faster_whisper import WhisperModel
+from edge_tts import SubMaker
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps, merge_segments
 from loguru import logger
 from openai import OpenAI # Import OpenAI client
 
 from app.config import config
+from app.services import stage, voice
 from app.utils import utils
 
 model_size = config.whisper.get("model_size", "large-v3")
 device = config.whisper.get("device", "cpu")
 compute_type = config.whisper.get("compute_type", "int8")
-model = None
-
-
-def create(audio_file, subtitle_file: str = ""):
-    global model
-    if not model:
-        model_path = f"{utils.root_dir()}/models/whisper-{model_size}"
+# Số lượt transcribe chạy đồng thời trên một model (num_workers của faster-whisper)
+# và số thread CPU cho mỗi lượt (0 = mặc định của CTranslate2)
+num_workers = max(1, int(config.whisper.get("num_workers", 1)))
+cpu_threads = int(config.whisper.get("cpu_threads", 0))
+# batch_size > 0: nhận dạng theo lô các đoạn VAD của cùng một file audio
+# (BatchedInferencePipeline); không gộp audio của các tác vụ khác nhau vào
+# một lô. Lớn hơn cho thông lượng cao hơn nhưng tốn bộ nhớ hơn, 0 = tuần tự.
+# chunk_length: độ dài tối đa (giây) của mỗi đoạn VAD trong một lô
+batch_size = int(config.whisper.get("batch_size", 8))
+chunk_length = int(config.whisper.get("chunk_length", 30))
+# Model nhỏ dùng cho provider whisper_align (đã biết trước kịch bản)
+align_model_size = config.whisper.get("align_model_size", "small")
+
+
+# Mỗi model chỉ được nạp một lần cho cả process (có khóa), các tác vụ dùng
+# chung model qua một pool giới hạn num_workers lượt transcribe đồng thời.
+class WhisperPool:
+    def __init__(self, device: str, compute_type: str, num_workers: int = 1, cpu_threads: int = 0):
+        self.device = device
+        self.compute_type = compute_type
+        self.num_workers = num_workers
+        self.cpu_threads = cpu_threads
+        self.slots = stage.StagePool("whisper", num_workers)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._models = {}
+        self._pipelines = {}
+        self._load_seconds = {}
+
+    @staticmethod
+    def _model_path(size: str) -> str:
+        model_path = f"{utils.root_dir()}/models/whisper-{size}"
         model_bin_file = f"{model_path}/model.bin"
         if not os.path.isdir(model_path) or not os.path.isfile(model_bin_file):
-            model_path = model_size # Sẽ tải xuống nếu không tìm thấy cục bộ
-
-        logger.info(
-            f"Đang tải mô hình Faster Whisper: {model_path}, thiết bị: {device}, kiểu tính toán: {compute_type}"
-        )
-        try:
-            model = WhisperModel(
-                model_size_or_path=model_path, device=device, compute_type=compute_type
-            )
-        except Exception as e:
-            logger.error(
-                f"Không thể tải mô hình Faster Whisper: {e}"
-                f"********************************************\n"
-                f"Điều này có thể do vấn đề mạng. \n"
-                f"Vui lòng tải mô hình thủ công và đặt nó vào thư mục 'models'. \n"
-                f"********************************************\n"
+            model_path = size # Sẽ tải xuống nếu không tìm thấy cục bộ
+        return model_path
+
+    def get_model(self, size: str = "") -> WhisperModel | None:
+        size = size or model_size
+        with self._lock:
+            if size in self._models:
+                return self._models[size]
+            load_lock = self._load_locks.setdefault(size, threading.Lock())
+
+        # Các tác vụ cùng chờ một lần nạp thay vì mỗi tác vụ tự nạp model
+        with load_lock:
+            with self._lock:
+                if size in self._models:
+                    return self._models[size]
+
+            model_path = self._model_path(size)
+            logger.info(
+                f"Đang tải mô hình Faster Whisper: {model_path}, thiết bị: {self.device}, kiểu tính toán: {self.compute_type}"
             )
+            start = timer()
+            try:
+                model = WhisperModel(
+                    model_size_or_path=model_path,
+                    device=self.device,
+                    compute_type=self.compute_type,
+                    num_workers=self.num_workers,
+                    cpu_threads=self.cpu_threads,
+                )
+            except Exception as e:
+                logger.error(
+                    f"Không thể tải mô hình Faster Whisper: {e}"
+                    f"********************************************\n"
+                    f"Điều này có thể do vấn đề mạng. \n"
+                    f"Vui lòng tải mô hình thủ công và đặt nó vào thư mục 'models'. \n"
+                    f"********************************************\n"
+                )
+                return None
+
+            with self._lock:
+                self._models[size] = model
+                self._load_seconds[size] = round(timer() - start, 2)
+            logger.info(f"Đã tải mô hình Faster Whisper {size} trong {self._load_seconds[size]} s")
+            return model
+
+    def get_pipeline(self, size: str = "") -> BatchedInferencePipeline | None:
+        size = size or model_size
+        model = self.get_model(size)
+        if model is None:
             return None
+        with self._lock:
+            if size not in self._pipelines:
+                self._pipelines[size] = BatchedInferencePipeline(model=model)
+            return self._pipelines[size]
+
+    def cost(self) -> tuple:
+        # (số core, MB bộ nhớ) cho admission của stage.render_pool: Whisper
+        # trên CPU tranh core với render nên dùng chung ngân sách CPU.
+        if self.device == "cuda":
+            return 1, 0
+        cores = self.cpu_threads or min(4, os.cpu_count() or 4)
+        return cores, 0
+
+    @contextmanager
+    def transcribe(self, model, audio, **kwargs):
+        """
+        Giữ một chỗ trong pool và một slot CPU của stage.render_pool trong
+        suốt quá trình duyệt segments, vì faster-whisper chỉ thực sự nhận
+        dạng khi generator được duyệt. model: WhisperModel hoặc
+        BatchedInferencePipeline. Yêu cầu vượt quá num_workers xếp hàng chờ
+        trong pool (xem stats()["waiting"]).
+        """
+        cores, memory_mb = self.cost()
+        with self.slots.slot(), stage.render_pool.slot(cores=cores, memory_mb=memory_mb):
+            yield model.transcribe(audio, **kwargs)
+
+    def stats(self) -> dict:
+        stats = self.slots.stats()
+        with self._lock:
+            stats["models"] = dict(self._load_seconds)
+        stats["saturation"] = round(stats["active"] / stats["size"], 2)
+        return stats
+
+
+pool = WhisperPool(device, compute_type, num_workers=num_workers, cpu_threads=cpu_threads)
+
+
+def preload():
+    """
+    Nạp trước model khi khởi động API hoặc worker. whisper.preload mặc định
+    bật khi subtitle_provider là whisper_local/whisper_align, tắt với các
+    provider khác. Mỗi process (uvicorn khi listen_workers > 1, worker) nạp
+    một bản model riêng.
+    """
+    provider = config.app.get("subtitle_provider", "edge").strip().lower()
+    if not config.whisper.get("preload", provider in ("whisper_local", "whisper_align")):
+        return
+    size = align_model_size if provider == "whisper_align" else model_size
+    utils.run_in_background(pool.get_model, size)
+
+
+def _transcribe_options(batched: bool) -> dict:
+    options = dict(beam_size=5, word_timestamps=True, vad_filter=True)
+    if batched:
+        options.update(batch_size=batch_size, chunk_length=chunk_length)
+    else:
+        options.update(vad_parameters=dict(min_silence_duration_ms=500))
+    return options
+
+
+def _report_progress(on_progress, position: float, duration: float):
+    if on_progress and duration:
+        on_progress(min(1.0, position / duration))
+
+
+# Ghi log tiến độ mỗi N dòng phụ đề thay vì từng dòng (log mỗi đoạn làm chậm
+# vòng ghi SRT với audio dài)
+_LOG_EVERY_LINES = 100
+
+
+def create(audio_file, subtitle_file: str = "", on_progress=None):
+    """
+    Phụ đề được ghi vào subtitle_file ngay khi từng segment được nhận dạng;
+    on_progress(tỷ lệ 0..1) được gọi theo thời điểm cuối segment so với
+    info.duration.
+    """
+    batched = batch_size > 0
+    model = pool.get_pipeline() if batched else pool.get_model()
+    if not model:
+        return None
 
     logger.info(f"Bắt đầu tạo phụ đề bằng Faster Whisper, tệp đầu ra: {subtitle_file}")
     if not subtitle_file:
         subtitle_file = f"{audio_file}.srt"
 
-    segments, info = model.transcribe(
-        audio_file,
-        beam_size=5,
-        word_timestamps=True,
-        vad_filter=True,
-        vad_parameters=dict(min_silence_duration_ms=500),
-    )
-
-    logger.info(
-        f"Ngôn ngữ được phát hiện bởi Faster Whisper: '{info.language}', xác suất: {info.language_probability:.2f}"
-    )
-
-    start = timer()
-    subtitles = []
-
-    def recognized(seg_text, seg_start, seg_end):
-        seg_text = seg_text.strip()
-        if not seg_text:
-            return
+    with pool.transcribe(model, audio_file, **_transcribe_options(batched)) as (segments, info), open(
+        subtitle_file, "w", encoding="utf-8"
+    ) as srt:
+        logger.info(
+            f"Ngôn ngữ được phát hiện bởi Faster Whisper: '{info.language}', xác suất: {info.language_probability:.2f}"
+        )
 
-        msg = "[%.2fs -> %.2fs] %s" % (seg_start, seg_end, seg_text)
-        logger.debug(msg)
+        start = timer()
+        idx = 1
 
-        subtitles.append(
-            {"msg": seg_text, "start_time": seg_start, "end_time": seg_end}
-        )
+        def recognized(seg_text, seg_start, seg_end):
+            nonlocal idx
+            seg_text = seg_text.strip()
+            if not seg_text:
+                return
 
-    for segment in segments:
-        words_idx = 0
-        words_len = len(segment.words)
+            # Ghi và flush từng dòng để các bước sau đọc được phụ đề dở dang
+            srt.write(utils.text_to_srt(idx, seg_text, seg_start, seg_end) + "\n")
+            srt.flush()
+            if idx % _LOG_EVERY_LINES == 0:
+                logger.debug(f"Đã ghi {idx} dòng phụ đề, tới {seg_end:.2f}s")
+            idx += 1
 
-        seg_start = 0
-        seg_end = 0
-        seg_text = ""
+        for segment in segments:
+            words_idx = 0
+            words_len = len(segment.words)
 
-        if segment.words:
-            is_segmented = False
-            for word in segment.words:
-                if not is_segmented:
-                    seg_start = word.start
-                    is_segmented = True
+            seg_start = 0
+            seg_end = 0
+            seg_text = ""
 
-                seg_end = word.end
-                # If it contains punctuation, then break the sentence.
-                seg_text += word.word
+            if segment.words:
+                is_segmented = False
+                for word in segment.words:
+                    if not is_segmented:
+                        seg_start = word.start
+                        is_segmented = True
 
-                if utils.str_contains_punctuation(word.word):
-                    # remove last char
-                    seg_text = seg_text[:-1]
-                    if not seg_text:
-                        continue
+                    seg_end = word.end
+                    # If it contains punctuation, then break the sentence.
+                    seg_text += word.word
 
-                    recognized(seg_text, seg_start, seg_end)
+                    if utils.str_contains_punctuation(word.word):
+                        # remove last char
+                        seg_text = seg_text[:-1]
+                        if not seg_text:
+                            continue
 
-                    is_segmented = False
-                    seg_text = ""
+                        recognized(seg_text, seg_start, seg_end)
 
-                if words_idx == 0 and segment.start < word.start:
-                    seg_start = word.start
-                if words_idx == (words_len - 1) and segment.end > word.end:
-                    seg_end = word.end
-                words_idx += 1
+                        is_segmented = False
+                        seg_text = ""
 
-        if not seg_text:
-            continue
+                    if words_idx == 0 and segment.start < word.start:
+                        seg_start = word.start
+                    if words_idx == (words_len - 1) and segment.end > word.end:
+                        seg_end = word.end
+                    words_idx += 1
 
-        recognized(seg_text, seg_start, seg_end)
+            if seg_text:
+                recognized(seg_text, seg_start, seg_end)
+            _report_progress(on_progress, segment.end, info.duration)
 
     end = timer()
 
     diff = end - start
     logger.info(f"Hoàn thành tạo phụ đề bằng Faster Whisper, thời gian đã trôi qua: {diff:.2f} s")
+    logger.info(f"Đã tạo tệp phụ đề: {subtitle_file} ({idx - 1} dòng)")
 
-    idx = 1
-    lines = []
-    for subtitle in subtitles:
-        text = subtitle.get("msg")
-        if text:
-            lines.append(
-                utils.text_to_srt(
-                    idx, text, subtitle.get("start_time"), subtitle.get("end_time")
-                )
-            )
-            idx += 1
+    return subtitle_file # Trả về đường dẫn tệp phụ đề đã tạo
 
-    sub = "\n".join(lines) + "\n"
-    with open(subtitle_file, "w", encoding="utf-8") as f:
-        f.write(sub)
-    logger.info(f"Đã tạo tệp phụ đề: {subtitle_file}")
 
-    return subtitle_file # Trả về đường dẫn tệp phụ đề đã tạo
+_SAMPLE_RATE = 16000
+# Số từ kịch bản tối đa đưa vào prompt của một cửa sổ (prompt bị cắt ở ~223 token)
+_ALIGN_PROMPT_WORDS = 80
+# Số từ kịch bản được dò phía trước khi dời vị trí theo từ nhận dạng được
+_ALIGN_LOOKAHEAD = 12
+
+
+def _align_windows(audio) -> list[tuple[int, int]]:
+    """
+    Chia audio thành các cửa sổ tối đa chunk_length giây, cắt ở khoảng lặng
+    (VAD) để không cắt ngang một từ. Trả về (mẫu đầu, mẫu cuối).
+    """
+    vad_options = VadOptions(max_speech_duration_s=chunk_length, min_silence_duration_ms=300)
+    windows = [
+        (w["start"], w["end"])
+        for w in merge_segments(get_speech_timestamps(audio, vad_options), vad_options)
+    ]
+    if windows:
+        return windows
+    step = chunk_length * _SAMPLE_RATE
+    return [(start, min(start + step, len(audio))) for start in range(0, len(audio), step)]
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def _advance(script_words: list[str], pos: int, recognized: list[str]) -> int:
+    # Dời vị trí trong kịch bản tới sau từ cuối cùng khớp với từ nhận dạng
+    for word in recognized:
+        word = _normalize_word(word)
+        if not word:
+            continue
+        for i in range(pos, min(pos + _ALIGN_LOOKAHEAD, len(script_words))):
+            if script_words[i] == word:
+                pos = i + 1
+                break
+    return pos
+
+
+def create_aligned(
+    audio_file: str, script: str, subtitle_file: str = "", on_progress=None
+) -> str | None:
+    """
+    Provider whisper_align: kịch bản đã biết trước nên chỉ cần model nhỏ để
+    lấy thời gian từng từ. Audio được nhận dạng theo từng cửa sổ (tách ở
+    khoảng lặng), mỗi cửa sổ nhận đúng đoạn kịch bản tương ứng làm
+    initial_prompt, chọn theo vị trí từ đã khớp ở các cửa sổ trước. Các từ
+    nhận dạng được căn về các dòng kịch bản như phụ đề Edge TTS
+    (voice.create_subtitle), nên SRT giữ nguyên văn bản gốc.
+    """
+    model = pool.get_model(align_model_size)
+    if not model:
+        return None
+    if not subtitle_file:
+        subtitle_file = f"{audio_file}.srt"
+
+    logger.info(f"Bắt đầu căn phụ đề theo kịch bản bằng Faster Whisper ({align_model_size}), tệp đầu ra: {subtitle_file}")
+    start = timer()
+    audio = decode_audio(audio_file, sampling_rate=_SAMPLE_RATE)
+    duration = len(audio) / _SAMPLE_RATE
+    windows = _align_windows(audio)
+    script_words = script.split()
+    normalized = [_normalize_word(w) for w in script_words]
+    speech_seconds = sum(end - begin for begin, end in windows) / _SAMPLE_RATE
+    words_per_second = len(script_words) / speech_seconds if speech_seconds else 0
+
+    sub_maker = SubMaker()
+    pos = 0
+    for begin, end in windows:
+        expected = int((end - begin) / _SAMPLE_RATE * words_per_second)
+        # Thêm biên vì tốc độ đọc không đều giữa các cửa sổ
+        prompt = " ".join(script_words[pos : pos + min(_ALIGN_PROMPT_WORDS, int(expected * 1.3) + 5)])
+        shift = begin / _SAMPLE_RATE
+        recognized = []
+        with pool.transcribe(
+            model,
+            audio[begin:end],
+            beam_size=1,
+            word_timestamps=True,
+            vad_filter=False,
+            condition_on_previous_text=False,
+            initial_prompt=prompt or None,
+        ) as (segments, info):
+            for segment in segments:
+                for word in segment.words or []:
+                    recognized.append(word.word.strip())
+                    sub_maker.subs.append(word.word.strip())
+                    sub_maker.offset.append(
+                        (int((word.start + shift) * 10_000_000), int((word.end + shift) * 10_000_000))
+                    )
+        matched = _advance(normalized, pos, recognized)
+        # Không khớp được từ nào: ước lượng theo tốc độ đọc để cửa sổ sau không lệch mãi
+        pos = matched if matched > pos else min(len(script_words), pos + expected)
+        _report_progress(on_progress, end / _SAMPLE_RATE, duration)
+    logger.info(f"Nhận dạng {len(sub_maker.subs)} từ trong {len(windows)} cửa sổ, {timer() - start:.2f} s")
+
+    if not sub_maker.subs:
+        logger.warning("Faster Whisper không nhận dạng được từ nào")
+        return None
+    voice.create_subtitle(sub_maker=sub_maker, text=script, subtitle_file=subtitle_file)
+    if not os.path.exists(subtitle_file):
+        return None
+    return subtitle_file
 
 
 def create_api(audio_file: str, subtitle_file: str, api_key: str) -> str | None:
@@ -177,7 +404,43 @@ def create_api(audio_file: str, subtitle_file: str, api_key: str) -> str | None:
         return None
 
 
+def benchmark(audio_file: str, runs: int = 1):
+    """So sánh thời gian nhận dạng tuần tự và theo lô trên cùng một file audio."""
+    if runs < 1:
+        raise ValueError(f"runs phải >= 1, nhận được {runs}")
+    from faster_whisper.audio import decode_audio
+
+    duration = len(decode_audio(audio_file)) / 16000
+    results = {}
+    for batched in (False, True):
+        model = pool.get_pipeline() if batched else pool.get_model()
+        options = _transcribe_options(batched)
+        if batched and not options["batch_size"]:
+            options["batch_size"] = 8
+        elapsed = []
+        for _ in range(runs):
+            start = timer()
+            with pool.transcribe(model, audio_file, **options) as (segments, info):
+                words = sum(len(segment.words or []) for segment in segments)
+            elapsed.append(timer() - start)
+        best = min(elapsed)
+        results["batched" if batched else "sequential"] = {
+            "seconds": round(best, 2),
+            "realtime_factor": round(best / duration, 3),
+            "words": words,
+        }
+    print(json.dumps({"audio_seconds": round(duration, 2), **results}, indent=2))
+    return results
+
+
 if __name__ == "__main__":
+    import sys
+
+    # python -m app.services.subtitle <audio_file> [số lần chạy]
+    if len(sys.argv) > 1:
+        benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+        sys.exit(0)
+
     print("--- Thử nghiệm tạo phụ đề từ audio (Faster Whisper) ---")
     test_task_id_fw = "test_subtitle_task_fw"
     task_dir_path_fw = utils.task_dir(test_task_id_fw)
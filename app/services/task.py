@@ -1,6 +1,7 @@
 import math
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 # from os import path # Dòng này sẽ được loại bỏ
 from typing import List
 
@@ -9,11 +10,12 @@ from loguru import logger
 from app.config import config
 from app.models import const
 from app.models.schema import VideoConcatMode, VideoParams, VideoPodcastParams
-from app.services import llm, material, subtitle, video, voice
+from app.services import llm, material, media_cache, render, stage, subtitle, video, voice
 from app.services import state as sm
 from app.utils import utils
 
 
+@stage.io_stage
 def generate_script(task_id, params):
     logger.info("## Đang tạo kịch bản video")
     video_script = params.video_script.strip()
@@ -35,6 +37,7 @@ def generate_script(task_id, params):
 
     return video_script
 
+@stage.io_stage
 def generate_podcast_script(task_id, params):
     logger.info("## Đang tạo kịch bản podcast")
     podcast_script = params.video_script.strip()
@@ -55,6 +58,7 @@ def generate_podcast_script(task_id, params):
     
     return podcast_script
 
+@stage.io_stage
 def generate_podcast_dialogue(task_id, params):
     logger.info("## Đang tạo đối thoại podcast")
     dialogue_output = {}
@@ -104,6 +108,7 @@ def generate_podcast_dialogue(task_id, params):
 
 
 
+@stage.io_stage
 def generate_terms(task_id, params, video_script):
     logger.info("## Đang tạo từ khóa video")
     video_terms = params.video_terms
@@ -141,6 +146,7 @@ def save_script_data(task_id, video_script, video_terms, params):
         f.write(utils.to_json(script_data))
 
 
+@stage.io_stage
 def generate_audio(task_id, params, video_script):
     logger.info("## Đang tạo âm thanh")
     audio_file = os.path.join(utils.task_dir(task_id), "audio.mp3")
@@ -163,6 +169,8 @@ def generate_audio(task_id, params, video_script):
     return audio_file, audio_duration, sub_maker
 
 
+# Không chạy trong io_pool: Whisper cục bộ nặng CPU nên lấy slot của
+# stage.render_pool trong subtitle.pool.transcribe, Whisper API lấy slot I/O.
 def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
     if not params.subtitle_enabled:
         logger.info("Tạo phụ đề bị vô hiệu hóa trong cấu hình.")
@@ -175,6 +183,15 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
 
     subtitle_created_successfully = False
 
+    progress_state = {"value": 30}
+
+    def on_subtitle_progress(done):
+        # Tiến độ phụ đề nằm trong khoảng 30 -> 40, chỉ cập nhật khi tăng ít nhất 1%
+        value = 30 + 10 * done
+        if value - progress_state["value"] >= 1:
+            progress_state["value"] = value
+            sm.state.update_task(task_id, progress=value)
+
     if subtitle_provider == "edge":
         if sub_maker:
             voice.create_subtitle(
@@ -189,7 +206,8 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
 
     if subtitle_provider == "whisper_api":
         logger.info("Đang thử tạo phụ đề bằng OpenAI Whisper API...")
-        created_path = subtitle.create_api(audio_file=audio_file, subtitle_file=subtitle_path, api_key=params.openai_key)
+        with stage.io_pool.slot():
+            created_path = subtitle.create_api(audio_file=audio_file, subtitle_file=subtitle_path, api_key=params.openai_key)
         if created_path and os.path.exists(created_path) and os.path.getsize(created_path) > 0:
             subtitle_created_successfully = True
             subtitle_path = created_path
@@ -198,13 +216,29 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
 
     if subtitle_provider == "whisper_local":
         logger.info("Đang thử tạo phụ đề bằng Faster Whisper cục bộ...")
-        created_path = subtitle.create(audio_file=audio_file, subtitle_file=subtitle_path)
+        created_path = subtitle.create(
+            audio_file=audio_file, subtitle_file=subtitle_path, on_progress=on_subtitle_progress
+        )
         if created_path and os.path.exists(created_path) and os.path.getsize(created_path) > 0:
             subtitle_created_successfully = True
             subtitle_path = created_path
         else:
             logger.warning("Tạo phụ đề bằng Faster Whisper cục bộ thất bại.")
 
+    if subtitle_provider == "whisper_align":
+        logger.info("Đang thử căn phụ đề theo kịch bản bằng Faster Whisper cục bộ...")
+        created_path = subtitle.create_aligned(
+            audio_file=audio_file,
+            script=video_script,
+            subtitle_file=subtitle_path,
+            on_progress=on_subtitle_progress,
+        )
+        if created_path and os.path.exists(created_path) and os.path.getsize(created_path) > 0:
+            subtitle_created_successfully = True
+            subtitle_path = created_path
+        else:
+            logger.warning("Căn phụ đề theo kịch bản bằng Faster Whisper thất bại.")
+
     if not subtitle_created_successfully:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
         logger.error("Không thể tạo phụ đề bằng bất kỳ nhà cung cấp nào.")
@@ -213,11 +247,13 @@ def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
     return subtitle_path
 
 
+@stage.io_stage
 def get_video_materials(
     task_id: str,
     params,
     video_terms: list,
     audio_duration: float,
+    pin=None,
 ) -> List[str] | None:
     if params.video_source == "local":
         logger.info("## Tiền xử lý tài liệu cục bộ")
@@ -243,6 +279,9 @@ def get_video_materials(
             audio_duration=audio_duration * params.video_count,
             max_clip_duration=params.video_clip_duration,
         )
+        if pin is not None:
+            # Ghim ngay khi tải xong: sweeper có thể chạy trong lúc chờ phụ đề
+            pin(downloaded_videos)
         if not downloaded_videos:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
             logger.error(
@@ -253,7 +292,7 @@ def get_video_materials(
 
 
 def generate_final_videos(
-    task_id, params, downloaded_videos, audio_file, subtitle_path
+    task_id, params, downloaded_videos, audio_file, subtitle_path, audio_duration
 ):
     final_video_paths = []
     combined_video_paths = []
@@ -262,14 +301,34 @@ def generate_final_videos(
     )
     video_transition_mode = params.video_transition_mode
 
+    render_cost = stage.estimate_render_cost(
+        params.video_aspect,
+        audio_duration,
+        threads=params.n_threads,
+        clip_duration=params.video_clip_duration,
+    )
+
     _progress = 50
+    _step = 50 / params.video_count / 2
+
+    def on_render_progress(info):
+        # Nội suy tiến độ trong stage render hiện tại theo số frame đã ghi
+        done = info["frame"] / info["total"] if info["total"] else 0
+        sm.state.update_task(
+            task_id,
+            progress=_progress + _step * min(done, 1),
+            render_fps=info["fps"],
+        )
+
     for i in range(params.video_count):
         index = i + 1
         combined_video_path = os.path.join(
             utils.task_dir(task_id), f"combined-{index}.mp4"
         )
         logger.info(f"## Đang kết hợp video: {index} => {combined_video_path}")
-        video.combine_videos(
+        render.run(
+            "combine_videos",
+            cost=render_cost,
             combined_video_path=combined_video_path,
             video_paths=downloaded_videos,
             audio_file=audio_file,
@@ -278,23 +337,27 @@ def generate_final_videos(
             video_transition_mode=video_transition_mode,
             max_clip_duration=params.video_clip_duration,
             threads=params.n_threads,
+            on_progress=on_render_progress,
         )
 
-        _progress += 50 / params.video_count / 2
+        _progress += _step
         sm.state.update_task(task_id, progress=_progress)
 
         final_video_path = os.path.join(utils.task_dir(task_id), f"final-{index}.mp4")
 
         logger.info(f"## Đang tạo video fianl thứ {index} => {final_video_path}")
-        video.generate_video(
+        render.run(
+            "generate_video",
+            cost=render_cost,
             video_path=combined_video_path,
             audio_path=audio_file,
             subtitle_path=subtitle_path,
             output_file=final_video_path,
             params=params,
+            on_progress=on_render_progress,
         )
 
-        _progress += 50 / params.video_count / 2
+        _progress += _step
         sm.state.update_task(task_id, progress=_progress)
 
         final_video_paths.append(final_video_path)
@@ -361,85 +424,111 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         )
         return {"audio_file": audio_file, "audio_duration": audio_duration}
 
-    # 4. Tạo phụ đề
-    subtitle_path = generate_subtitle(
-        task_id, params, video_script, sub_maker, audio_file
-    )
+    # Tài liệu được ghim từ lúc tải xong tới khi render xong để sweeper
+    # của cache video không xóa
+    with media_cache.cache.pin() as pin_materials:
+        # 4. Tạo phụ đề
+        # Tài liệu video chỉ cần thời lượng audio nên được tải song song với
+        # việc tạo phụ đề (Whisper có thể mất nhiều thời gian)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            materials_future = None
+            if stop_at != "subtitle":
+                materials_future = executor.submit(
+                    get_video_materials, task_id, params, video_terms, audio_duration, pin_materials
+                )
+            subtitle_path = generate_subtitle(
+                task_id, params, video_script, sub_maker, audio_file
+            )
 
-    if stop_at == "subtitle":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            subtitle_path=subtitle_path,
-        )
-        return {"subtitle_path": subtitle_path}
+        if stop_at == "subtitle":
+            sm.state.update_task(
+                task_id,
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                subtitle_path=subtitle_path,
+            )
+            return {"subtitle_path": subtitle_path}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
+        sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
 
-    # 5. Lấy tài liệu video
-    downloaded_videos = get_video_materials(
-        task_id, params, video_terms, audio_duration
-    )
-    if not downloaded_videos:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+        # 5. Lấy tài liệu video
+        downloaded_videos = materials_future.result()
+        if not downloaded_videos:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
 
-    if stop_at == "materials":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            materials=downloaded_videos,
-        )
-        return {"materials": downloaded_videos}
+        if stop_at == "materials":
+            sm.state.update_task(
+                task_id,
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                materials=downloaded_videos,
+            )
+            return {"materials": downloaded_videos}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
+        sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
 
-    # 6. Tạo video cuối cùng
-    final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
-    )
+        # 6. Tạo video cuối cùng
+        final_video_paths, combined_video_paths = generate_final_videos(
+            task_id, params, downloaded_videos, audio_file, subtitle_path, audio_duration
+        )
 
-    if not final_video_paths:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+        if not final_video_paths:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
 
-    logger.success(
-        f"Tác vụ {task_id} hoàn thành, đã tạo {len(final_video_paths)} video."
-    )
+        logger.success(
+            f"Tác vụ {task_id} hoàn thành, đã tạo {len(final_video_paths)} video."
+        )
 
-    kwargs = {
-        "videos": final_video_paths,
-        "combined_videos": combined_video_paths,
-        "script": video_script,
-        "terms": video_terms,
-        "audio_file": audio_file,
-        "audio_duration": audio_duration,
-        "subtitle_path": subtitle_path,
-        "materials": downloaded_videos,
-    }
-    sm.state.update_task(
-        task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
-    )
-    return kwargs
+        kwargs = {
+            "videos": final_video_paths,
+            "combined_videos": combined_video_paths,
+            "script": video_script,
+            "terms": video_terms,
+            "audio_file": audio_file,
+            "audio_duration": audio_duration,
+            "subtitle_path": subtitle_path,
+            "materials": downloaded_videos,
+        }
+        sm.state.update_task(
+            task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
+        )
+        return kwargs
 
 
+@stage.io_stage
 def generate_podcast_audio(task_id, params, podcast_dialogue_tts, podcast_dialogue_subtitle):
     logger.info("## Đang tạo audio podcast")
     audio_file = os.path.join(utils.task_dir(task_id), "audio.mp3")
     
-    # Gọi voice.get_audio_raw với cả hai loại dialogue
-    sub_maker = voice.get_audio_podcast_raw(
-        dialogue_tts=podcast_dialogue_tts,
-        dialogue_subtitle=podcast_dialogue_subtitle,
-        host1=params.host1,
-        host2=params.host2,
-        voice1=params.voice1,
-        voice2=params.voice2,
-        voice_file=audio_file,
-        gemini_key=params.gemini_key,
-    )
+    # Tổng hợp từng lượt thoại song song; đối thoại không tách được theo người
+    # nói thì gửi cả đoạn như trước
+    turns = voice.parse_podcast_turns(podcast_dialogue_tts, params.host1, params.host2)
+    if turns:
+        sub_maker = voice.get_audio_podcast_turns(
+            turns=turns,
+            host1=params.host1,
+            host2=params.host2,
+            voice1=params.voice1,
+            voice2=params.voice2,
+            voice_file=audio_file,
+            gemini_key=params.gemini_key,
+            instruction=voice.parse_podcast_instruction(
+                podcast_dialogue_tts, params.host1, params.host2
+            ),
+        )
+    else:
+        sub_maker = voice.get_audio_podcast_raw(
+            dialogue_tts=podcast_dialogue_tts,
+            dialogue_subtitle=podcast_dialogue_subtitle,
+            host1=params.host1,
+            host2=params.host2,
+            voice1=params.voice1,
+            voice2=params.voice2,
+            voice_file=audio_file,
+            gemini_key=params.gemini_key,
+        )
     if sub_maker is None:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
         logger.error("Không thể tạo âm thanh podcast.")
@@ -520,71 +609,80 @@ def start_podcast(task_id, params: VideoPodcastParams, stop_at: str = "video"):
         )
         return {"audio_file": audio_file, "audio_duration": audio_duration}
 
-    # 4. Tạo phụ đề
-    # Sử dụng podcast_dialogue_subtitle để tạo phụ đề
-    subtitle_path = generate_subtitle(
-        task_id, params, podcast_dialogue_subtitle, sub_maker, audio_file
-    )
+    # Tài liệu được ghim từ lúc tải xong tới khi render xong để sweeper
+    # của cache video không xóa
+    with media_cache.cache.pin() as pin_materials:
+        # 4. Tạo phụ đề
+        # Sử dụng podcast_dialogue_subtitle để tạo phụ đề
+        # Tài liệu video chỉ cần thời lượng audio nên được tải song song với
+        # việc tạo phụ đề (Whisper có thể mất nhiều thời gian)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            materials_future = None
+            if stop_at != "subtitle":
+                materials_future = executor.submit(
+                    get_video_materials, task_id, params, video_terms, audio_duration, pin_materials
+                )
+            subtitle_path = generate_subtitle(
+                task_id, params, podcast_dialogue_subtitle, sub_maker, audio_file
+            )
 
-    if stop_at == "subtitle":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            subtitle_path=subtitle_path,
-        )
-        return {"subtitle_path": subtitle_path}
+        if stop_at == "subtitle":
+            sm.state.update_task(
+                task_id,
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                subtitle_path=subtitle_path,
+            )
+            return {"subtitle_path": subtitle_path}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
+        sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
 
-    # 5. Lấy tài liệu video
-    downloaded_videos = get_video_materials(
-        task_id, params, video_terms, audio_duration
-    )
-    if not downloaded_videos:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+        # 5. Lấy tài liệu video
+        downloaded_videos = materials_future.result()
+        if not downloaded_videos:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
 
-    if stop_at == "materials":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            materials=downloaded_videos,
-        )
-        return {"materials": downloaded_videos}
+        if stop_at == "materials":
+            sm.state.update_task(
+                task_id,
+                state=const.TASK_STATE_COMPLETE,
+                progress=100,
+                materials=downloaded_videos,
+            )
+            return {"materials": downloaded_videos}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
+        sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
 
-    # 6. Tạo video cuối cùng
-    final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
-    )
+        # 6. Tạo video cuối cùng
+        final_video_paths, combined_video_paths = generate_final_videos(
+            task_id, params, downloaded_videos, audio_file, subtitle_path, audio_duration
+        )
 
-    if not final_video_paths:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+        if not final_video_paths:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
 
-    logger.success(
-        f"Tác vụ podcast {task_id} hoàn thành, đã tạo {len(final_video_paths)} video."
-    )
+        logger.success(
+            f"Tác vụ podcast {task_id} hoàn thành, đã tạo {len(final_video_paths)} video."
+        )
 
-    kwargs = {
-        "videos": final_video_paths,
-        "combined_videos": combined_video_paths,
-        "script": podcast_script,
-        "dialogue_tts": podcast_dialogue_tts, # Lưu dialogue_tts
-        "dialogue_subtitle": podcast_dialogue_subtitle, # Lưu dialogue_subtitle
-        "terms": video_terms,
-        "audio_file": audio_file,
-        "audio_duration": audio_duration,
-        "subtitle_path": subtitle_path,
-        "materials": downloaded_videos,
-    }
-    sm.state.update_task(
-        task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
-    )
-    return kwargs
+        kwargs = {
+            "videos": final_video_paths,
+            "combined_videos": combined_video_paths,
+            "script": podcast_script,
+            "dialogue_tts": podcast_dialogue_tts, # Lưu dialogue_tts
+            "dialogue_subtitle": podcast_dialogue_subtitle, # Lưu dialogue_subtitle
+            "terms": video_terms,
+            "audio_file": audio_file,
+            "audio_duration": audio_duration,
+            "subtitle_path": subtitle_path,
+            "materials": downloaded_videos,
+        }
+        sm.state.update_task(
+            task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
+        )
+        return kwargs
 
 
 if __name__ == "__main__":
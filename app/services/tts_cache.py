@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+
+from edge_tts import SubMaker
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+
+# Cache TTS trên đĩa: mỗi mục gồm file audio "<key>.audio" và timing của
+# SubMaker "<key>.json", key = sha256 của (loại, văn bản đã chuẩn hóa, giọng,
+# tốc độ, tts_server). Mục ít dùng nhất (mtime cũ nhất) bị xóa khi vượt dung lượng.
+class TTSCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max(0, int(max_bytes))  # 0 = không giới hạn
+        self._lock = threading.Lock()
+        self._size = None  # tính khi cần lần đầu
+        self.hits = {"text": 0, "sentence": 0}
+        self.misses = {"text": 0, "sentence": 0}
+        self.evicted = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip()
+
+    @classmethod
+    def make_key(
+        cls,
+        text: str,
+        voice_name: str,
+        voice_rate: float,
+        tts_server: str,
+        kind: str = "text",
+    ) -> str:
+        raw = json.dumps(
+            [kind, cls.normalize_text(text), voice_name, float(voice_rate or 1.0), tts_server],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str):
+        sub_dir = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(sub_dir, f"{key}.audio"), os.path.join(sub_dir, f"{key}.json")
+
+    def get(self, key: str, kind: str = "text"):
+        """Trả về (đường dẫn audio, SubMaker) hoặc None."""
+        audio_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # cập nhật mtime để mục vừa dùng bị xóa sau cùng
+            os.utime(audio_path)
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses[kind] += 1
+            return None
+
+        sub_maker = SubMaker()
+        sub_maker.subs = meta["subs"]
+        sub_maker.offset = [tuple(o) for o in meta["offset"]]
+        with self._lock:
+            self.hits[kind] += 1
+        return audio_path, sub_maker
+
+    def _lost(self, kind: str):
+        # Mục bị xóa (giới hạn dung lượng) giữa lúc đọc json và đọc audio: tính là miss
+        with self._lock:
+            self.hits[kind] -= 1
+            self.misses[kind] += 1
+
+    def load(self, key: str, voice_file: str, kind: str = "text"):
+        # Sao chép audio trong cache ra voice_file và trả về SubMaker
+        entry = self.get(key, kind)
+        if entry is None:
+            return None
+        audio_path, sub_maker = entry
+        try:
+            shutil.copyfile(audio_path, voice_file)
+        except OSError:
+            self._lost(kind)
+            return None
+        return sub_maker
+
+    def read(self, key: str, kind: str = "text"):
+        """Trả về (bytes audio, SubMaker) hoặc None."""
+        entry = self.get(key, kind)
+        if entry is None:
+            return None
+        audio_path, sub_maker = entry
+        try:
+            with open(audio_path, "rb") as f:
+                return f.read(), sub_maker
+        except OSError:
+            self._lost(kind)
+            return None
+
+    def put(self, key: str, audio, sub_maker: SubMaker):
+        """audio: bytes hoặc đường dẫn file audio."""
+        audio_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if isinstance(audio, (bytes, bytearray)):
+                with open(audio_path + tmp_suffix, "wb") as f:
+                    f.write(audio)
+            else:
+                shutil.copyfile(audio, audio_path + tmp_suffix)
+            with open(meta_path + tmp_suffix, "w", encoding="utf-8") as f:
+                json.dump({"subs": sub_maker.subs, "offset": sub_maker.offset}, f, ensure_ascii=False)
+            # audio trước, json sau: get chỉ thấy mục khi json đã có
+            os.replace(audio_path + tmp_suffix, audio_path)
+            os.replace(meta_path + tmp_suffix, meta_path)
+        except OSError as e:
+            logger.warning(f"Ghi cache TTS thất bại: {str(e)}")
+            for path in (audio_path + tmp_suffix, meta_path + tmp_suffix):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        added = os.path.getsize(audio_path) + os.path.getsize(meta_path)
+        with self._lock:
+            if self._size is not None:
+                self._size += added
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(root, name)
+                audio_path = meta_path[: -len(".json")] + ".audio"
+                try:
+                    size = os.path.getsize(meta_path) + os.path.getsize(audio_path)
+                    entries.append((os.path.getmtime(meta_path), size, audio_path, meta_path))
+                except OSError:
+                    continue
+        return entries
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        with self._lock:
+            if self._size is not None and self._size <= self.max_bytes:
+                return
+            entries = self._entries()
+            self._size = sum(e[1] for e in entries)
+            if self._size <= self.max_bytes:
+                return
+            # Xóa tới 90% ngân sách để không phải quét thư mục sau mỗi lần ghi
+            target = self.max_bytes * 0.9
+            for _, size, audio_path, meta_path in sorted(entries):
+                if self._size <= target:
+                    break
+                for path in (meta_path, audio_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self._size -= size
+                self.evicted += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "size_bytes": self._size,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "evicted": self.evicted,
+            }
+
+
+cache = None
+if config.app.get("tts_cache_enabled", True):
+    cache = TTSCache(
+        cache_dir=config.app.get("tts_cache_dir", "") or utils.storage_dir("cache_tts", create=True),
+        max_bytes=int(config.app.get("tts_cache_max_mb", 1024)) * 1024 * 1024,
+    )
@@ -0,0 +1,142 @@
+import asyncio
+import random
+import threading
+from concurrent.futures import Future
+
+from loguru import logger
+
+from app.config import config
+
+
+# Dịch vụ chạy các job TTS bất đồng bộ trên một event loop dùng chung.
+# Thread của tác vụ gửi job vào và chờ kết quả, thay vì mỗi lần gọi lại
+# asyncio.run tạo rồi hủy một event loop mới.
+class TTSService:
+    def __init__(
+        self,
+        name: str,
+        concurrency: int = 4,
+        max_attempts: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 10.0,
+    ):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._loop = None
+        self._semaphore = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            ready = threading.Event()
+
+            def _run_loop():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                # Semaphore phải được tạo trong loop sẽ dùng nó
+                self._semaphore = asyncio.Semaphore(self.concurrency)
+                ready.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(
+                target=_run_loop, name=f"{self.name}-loop", daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+            logger.info(f"Khởi động dịch vụ {self.name}, số job đồng thời: {self.concurrency}")
+
+    async def _run(self, job_factory, label: str):
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                async with self._semaphore:
+                    with self._lock:
+                        self.queued -= 1
+                        self.active += 1
+                    try:
+                        result = await job_factory()
+                        with self._lock:
+                            self.completed += 1
+                        return result
+                    except Exception as e:
+                        if attempt >= self.max_attempts:
+                            raise
+                        logger.error(f"{label} thất bại, thử: {attempt}, lỗi: {str(e)}")
+                    finally:
+                        with self._lock:
+                            self.active -= 1
+                            self.queued += 1
+                with self._lock:
+                    self.retries += 1
+                # Chờ ngoài semaphore để job khác được chạy trong lúc backoff
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                await asyncio.sleep(delay * (0.5 + random.random() / 2))
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.queued -= 1
+
+    def submit(self, job_factory, label: str = "job") -> Future:
+        """
+        job_factory: hàm không tham số trả về coroutine, được gọi lại ở mỗi lần thử.
+        Trả về concurrent.futures.Future để thread gọi chờ kết quả.
+        """
+        self._ensure_started()
+        with self._lock:
+            self.queued += 1
+        return asyncio.run_coroutine_threadsafe(self._run(job_factory, label), self._loop)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "concurrency": self.concurrency,
+                "queued": self.queued,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retries": self.retries,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._thread = None
+        if loop is None or thread is None:
+            return
+
+        async def _cancel_jobs():
+            # Hủy job đang chờ/đang chạy trước khi dừng loop: thread đang chờ
+            # .result() nhận CancelledError thay vì chờ mãi
+            jobs = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if jobs:
+                logger.warning(f"Dừng dịch vụ {self.name}, hủy {len(jobs)} job chưa xong")
+            for job in jobs:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+            loop.stop()
+
+        asyncio.run_coroutine_threadsafe(_cancel_jobs(), loop)
+        thread.join(timeout=5)
+
+
+edge_service = TTSService(
+    "edge-tts",
+    concurrency=config.app.get("tts_chunk_concurrency", 4),
+    max_attempts=3,
+    backoff=float(config.app.get("tts_retry_backoff", 1.0)),
+)
@@ -1,3 +1,4 @@
+import bisect
 import glob
 import itertools
 import os
@@ -5,7 +6,9 @@ import random
 import numpy as np
 import gc
 import shutil
-from typing import List
+import time
+from typing import Callable, List
+from proglog import TqdmProgressBarLogger
 from loguru import logger
 from PIL import Image, ImageDraw, ImageFont
 from moviepy.video.fx.Resize import Resize
@@ -34,6 +37,7 @@ from app.models.schema import (
     VideoTransitionMode,
     VideoPodcastParams,
 )
+from app.services import alignment
 from app.services.utils import video_effects
 from app.utils import utils
 
@@ -59,6 +63,43 @@ video_codec = "libx264"
 fps = 30
 preset = "ultrafast"
 
+class RenderProgressLogger(TqdmProgressBarLogger):
+    """
+    Logger cho write_videofile: vẫn in thanh tiến độ như logger="bar" và gọi
+    callback({"frame", "total", "fps"}) tối đa mỗi interval giây.
+    """
+
+    def __init__(self, callback: Callable[[dict], None], interval: float = 1.0):
+        super().__init__()
+        self.callback = callback
+        self.interval = interval
+        self._started_at = None
+        self._reported_at = 0.0
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        super().bars_callback(bar, attr, value, old_value)
+        if bar != "frame_index" or attr != "index":
+            return
+        now = time.time()
+        if self._started_at is None or value < (old_value or 0):
+            self._started_at = now
+        total = self.bars[bar].get("total") or 0
+        # index = số frame đã ghi xong
+        frame = min(value, total) if total else value
+        if now - self._reported_at < self.interval and frame < total:
+            return
+        self._reported_at = now
+        elapsed = now - self._started_at
+        try:
+            self.callback({
+                "frame": frame,
+                "total": total,
+                "fps": round(frame / elapsed, 2) if elapsed > 0 else 0,
+            })
+        except Exception as e:
+            logger.warning(f"Gửi tiến độ render thất bại: {str(e)}")
+
+
 def close_clip(clip):
     if clip is None:
         return
@@ -132,7 +173,8 @@ def combine_images(
     video_aspect: VideoAspect = VideoAspect.portrait,
     video_concat_mode: VideoConcatMode = VideoConcatMode.random,
     video_transition_mode: VideoTransitionMode = None,
-    threads: int = 2
+    threads: int = 2,
+    progress_logger: RenderProgressLogger = None
 ) -> str:
 
     logger.info("🔄 Bắt đầu quá trình kết hợp image")
@@ -207,7 +249,7 @@ def combine_images(
         threads=threads,
         audio_codec="aac",
         preset=preset,
-        logger="bar",
+        logger=progress_logger or "bar",
         temp_audiofile_path=output_dir
     )
 
@@ -228,7 +270,8 @@ def combine_videos(
     video_concat_mode: VideoConcatMode = VideoConcatMode.random,
     video_transition_mode: VideoTransitionMode = None,
     max_clip_duration: int = 5,
-    threads: int = 4
+    threads: int = 4,
+    progress_logger: RenderProgressLogger = None
 ) -> str:
 
     logger.info("🔄 Bắt đầu quá trình kết hợp video")
@@ -327,7 +370,7 @@ def combine_videos(
     final_video.write_videofile(
         combined_video_path,
         threads=threads,
-        logger="bar",
+        logger=progress_logger or "bar",
         temp_audiofile_path=output_dir,
         audio_codec="aac",
         fps=fps,
@@ -441,8 +484,18 @@ def typewriter_word_clip(text,
                          words_per_sec=3,
                          video_w=1080, video_h=1920,
                          subtitle_position="center",
-                         custom_pos=70):
-    words = re.findall(r"\S+", text)
+                         custom_pos=70,
+                         word_times=None):
+    """
+    word_times: [(từ, bắt đầu)] theo giây tính từ đầu clip, lấy từ file timing
+    từng từ; không có thì hiện đều words_per_sec từ mỗi giây.
+    """
+    if word_times:
+        words  = [w for w, _ in word_times]
+        starts = [s for _, s in word_times]
+    else:
+        words  = re.findall(r"\S+", text)
+        starts = None
     font  = ImageFont.truetype(font_path, font_size)
 
     # ------- hàm tạo frame ----------
@@ -450,7 +503,10 @@ def typewriter_word_clip(text,
         img = Image.new("RGBA", (video_w, video_h), (0,0,0,0))
         draw = ImageDraw.Draw(img)
 
-        idx = int(t * words_per_sec)
+        if starts is not None:
+            idx = max(0, bisect.bisect_right(starts, t) - 1)
+        else:
+            idx = int(t * words_per_sec)
         if idx < len(words):
             word = words[idx]
             w, h = font.getbbox(word)[2:]
@@ -474,7 +530,7 @@ def typewriter_word_clip(text,
 
         return np.array(img)
 
-    clip_dur = max(duration, len(words)/words_per_sec)
+    clip_dur = duration if starts is not None else max(duration, len(words)/words_per_sec)
     return VideoClip(frame_function=make_frame,
                      duration=clip_dur).with_fps(24)
 
@@ -483,7 +539,8 @@ def generate_video(
     audio_path: str,
     subtitle_path: str,
     output_file: str,
-    params: VideoParams
+    params: VideoParams,
+    progress_logger: RenderProgressLogger = None
 ):
     font_size    = int(round(params.font_size))
     stroke_width = int(round(params.stroke_width))
@@ -508,10 +565,42 @@ def generate_video(
 
         logger.info(f"  ⑤ phông chữ: {font_path}")
 
+    # Timing từng từ (nếu có) cho chế độ word2word
+    word_timings = []
+    if params.subtitle_enabled and params.type_subtitle == "word2word" and subtitle_path:
+        try:
+            word_timings = alignment.load_word_timings(subtitle_path)
+        except Exception as e:
+            logger.warning(f"Đọc timing từng từ thất bại: {str(e)}")
+    word_starts = [w["start"] for w in word_timings]
+
+    def words_in(start_t, end_t):
+        # Các từ bắt đầu trong khoảng của dòng phụ đề, thời gian tính từ đầu dòng
+        lo = bisect.bisect_left(word_starts, start_t - 0.05)
+        hi = bisect.bisect_left(word_starts, end_t)
+        return [(w["word"], max(0.0, w["start"] - start_t)) for w in word_timings[lo:hi]]
+
+    # Podcast: màu chữ theo người nói của lượt thoại chứa dòng phụ đề
+    speaker_turns = []
+    host2_color = getattr(params, "text_fore_color2", "")
+    if params.subtitle_enabled and host2_color:
+        try:
+            speaker_turns = alignment.load_speaker_timings(audio_path)
+        except Exception as e:
+            logger.warning(f"Đọc timing người nói thất bại: {str(e)}")
+    turn_ends = [turn["end"] for turn in speaker_turns]
+
+    def fore_color_at(start_t, end_t):
+        index = bisect.bisect_left(turn_ends, (start_t + end_t) / 2)
+        if index < len(speaker_turns) and speaker_turns[index]["host"] == 2:
+            return host2_color
+        return params.text_fore_color
+
     def create_text_clip(subtitle_item):
         type_subtitle = params.type_subtitle
         (start_t, end_t), phrase = subtitle_item
         duration = end_t - start_t
+        fore_color = fore_color_at(start_t, end_t)
         if type_subtitle == "normal":
             max_width = video_width * 0.9
             wrapped_txt, txt_height = wrap_text(
@@ -524,7 +613,7 @@ def generate_video(
                 text=wrapped_txt,
                 font=font_path,
                 font_size=font_size,
-                color=params.text_fore_color,
+                color=fore_color,
                 bg_color=params.text_background_color,
                 stroke_color=params.stroke_color,
                 stroke_width=stroke_width,
@@ -559,7 +648,7 @@ def generate_video(
                 text=phrase,
                 font_path=font_path,
                 font_size=font_size,
-                color=params.text_fore_color,
+                color=fore_color,
                 stroke_color=params.stroke_color,
                 stroke_width=stroke_width,
                 duration=duration,
@@ -586,7 +675,7 @@ def generate_video(
                         text           = phrase,
                         font_path      = font_path,
                         font_size      = font_size,
-                        color          = params.text_fore_color,
+                        color          = fore_color,
                         stroke_color   = params.stroke_color,
                         stroke_width   = stroke_width,
                         duration       = duration,
@@ -595,6 +684,7 @@ def generate_video(
                         video_h        = video_height,
                         subtitle_position = params.subtitle_position,
                         custom_pos     = params.custom_position,
+                        word_times     = words_in(start_t, end_t),
                     )
                     .with_start(start_t)
                     .with_end(end_t))
@@ -649,7 +739,7 @@ def generate_video(
         audio_codec=audio_codec,
         temp_audiofile_path=output_dir,
         threads=params.n_threads or 2,
-        logger="bar",
+        logger=progress_logger or "bar",
         fps=fps,
         preset=preset,
         ffmpeg_params=ffmpeg_extra,
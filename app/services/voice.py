@@ -1,6 +1,8 @@
 import asyncio
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Union
 from xml.sax.saxutils import unescape
@@ -14,10 +16,9 @@ from moviepy.video.tools import subtitles
 # from edge_tts.submaker import mktimestamp
 
 import ffmpeg
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-import tempfile
 
 from app.config import config
+from app.services import alignment, tts_cache, tts_service
 from app.utils import utils
 
 
@@ -96,14 +97,27 @@ def tts(
     gemini_key: str,
     voice_volume: float = 1.0,
 ) -> Union[SubMaker, None]:
+    cache = tts_cache.cache
+    key = None
+    if cache is not None:
+        key = cache.make_key(text, voice_name, voice_rate, tts_server)
+        sub_maker = cache.load(key, voice_file)
+        if sub_maker is not None:
+            logger.info(f"Dùng giọng nói trong cache TTS, tệp đầu ra: {voice_file}")
+            return sub_maker
+
     if tts_server == "gemini":
-        return get_audio_raw(text, voice_name, voice_file, gemini_key)
+        sub_maker = get_audio_raw(text, voice_name, voice_file, gemini_key)
+    elif is_azure_v2_voice(voice_name):
+        # Sử dụng Azure TTS v2 cho các giọng nói đa ngôn ngữ
+        sub_maker = azure_tts_v2(text, voice_name, voice_file)
     else:
-        if is_azure_v2_voice(voice_name):
-            # Sử dụng Azure TTS v2 cho các giọng nói đa ngôn ngữ
-            return azure_tts_v2(text, voice_name, voice_file)
         # Mặc định sử dụng Azure TTS v1 (Edge TTS)
-        return azure_tts_v1(text, voice_name, voice_rate, voice_file)
+        sub_maker = azure_tts_v1(text, voice_name, voice_rate, voice_file)
+
+    if key is not None and sub_maker is not None and sub_maker.subs and os.path.exists(voice_file):
+        cache.put(key, voice_file, sub_maker)
+    return sub_maker
 
 
 def convert_rate_to_percent(rate: float) -> str:
@@ -116,39 +130,121 @@ def convert_rate_to_percent(rate: float) -> str:
         return f"{percent}%"
 
 
+# Edge TTS trả về MP3 CBR 48 kbit/s (audio-24khz-48kbitrate-mono-mp3), nên
+# thời lượng một đoạn tính được từ số byte: dùng để nối timeline các đoạn
+_EDGE_MP3_BITRATE = 48000
+# Kịch bản dài được tách theo câu thành các đoạn tối đa N ký tự và tổng hợp song song
+# (số đoạn đồng thời: tts_chunk_concurrency, xem tts_service.edge_service)
+_tts_chunk_chars = int(config.app.get("tts_chunk_chars", 600) or 0)
+
+
+def _split_sentences(text: str) -> list[str]:
+    # Giữ nguyên dấu câu để giọng đọc không bị đổi ngữ điệu
+    parts = re.split(r"(?<=[.!?。！？;；…])\s+|\n+", text)
+    return [p.strip() for p in parts if p and p.strip()]
+
+
+def _chunk_text(text: str, max_chars: int) -> list[str]:
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+    chunks = []
+    current = ""
+    for sentence in _split_sentences(text):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _edge_stream(text: str, voice_name: str, rate: str):
+    # Tách riêng để có thể thay bằng luồng giả khi kiểm thử
+    communicate = edge_tts.Communicate(text, voice_name, rate=rate)
+    async for chunk in communicate.stream():
+        yield chunk
+
+
+async def _edge_synthesize(text: str, voice_name: str, rate: str):
+    audio = bytearray()
+    sub_maker = SubMaker()
+    async for chunk in _edge_stream(text, voice_name, rate):
+        if chunk["type"] == "audio":
+            audio.extend(chunk["data"])
+        elif chunk["type"] == "WordBoundary":
+            sub_maker.create_sub((chunk["offset"], chunk["duration"]), chunk["text"])
+    if not audio or not sub_maker.subs:
+        raise ValueError("sub_maker là None hoặc sub_maker.subs là None")
+    return bytes(audio), sub_maker
+
+
+def _merge_sub_makers(parts) -> SubMaker:
+    """Nối (audio, SubMaker) của các đoạn thành một timeline liên tục."""
+    merged = SubMaker()
+    shift = 0
+    for audio, sub_maker in parts:
+        merged.subs.extend(sub_maker.subs)
+        merged.offset.extend((start + shift, end + shift) for start, end in sub_maker.offset)
+        # offset tính theo đơn vị 100ns
+        shift += len(audio) * 8 * 10_000_000 // _EDGE_MP3_BITRATE
+    return merged
+
+
 def azure_tts_v1(
     text: str, voice_name: str, voice_rate: float, voice_file: str
 ) -> Union[SubMaker, None]:
     voice_name = parse_voice_name(voice_name)
     text = text.strip()
     rate_str = convert_rate_to_percent(voice_rate)
-    for i in range(3):
+    cache = tts_cache.cache
+    # Có cache: mỗi câu là một mục cache và một request, nên kịch bản sửa một
+    # câu chỉ tổng hợp lại câu đó. Không cache: gộp câu thành đoạn tts_chunk_chars
+    if cache is not None:
+        chunks = _split_sentences(text) or [text]
+    else:
+        chunks = _chunk_text(text, _tts_chunk_chars)
+    logger.info(f"Bắt đầu, tên giọng nói: {voice_name}, số đoạn: {len(chunks)}")
+
+    # Đoạn có trong cache được lấy ngay, các đoạn còn lại gửi vào dịch vụ
+    # edge-tts dùng chung (giới hạn đồng thời toàn process, chỉ thử lại đoạn lỗi)
+    parts = [None] * len(chunks)
+    futures = {}
+    for index, chunk in enumerate(chunks):
+        key = None
+        if cache is not None:
+            key = cache.make_key(chunk, voice_name, voice_rate, "azure-tts-v1", kind="sentence")
+            parts[index] = cache.read(key, kind="sentence")
+            if parts[index] is not None:
+                continue
+        futures[index] = (
+            key,
+            tts_service.edge_service.submit(
+                lambda chunk=chunk: _edge_synthesize(chunk, voice_name, rate_str),
+                label=f"Đoạn {index + 1}/{len(chunks)}",
+            ),
+        )
+
+    for index, (key, future) in futures.items():
         try:
-            logger.info(f"Bắt đầu, tên giọng nói: {voice_name}, thử: {i + 1}")
-
-            async def _do() -> SubMaker:
-                communicate = edge_tts.Communicate(text, voice_name, rate=rate_str)
-                sub_maker = edge_tts.SubMaker()
-                with open(voice_file, "wb") as file:
-                    async for chunk in communicate.stream():
-                        if chunk["type"] == "audio":
-                            file.write(chunk["data"])
-                        elif chunk["type"] == "WordBoundary":
-                            sub_maker.create_sub(
-                                (chunk["offset"], chunk["duration"]), chunk["text"]
-                            )
-                return sub_maker
+            parts[index] = future.result()
+        except Exception as e:
+            logger.error(f"Đoạn {index + 1}/{len(chunks)} thất bại, lỗi: {str(e)}")
+            continue
+        if key is not None:
+            cache.put(key, *parts[index])
 
-            sub_maker = asyncio.run(_do())
-            if not sub_maker or not sub_maker.subs:
-                logger.warning("Thất bại, sub_maker là None hoặc sub_maker.subs là None")
-                continue
+    if any(part is None for part in parts):
+        logger.warning("Thất bại, có đoạn không tổng hợp được giọng nói")
+        return None
 
-            logger.info(f"Hoàn thành, tệp đầu ra: {voice_file}")
-            return sub_maker
-        except Exception as e:
-            logger.error(f"Thất bại, lỗi: {str(e)}")
-    return None
+    with open(voice_file, "wb") as file:
+        for audio, _ in parts:
+            file.write(audio)
+    sub_maker = _merge_sub_makers(parts)
+    logger.info(f"Hoàn thành, tệp đầu ra: {voice_file}")
+    return sub_maker
 
 
 def azure_tts_v2(text: str, voice_name: str, voice_file: str) -> Union[SubMaker, None]:
@@ -272,139 +368,155 @@ def create_subtitle(sub_maker: submaker.SubMaker, text: str, subtitle_file: str)
         end_t = mktimestamp(end_time).replace(".", ",")
         return f"{idx}\n{start_t} --> {end_t}\n{sub_text}\n"
 
-    start_time = -1.0
-    sub_items = []
-    sub_index = 0
-
     script_lines = utils.split_string_by_punctuations(text)
     script_lines = utils.split_by_word_limit(script_lines, max_words=6)
-
-    def match_line(_sub_line: str, _sub_index: int):
-        if len(script_lines) <= _sub_index:
-            return ""
-
-        _line = script_lines[_sub_index]
-        if _sub_line == _line:
-            return script_lines[_sub_index].strip()
-
-        _sub_line_ = re.sub(r"[^\w\s]", "", _sub_line)
-        _line_ = re.sub(r"[^\w\s]", "", _line)
-        if _sub_line_ == _line_:
-            return _line_.strip()
-
-        _sub_line_ = re.sub(r"\W+", "", _sub_line)
-        _line_ = re.sub(r"\W+", "", _line)
-        if _sub_line_ == _line_:
-            return _line.strip()
-
-        return ""
-
-    sub_line = ""
+    if not script_lines or not sub_maker.offset:
+        logger.warning(
+            f"Thất bại, số mục phụ đề: {len(sub_maker.offset)}, số dòng kịch bản: {len(script_lines)}"
+        )
+        return
 
     try:
-        for _, (offset, sub) in enumerate(zip(sub_maker.offset, sub_maker.subs)):
-            _start_time, end_time = offset
-            if start_time < 0:
-                start_time = _start_time
-
-            sub = unescape(sub)
-            sub_line += sub
-            sub_text = match_line(sub_line, sub_index)
-            if sub_text:
-                sub_index += 1
-                line = formatter(
-                    idx=sub_index,
-                    start_time=start_time,
-                    end_time=end_time,
-                    sub_text=sub_text,
-                )
-                sub_items.append(line)
-                start_time = -1.0
-                sub_line = ""
-
-        if len(sub_items) == len(script_lines):
-            with open(subtitle_file, "w", encoding="utf-8") as file:
-                file.write("\n".join(sub_items) + "\n")
-            try:
-                sbs = subtitles.file_to_subtitles(subtitle_file, encoding="utf-8")
-                duration = max([tb for ((ta, tb), txt) in sbs])
-                logger.info(
-                    f"Hoàn thành, tệp phụ đề đã tạo: {subtitle_file}, thời lượng: {duration}"
-                )
-            except Exception as e:
-                logger.error(f"Thất bại, lỗi: {str(e)}")
-                os.remove(subtitle_file)
-        else:
-            logger.warning(
-                f"Thất bại, số mục phụ đề: {len(sub_items)}, số dòng kịch bản: {len(script_lines)}"
+        # Căn từ của SubMaker với kịch bản trong một lượt, chịu được từ lệch
+        line_timings, word_timings = alignment.align_words(
+            script_lines, sub_maker.subs, sub_maker.offset
+        )
+        sub_items = [
+            formatter(idx=i + 1, start_time=start, end_time=end, sub_text=line.strip())
+            for i, (line, (start, end)) in enumerate(zip(script_lines, line_timings))
+        ]
+        with open(subtitle_file, "w", encoding="utf-8") as file:
+            file.write("\n".join(sub_items) + "\n")
+        alignment.save_word_timings(
+            subtitle_file,
+            [(line, word, start / 10_000_000, end / 10_000_000) for line, word, start, end in word_timings],
+        )
+        try:
+            sbs = subtitles.file_to_subtitles(subtitle_file, encoding="utf-8")
+            duration = max([tb for ((ta, tb), txt) in sbs])
+            logger.info(
+                f"Hoàn thành, tệp phụ đề đã tạo: {subtitle_file}, thời lượng: {duration}"
             )
+        except Exception as e:
+            logger.error(f"Thất bại, lỗi: {str(e)}")
+            os.remove(subtitle_file)
 
     except Exception as e:
         logger.error(f"Thất bại, lỗi: {str(e)}")
 
-def convert_raw_to_mp3(raw_file, mp3_file, sample_rate=24000, channels=1):
+# Gemini/webhook trả về PCM thô: 24 kHz, mono, s16le
+_PCM_SAMPLE_RATE = 24000
+_PCM_CHANNELS = 1
+_PCM_SAMPLE_WIDTH = 2
+# "silence": căn dòng phụ đề theo khoảng lặng trong audio, "proportional": chia theo số ký tự
+_gemini_subtitle_alignment = config.app.get("gemini_subtitle_alignment", "silence")
+_GEMINI_TTS_URL = "https://workflow.doiquanai.vn/webhook/audio"
+# Số lượt thoại podcast được tổng hợp đồng thời
+_podcast_turn_concurrency = max(1, int(config.app.get("podcast_turn_concurrency", 4)))
+
+
+def encode_pcm_to_mp3(
+    chunks, mp3_file: str, sample_rate=_PCM_SAMPLE_RATE, channels=_PCM_CHANNELS,
+    envelope: alignment.PCMEnvelope = None,
+) -> Union[int, None]:
     """
-    Chuyển đổi tệp âm thanh PCM thô sang MP3 bằng ffmpeg.
-    sample_format thường là 's16le' (PCM 16bit little-endian), chỉnh lại cho đúng format của bạn.
+    Ghi lần lượt các khối PCM s16le vào stdin của ffmpeg để mã hóa MP3.
+    Trả về tổng số byte PCM, hoặc None nếu lỗi.
     """
-    (
+    process = (
         ffmpeg
-        .input(raw_file, format='s16le', ar=sample_rate, ac=channels)
-        .output(mp3_file, acodec='mp3')
-        .run(overwrite_output=True)
+        .input("pipe:", format="s16le", ar=sample_rate, ac=channels)
+        .output(mp3_file, acodec="mp3")
+        .global_args("-hide_banner", "-loglevel", "error")
+        .overwrite_output()
+        .run_async(pipe_stdin=True, quiet=True)
     )
+    total_bytes = 0
+    try:
+        for chunk in chunks:
+            if chunk:
+                process.stdin.write(chunk)
+                total_bytes += len(chunk)
+                if envelope is not None:
+                    envelope.feed(chunk)
+    except Exception as e:
+        logger.error(f"Nhận luồng audio TTS Gemini thất bại: {str(e)}")
+        process.kill()
+        process.communicate()
+        return None
 
-def get_audio_raw(
-    text: str,
-    voice_name: str,
-    voice_file: str,
-    gemini_key: str
-) -> submaker.SubMaker:
-    text = text.strip()
-    url = "https://workflow.doiquanai.vn/webhook/audio"
-    payload = {
-        "script": text, # Sử dụng dialogue_tts ở đây
-        "voice": voice_name,
-        "gemini_key": gemini_key
-    }
-    headers = {
-        "Content-Type": "application/json"
-    }
+    # communicate đóng stdin để ffmpeg kết thúc file MP3
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        logger.error(f"ffmpeg mã hóa MP3 thất bại: {stderr.decode('utf-8', errors='ignore')[-500:]}")
+        return None
+    return total_bytes
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".raw") as tmp_raw:
-        raw_path = tmp_raw.name
 
-    response = requests.post(url, json=payload, headers=headers)
-    if response.status_code == 200:
-        with open(raw_path, "wb") as f:
-            f.write(response.content)
-        convert_raw_to_mp3(raw_path, voice_file, sample_rate=24000, channels=1)
-        logger.success(f"Đã lưu TTS Gemini → {voice_file}")
-        os.remove(raw_path)
-    else:
-        logger.error(f"Lỗi khi gọi API TTS Gemini: {response.status_code} - {response.text}")
+def stream_pcm_to_mp3(
+    url: str,
+    payload: dict,
+    mp3_file: str,
+    sample_rate=_PCM_SAMPLE_RATE,
+    channels=_PCM_CHANNELS,
+    envelope: alignment.PCMEnvelope = None,
+) -> Union[float, None]:
+    """
+    Gọi webhook TTS và đưa luồng PCM nhận được thẳng vào stdin của ffmpeg để
+    mã hóa MP3, không ghi file tạm. Trả về thời lượng (giây) tính từ số byte
+    PCM, hoặc None nếu lỗi. envelope: nếu có, tính năng lượng PCM trong lúc nhận.
+    """
+    headers = {"Content-Type": "application/json"}
+    with requests.post(url, json=payload, headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            logger.error(f"Lỗi khi gọi API TTS Gemini: {response.status_code} - {response.text}")
+            return None
+        total_bytes = encode_pcm_to_mp3(
+            response.iter_content(chunk_size=64 * 1024),
+            mp3_file,
+            sample_rate=sample_rate,
+            channels=channels,
+            envelope=envelope,
+        )
+
+    if total_bytes is None:
         return None
+    if not total_bytes:
+        logger.error("API TTS Gemini không trả về dữ liệu audio")
+        return None
+    return total_bytes / (sample_rate * channels * _PCM_SAMPLE_WIDTH)
+
 
-    audio_clip = AudioFileClip(voice_file)
-    audio_duration = audio_clip.duration  # seconds
-    audio_clip.close()
+def _estimate_sub_maker(
+    text: str, audio_duration: float, envelope: alignment.PCMEnvelope = None
+) -> Union[submaker.SubMaker, None]:
+    # Chia thời lượng audio cho các dòng phụ đề theo số ký tự, hoặc căn theo
+    # khoảng lặng nếu có năng lượng PCM
     audio_duration_100ns = int(audio_duration * 10_000_000)
 
-    # Tách các câu thoại từ script
     lines = utils.split_string_by_punctuations(text)
     lines = utils.split_by_word_limit(lines, max_words=6)
-    
+
     if not lines:
         logger.warning(f"Không có dòng nào được trích xuất từ đối thoại phụ đề. Đối thoại gốc: '{text}'")
         return None
 
     total_chars = sum(len(line) for line in lines)
-    
+
     # Xử lý trường hợp total_chars = 0 để tránh chia cho 0
     if total_chars == 0:
         logger.warning(f"Tổng số ký tự trong đối thoại phụ đề là 0. Không thể ước tính thời lượng ký tự.")
         return None
 
+    if envelope is not None and _gemini_subtitle_alignment == "silence":
+        sub_maker = submaker.SubMaker()
+        for line, (start, end) in zip(
+            lines, alignment.align_lines(lines, envelope.rms, audio_duration)
+        ):
+            sub_maker.subs.append(line)
+            sub_maker.offset.append((int(start * 10_000_000), int(end * 10_000_000)))
+        return sub_maker
+
     char_duration = audio_duration_100ns / total_chars
 
     sub_maker = submaker.SubMaker()
@@ -418,6 +530,30 @@ def get_audio_raw(
 
     return sub_maker
 
+
+def get_audio_raw(
+    text: str,
+    voice_name: str,
+    voice_file: str,
+    gemini_key: str
+) -> submaker.SubMaker:
+    text = text.strip()
+    url = _GEMINI_TTS_URL
+    payload = {
+        "script": text, # Sử dụng dialogue_tts ở đây
+        "voice": voice_name,
+        "gemini_key": gemini_key
+    }
+
+    envelope = alignment.PCMEnvelope(_PCM_SAMPLE_RATE)
+    audio_duration = stream_pcm_to_mp3(url, payload, voice_file, envelope=envelope)
+    if audio_duration is None:
+        return None
+    logger.success(f"Đã lưu TTS Gemini → {voice_file}")
+
+    # Tách các câu thoại từ script
+    return _estimate_sub_maker(text, audio_duration, envelope)
+
 def get_audio_podcast_raw(
     dialogue_tts: str,
     dialogue_subtitle: str,
@@ -437,57 +573,138 @@ def get_audio_podcast_raw(
         "voice2": voice2,
         "gemini_key": gemini_key
     }
-    headers = {
-        "Content-Type": "application/json"
-    }
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".raw") as tmp_raw:
-        raw_path = tmp_raw.name
-
-    response = requests.post(url, json=payload, headers=headers)
-    if response.status_code == 200:
-        with open(raw_path, "wb") as f:
-            f.write(response.content)
-        convert_raw_to_mp3(raw_path, voice_file, sample_rate=24000, channels=1)
-        logger.success(f"Đã lưu TTS Gemini → {voice_file}")
-        os.remove(raw_path)
-    else:
-        logger.error(f"Lỗi khi gọi API TTS Gemini: {response.status_code} - {response.text}")
+    # Không có timing theo người nói: bỏ file của lần tạo trước (nếu có) để
+    # video không dùng timing lệch với audio mới
+    alignment.remove_speaker_timings(voice_file)
+    envelope = alignment.PCMEnvelope(_PCM_SAMPLE_RATE)
+    audio_duration = stream_pcm_to_mp3(url, payload, voice_file, envelope=envelope)
+    if audio_duration is None:
         return None
-
-    audio_clip = AudioFileClip(voice_file)
-    audio_duration = audio_clip.duration  # seconds
-    audio_clip.close()
-    audio_duration_100ns = int(audio_duration * 10_000_000)
+    logger.success(f"Đã lưu TTS Gemini → {voice_file}")
 
     # Tách các câu thoại từ dialogue_subtitle
-    lines = utils.split_string_by_punctuations(dialogue_subtitle) # Sử dụng dialogue_subtitle ở đây
-    lines = utils.split_by_word_limit(lines, max_words=6)
+    return _estimate_sub_maker(dialogue_subtitle, audio_duration, envelope)
 
-    if not lines:
-        logger.warning(f"Không có dòng nào được trích xuất từ đối thoại phụ đề. Đối thoại gốc: '{dialogue_subtitle}'")
+def parse_podcast_turns(dialogue_tts: str, host1: str, host2: str) -> list[tuple[int, str]]:
+    """
+    Tách dialogue_tts ("<host1>: ..." / "<host2>: ..." mỗi dòng) thành các lượt
+    thoại (1 hoặc 2, nội dung). Dòng không có tên người nói (ví dụ dòng hướng
+    dẫn giọng đọc ở đầu, xem parse_podcast_instruction) không phải lượt thoại.
+    """
+    prefixes = {1: f"{host1}:", 2: f"{host2}:"}
+    turns = []
+    for line in dialogue_tts.splitlines():
+        line = line.strip()
+        for host, prefix in prefixes.items():
+            if line.startswith(prefix):
+                text = line[len(prefix):].strip()
+                if text:
+                    turns.append((host, text))
+                break
+    return turns
+
+
+def parse_podcast_instruction(dialogue_tts: str, host1: str, host2: str) -> str:
+    """
+    Lấy các dòng hướng dẫn giọng đọc đứng trước lượt thoại đầu tiên (ví dụ
+    "Read aloud in a warm" do llm.generate_podcast_dialogue thêm vào).
+    """
+    prefixes = (f"{host1}:", f"{host2}:")
+    lines = []
+    for line in dialogue_tts.splitlines():
+        line = line.strip()
+        if line.startswith(prefixes):
+            break
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _fetch_pcm(url: str, payload: dict) -> bytes:
+    headers = {"Content-Type": "application/json"}
+    with requests.post(url, json=payload, headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"{response.status_code} - {response.text}")
+        pcm = b"".join(response.iter_content(chunk_size=64 * 1024))
+    if not pcm:
+        raise RuntimeError("API TTS Gemini không trả về dữ liệu audio")
+    return pcm
+
+
+def get_audio_podcast_turns(
+    turns: list[tuple[int, str]],
+    host1: str,
+    host2: str,
+    voice1: str,
+    voice2: str,
+    voice_file: str,
+    gemini_key: str,
+    instruction: str = "",
+) -> Union[submaker.SubMaker, None]:
+    """
+    Tổng hợp song song từng lượt thoại podcast bằng giọng của người nói, nối
+    PCM theo thứ tự rồi mã hóa MP3 một lần. Thời lượng từng lượt tính chính
+    xác từ số byte PCM; timing kèm người nói được lưu cạnh file audio
+    (alignment.speaker_timing_file) để tạo phụ đề theo từng người.
+    instruction: dòng hướng dẫn giọng đọc, đặt ở đầu script của mọi lượt
+    giống như khi gửi cả đoạn đối thoại.
+    """
+    voices = {1: voice1, 2: voice2}
+    names = {1: host1, 2: host2}
+    alignment.remove_speaker_timings(voice_file)
+
+    def _synthesize(index: int, host: int, text: str):
+        script = f"{instruction}\n{text}" if instruction else text
+        # Chỉ thử lại lượt bị lỗi, các lượt khác giữ kết quả
+        for attempt in range(1, 4):
+            try:
+                return _fetch_pcm(
+                    _GEMINI_TTS_URL,
+                    {"script": script, "voice": voices[host], "gemini_key": gemini_key},
+                )
+            except Exception as e:
+                logger.error(f"Lượt thoại {index + 1}/{len(turns)} thất bại, thử: {attempt}, lỗi: {str(e)}")
+                if attempt < 3:
+                    time.sleep(2 ** (attempt - 1))
         return None
 
-    total_chars = sum(len(line) for line in lines)
-    
-    # Xử lý trường hợp total_chars = 0 để tránh chia cho 0
-    if total_chars == 0:
-        logger.warning(f"Tổng số ký tự trong đối thoại phụ đề là 0. Không thể ước tính thời lượng ký tự.")
+    logger.info(f"Bắt đầu tổng hợp podcast, số lượt thoại: {len(turns)}")
+    with ThreadPoolExecutor(max_workers=_podcast_turn_concurrency) as pool:
+        pcms = list(pool.map(lambda args: _synthesize(*args), [(i, h, t) for i, (h, t) in enumerate(turns)]))
+    if any(pcm is None for pcm in pcms):
+        logger.error("Không thể tạo âm thanh cho tất cả lượt thoại podcast.")
         return None
 
-    char_duration = audio_duration_100ns / total_chars
+    if encode_pcm_to_mp3(pcms, voice_file) is None:
+        return None
+    logger.success(f"Đã lưu TTS Gemini → {voice_file}")
 
+    bytes_per_second = _PCM_SAMPLE_RATE * _PCM_CHANNELS * _PCM_SAMPLE_WIDTH
     sub_maker = submaker.SubMaker()
-    current_offset = 0
-    for line in lines:
-        line_chars = len(line)
-        duration = int(line_chars * char_duration)
-        sub_maker.subs.append(line)
-        sub_maker.offset.append((current_offset, current_offset + duration))
-        current_offset += duration
-
+    speakers = []
+    turn_start = 0.0
+    for (host, text), pcm in zip(turns, pcms):
+        duration = len(pcm) / bytes_per_second
+        envelope = alignment.PCMEnvelope(_PCM_SAMPLE_RATE)
+        envelope.feed(pcm)
+        turn_subs = _estimate_sub_maker(text, duration, envelope)
+        if turn_subs is not None:
+            shift = int(turn_start * 10_000_000)
+            sub_maker.subs.extend(turn_subs.subs)
+            sub_maker.offset.extend((a + shift, b + shift) for a, b in turn_subs.offset)
+        speakers.append({
+            "host": host,
+            "speaker": names[host],
+            "start": round(turn_start, 3),
+            "end": round(turn_start + duration, 3),
+            "text": text,
+        })
+        turn_start += duration
+    alignment.save_speaker_timings(voice_file, speakers)
     return sub_maker
 
+
 def get_audio_duration(sub_maker: submaker.SubMaker):
     """
     Tính tổng thời lượng âm thanh từ SubMaker.
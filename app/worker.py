@@ -0,0 +1,194 @@
+"""Worker độc lập cho hàng đợi Redis.
+
+Chạy: python -m app.worker [--concurrency N] [--worker-id ID]
+
+Worker chờ job trên hàng đợi Redis, chạy mọi loại job trong
+redis_manager.FUNC_MAP và định kỳ gửi heartbeat để API/quản trị biết
+worker nào còn sống. Có thể chạy nhiều worker trên nhiều máy cùng trỏ vào
+một Redis.
+
+Job được nhận bằng BLMOVE sang danh sách processing riêng của worker và giữ
+lease; heartbeat gia hạn lease của các job đang chạy. Mỗi worker cũng định kỳ
+đưa job có lease hết hạn (worker khác đã chết) về hàng đợi.
+"""
+
+import argparse
+import os
+import signal
+import threading
+import time
+from typing import Dict
+
+from loguru import logger
+
+from app.config import config
+from app.controllers.manager.redis_manager import RedisTaskManager, get_redis_url
+from app.models import const
+from app.services import media_cache, render, stage, subtitle, tts_service
+from app.services import state as sm
+
+
+class Worker:
+    def __init__(
+        self,
+        task_manager: RedisTaskManager,
+        concurrency: int,
+        worker_id: str = "",
+        poll_timeout: int = 5,
+        heartbeat_interval: int = 10,
+    ):
+        self.task_manager = task_manager
+        self.redis_client = task_manager.redis_client
+        self.concurrency = max(1, concurrency)
+        self.worker_id = worker_id or f"{config.hostname}-{os.getpid()}"
+        self.poll_timeout = poll_timeout
+        self.heartbeat_interval = heartbeat_interval
+
+        # Job đang chờ/chạy render trả chỗ (stage.task_slot) để job khác được nhận
+        self._slots = stage.TaskSlots(self.concurrency)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._jobs = {}  # job_id -> task_info của các job đang chạy
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.started_at = int(time.time())
+
+    @property
+    def heartbeat_key(self):
+        return f"worker:{self.worker_id}"
+
+    def heartbeat(self):
+        with self._lock:
+            info = {
+                "worker_id": self.worker_id,
+                "hostname": config.hostname,
+                "pid": os.getpid(),
+                "concurrency": self.concurrency,
+                "active": self.active,
+                "processed": self.processed,
+                "failed": self.failed,
+                "started_at": self.started_at,
+                "last_seen": int(time.time()),
+            }
+            job_ids = list(self._jobs.keys())
+        pipe = self.redis_client.pipeline()
+        pipe.hset(self.heartbeat_key, mapping=info)
+        # Heartbeat hết hạn nếu worker chết mà không kịp dọn dẹp
+        pipe.expire(self.heartbeat_key, self.heartbeat_interval * 3)
+        pipe.sadd(self.task_manager.workers_key, self.worker_id)
+        pipe.execute()
+        self.task_manager.extend_leases(job_ids)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Gửi heartbeat thất bại: {str(e)}")
+            try:
+                self.task_manager.requeue_expired()
+            except Exception as e:
+                logger.error(f"Thu hồi job hết hạn lease thất bại: {str(e)}")
+
+    def _run_job(self, task_info: Dict):
+        func = task_info["func"]
+        args = task_info.get("args", ())
+        kwargs = task_info.get("kwargs", {})
+        task_id = kwargs.get("task_id", "")
+        job_id = task_info.get("job_id") or task_id
+        with self._lock:
+            self.active += 1
+            self._jobs[job_id] = task_info
+        try:
+            logger.info(f"Worker {self.worker_id} chạy job: {func.__name__}, task: {task_id}")
+            with stage.task_slot(self._slots.release, self._slots.reacquire):
+                func(*args, **kwargs)
+            with self._lock:
+                self.processed += 1
+        except Exception as e:
+            logger.exception(f"Job thất bại: {func.__name__}, task: {task_id}, lỗi: {str(e)}")
+            with self._lock:
+                self.failed += 1
+            if task_id:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self._jobs.pop(job_id, None)
+            try:
+                self.task_manager.ack(self.worker_id, task_info)
+            except Exception as e:
+                # Không ack được: lease sẽ hết hạn và job được chạy lại
+                logger.error(f"Ack job {job_id} thất bại: {str(e)}")
+            self._slots.release()
+
+    def run(self):
+        logger.info(
+            f"Worker {self.worker_id} bắt đầu, hàng đợi: {self.task_manager.queue}, "
+            f"số job đồng thời: {self.concurrency}"
+        )
+        self.heartbeat()
+        heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat_thread.start()
+
+        while not self._stop.is_set():
+            # Chỉ lấy job khi còn chỗ, job còn lại để worker khác nhận
+            if not self._slots.acquire(timeout=self.poll_timeout):
+                continue
+            try:
+                task_info = self.task_manager.claim(self.worker_id, self.poll_timeout)
+            except Exception as e:
+                logger.error(f"Lấy job từ Redis thất bại: {str(e)}")
+                task_info = None
+                self._stop.wait(self.poll_timeout)
+            if not task_info:
+                self._slots.release()
+                continue
+
+            thread = threading.Thread(target=self._run_job, args=(task_info,))
+            thread.start()
+            self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+
+        logger.info(f"Worker {self.worker_id} đang dừng, chờ {self.active} job chạy xong")
+        for thread in self._threads:
+            thread.join()
+        self.redis_client.delete(self.heartbeat_key)
+        self.redis_client.srem(self.task_manager.workers_key, self.worker_id)
+        render.shutdown()
+        tts_service.edge_service.shutdown()
+        media_cache.cache.shutdown()
+        logger.info(f"Worker {self.worker_id} đã dừng")
+
+    def stop(self, *_):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AutoVideo Redis worker")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.app.get("max_concurrent_tasks", 5),
+        help="số job chạy đồng thời",
+    )
+    parser.add_argument("--worker-id", default="", help="mặc định: hostname-pid")
+    args = parser.parse_args()
+
+    if not config.app.get("enable_redis", False):
+        raise SystemExit("Worker cần enable_redis = true trong config.toml")
+
+    task_manager = RedisTaskManager(
+        max_concurrent_tasks=args.concurrency, redis_url=get_redis_url()
+    )
+    worker = Worker(task_manager, concurrency=args.concurrency, worker_id=args.worker_id)
+    subtitle.preload()
+    media_cache.start()
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
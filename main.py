@@ -12,5 +12,6 @@ if __name__ == "__main__":
         host=config.listen_host,
         port=config.listen_port,
         reload=config.reload_debug,
+        workers=config.listen_workers,
         log_level="warning",
     )
\ No newline at end of file
@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+
+from app.services import alignment
+
+_FRAMES_PER_SECOND = 1000 // alignment._FRAME_MS
+
+
+def _envelope(*parts):
+    """RMS giả theo khung 10ms: parts là (số giây, có tiếng nói hay không)."""
+    frames = [
+        np.full(int(round(seconds * _FRAMES_PER_SECOND)), 3000.0 if speech else 10.0)
+        for seconds, speech in parts
+    ]
+    return np.concatenate(frames).astype(np.float32)
+
+
+class TestFindPauses(unittest.TestCase):
+    def test_finds_silence_between_speech(self):
+        rms = _envelope((1.0, True), (0.3, False), (1.0, True))
+        pauses = alignment.find_pauses(rms)
+        self.assertEqual(len(pauses), 1)
+        self.assertAlmostEqual(pauses[0][0], 1.0)
+        self.assertAlmostEqual(pauses[0][1], 1.3)
+
+    def test_short_silence_is_ignored(self):
+        rms = _envelope((1.0, True), (0.05, False), (1.0, True), (0.3, False), (1.0, True))
+        self.assertEqual(len(alignment.find_pauses(rms)), 1)
+
+    def test_flat_or_empty_envelope_has_no_pauses(self):
+        self.assertEqual(alignment.find_pauses(np.zeros(0, dtype=np.float32)), [])
+        self.assertEqual(alignment.find_pauses(_envelope((2.0, True))), [])
+
+
+class TestAlignLines(unittest.TestCase):
+    lines = ["Câu thứ một.", "Câu thứ hai."]
+
+    def _assert_timings(self, timings, expected):
+        self.assertEqual(len(timings), len(expected))
+        for (start, end), (expected_start, expected_end) in zip(timings, expected):
+            self.assertAlmostEqual(start, expected_start)
+            self.assertAlmostEqual(end, expected_end)
+
+    def test_boundary_snaps_to_pause(self):
+        # Hai dòng cùng độ dài: ước tính ranh giới ở 1.15s, khoảng lặng ở 1.4-1.7s
+        rms = _envelope((1.4, True), (0.3, False), (0.6, True))
+        timings = alignment.align_lines(self.lines, rms, duration=2.3)
+        self._assert_timings(timings, [(0.0, 1.4), (1.7, 2.3)])
+
+    def test_falls_back_to_estimate_without_pause_in_range(self):
+        rms = _envelope((1.4, True), (0.3, False), (0.6, True))
+        timings = alignment.align_lines(self.lines, rms, duration=2.3, max_shift=0.2)
+        self._assert_timings(timings, [(0.0, 1.15), (1.15, 2.3)])
+
+    def test_leading_and_trailing_silence_is_trimmed(self):
+        rms = _envelope((0.5, False), (1.0, True), (0.3, False), (1.0, True), (0.5, False))
+        timings = alignment.align_lines(self.lines, rms, duration=3.3)
+        self._assert_timings(timings, [(0.5, 1.5), (1.8, 2.8)])
+
+
+
+class TestAlignWords(unittest.TestCase):
+    def _assert_words(self, word_timings, expected):
+        self.assertEqual([w[:2] for w in word_timings], [w[:2] for w in expected])
+        for (_, _, start, end), (_, _, expected_start, expected_end) in zip(word_timings, expected):
+            self.assertAlmostEqual(start, expected_start)
+            self.assertAlmostEqual(end, expected_end)
+
+    def test_spoken_form_is_skipped_and_interpolated(self):
+        # TTS đọc "10/5" thành "mười tháng năm": các từ này không khớp kịch bản
+        words = ["Ngày", "mười", "tháng", "năm", "trời", "đẹp"]
+        offsets = [(i, i + 1) for i in range(len(words))]
+        line_timings, word_timings = alignment.align_words(["Ngày 10/5 trời đẹp"], words, offsets)
+        self._assert_words(
+            word_timings,
+            [(0, "Ngày", 0, 1), (0, "10/5", 1, 4), (0, "trời", 4, 5), (0, "đẹp", 5, 6)],
+        )
+        self.assertEqual(line_timings, [(0, 6)])
+
+    def test_line_without_matching_words(self):
+        lines = ["Một hai", "ba bốn", "", "năm"]
+        words = ["Một", "hai", "năm"]
+        offsets = [(0, 1), (1, 2), (4, 5)]
+        line_timings, word_timings = alignment.align_words(lines, words, offsets)
+        # Dòng không được đọc nhận thời gian nội suy giữa hai dòng bên cạnh
+        self._assert_words(
+            word_timings,
+            [(0, "Một", 0, 1), (0, "hai", 1, 2), (1, "ba", 2, 3), (1, "bốn", 3, 4), (3, "năm", 4, 5)],
+        )
+        # Dòng rỗng dài 0 tại cuối dòng trước
+        self.assertEqual(line_timings, [(0, 2), (2, 4), (4, 4), (4, 5)])
+
+    def test_empty_offsets(self):
+        line_timings, word_timings = alignment.align_words(["Một hai", "ba"], [], [])
+        self.assertEqual(word_timings, [(0, "Một", 0, 0), (0, "hai", 0, 0), (1, "ba", 0, 0)])
+        self.assertEqual(line_timings, [(0, 0), (0, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
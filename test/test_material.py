@@ -0,0 +1,222 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from app.models.schema import MaterialInfo, VideoConcatMode
+from app.services import material, media_cache
+
+_SIZE = 3 * 1024 * 1024
+# material.time là module time dùng chung: giữ hàm sleep thật cho server
+_sleep = time.sleep
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get("Range")))
+        data = server.files[self.path]
+        _sleep(server.delays.get(self.path, 0))
+
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header:
+            start = int(range_header.split("=", 1)[1].rstrip("-"))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+
+        body = data[start:]
+        corrupt = server.corrupt.pop(self.path, None)
+        if corrupt:
+            # Process khác cùng ghi vào .part trong lúc tải
+            with open(corrupt, "ab") as f:
+                f.write(b"x" * 100)
+        if self.path in server.truncate and server.truncate[self.path] != 0:
+            # Đóng kết nối giữa chừng: gửi 1.5 MB rồi ngắt
+            server.truncate[self.path] -= 1
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.wfile.write(body)
+
+
+class TestDownload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.server.daemon_threads = True
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.files = {}
+        self.server.delays = {}
+        self.server.truncate = {}  # đường dẫn -> số lần cắt ngang (-1 = luôn cắt)
+        self.server.requests = []
+        self.server.corrupt = {}  # đường dẫn -> file .part bị ghi chen
+        self.dir = tempfile.TemporaryDirectory()
+        patch = mock.patch.object(material.time, "sleep")
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _serve(self, path, size=_SIZE):
+        data = os.urandom(size)
+        self.server.files[path] = data
+        return f"{self.base_url}{path}", data
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_resume_with_range(self):
+        url, data = self._serve("/a.mp4")
+        part_path = os.path.join(self.dir.name, "a.mp4.part")
+        with open(part_path, "wb") as f:
+            f.write(data[:1000])
+
+        self.assertTrue(material._download_to_part(url, part_path))
+        self.assertEqual(self._read(part_path), data)
+        self.assertEqual(self.server.requests, [("/a.mp4", "bytes=1000-")])
+
+    def test_truncated_response_is_resumed(self):
+        url, data = self._serve("/b.mp4")
+        self.server.truncate["/b.mp4"] = 1
+        part_path = os.path.join(self.dir.name, "b.mp4.part")
+
+        self.assertTrue(material._download_to_part(url, part_path))
+        self.assertEqual(self._read(part_path), data)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIsNone(self.server.requests[0][1])
+        # Lần thử lại tiếp tục từ phần đã ghi, không tải lại từ đầu
+        self.assertNotEqual(self.server.requests[1][1], None)
+        self.assertNotEqual(self.server.requests[1][1], "bytes=0-")
+
+    def test_truncation_is_detected(self):
+        url, _ = self._serve("/c.mp4")
+        self.server.truncate["/c.mp4"] = -1
+        part_path = os.path.join(self.dir.name, "c.mp4.part")
+
+        with self.assertRaises(Exception):
+            material._download_to_part(url, part_path)
+        self.assertEqual(len(self.server.requests), material._DOWNLOAD_ATTEMPTS)
+        self.assertLess(os.path.getsize(part_path), _SIZE)
+
+    def test_oversized_part_is_rejected(self):
+        url, data = self._serve("/f.mp4", size=1000)
+        part_path = os.path.join(self.dir.name, "f.mp4.part")
+        with open(part_path, "wb") as f:
+            f.write(data[:500])
+        self.server.corrupt["/f.mp4"] = part_path
+
+        self.assertTrue(material._download_to_part(url, part_path))
+        self.assertEqual(self._read(part_path), data)
+        # .part dư byte bị bỏ, lần thử sau tải lại từ đầu
+        self.assertEqual(self.server.requests, [("/f.mp4", "bytes=500-"), ("/f.mp4", None)])
+
+    def test_416_with_complete_part(self):
+        url, data = self._serve("/d.mp4")
+        part_path = os.path.join(self.dir.name, "d.mp4.part")
+        with open(part_path, "wb") as f:
+            f.write(data)
+
+        self.assertTrue(material._download_to_part(url, part_path))
+        self.assertEqual(self._read(part_path), data)
+        self.assertEqual(self.server.requests, [("/d.mp4", f"bytes={_SIZE}-")])
+
+    def test_416_with_oversized_part_restarts(self):
+        url, data = self._serve("/e.mp4", size=1000)
+        part_path = os.path.join(self.dir.name, "e.mp4.part")
+        with open(part_path, "wb") as f:
+            f.write(os.urandom(2000))
+
+        self.assertTrue(material._download_to_part(url, part_path))
+        self.assertEqual(self._read(part_path), data)
+        self.assertEqual(
+            self.server.requests, [("/e.mp4", "bytes=2000-"), ("/e.mp4", None)]
+        )
+
+    def test_concurrent_downloads_keep_list_order(self):
+        items = []
+        for i in range(4):
+            url, _ = self._serve(f"/v{i}.mp4", size=1000)
+            # Video đầu danh sách tải xong sau cùng
+            self.server.delays[f"/v{i}.mp4"] = (3 - i) * 0.1
+            items.append(MaterialInfo(provider="pexels", url=url, duration=5))
+
+        completed = []
+
+        def fake_save_video(video_url, save_dir="", cancel_event=None):
+            path = os.path.join(self.dir.name, os.path.basename(video_url))
+            material._download_to_part(video_url, path, cancel_event)
+            completed.append(os.path.basename(path))
+            return path
+
+        with mock.patch.object(material, "search_videos_pexels", return_value=items), mock.patch.object(
+            material, "save_video", side_effect=fake_save_video
+        ), mock.patch.object(material, "download_concurrency", 4):
+            paths = material.download_videos(
+                task_id="test",
+                search_terms=["cat"],
+                video_contact_mode=VideoConcatMode.sequential,
+                audio_duration=60,
+                max_clip_duration=5,
+            )
+
+        self.assertEqual(
+            [os.path.basename(p) for p in paths], [f"v{i}.mp4" for i in range(4)]
+        )
+        # Tải song song: video cuối danh sách (chờ ít nhất) xong trước
+        self.assertEqual(completed, [f"v{i}.mp4" for i in reversed(range(4))])
+
+
+@unittest.skipIf(media_cache.fcntl is None, "cần fcntl")
+class TestStoreLock(unittest.TestCase):
+    def test_lock_excludes_other_open_files(self):
+        # flock khóa theo file mở, nên hai lần mở trong một process loại trừ
+        # nhau giống như hai process
+        with tempfile.TemporaryDirectory() as d:
+            cache = media_cache.MediaCache(d)
+            path = os.path.join(d, "vid-a.mp4")
+            entered = threading.Event()
+
+            def other():
+                with cache.lock(path):
+                    entered.set()
+
+            with cache.lock(path):
+                thread = threading.Thread(target=other)
+                thread.start()
+                self.assertFalse(entered.wait(0.3))
+            self.assertTrue(entered.wait(5))
+            thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from app.controllers.v1 import video
+from app.services.media_cache import MediaCache
+from app.services.state import MemoryState
+
+
+class TestMediaCachePin(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = MediaCache(self.dir.name, max_bytes=1000, pin_seconds=0)
+        self.path = os.path.join(self.dir.name, "vid-a.mp4")
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * 2000)
+        old = time.time() - 60
+        os.utime(self.path, (old, old))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_paths_added_later_stay_pinned_until_exit(self):
+        with self.cache.pin() as pin:
+            # Tài liệu tải xong giữa chừng tác vụ được ghim thêm
+            pin([self.path])
+            self.assertEqual(self.cache.sweep(), 0)
+            self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(self.cache.stats()["pinned"], 0)
+        self.assertEqual(self.cache.sweep(), 2000)
+        self.assertFalse(os.path.exists(self.path))
+
+
+
+class TestMediaCacheStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = os.path.join(self.dir.name, "store")
+        self.task_dir = os.path.join(self.dir.name, "tasks", "t1")
+        os.makedirs(self.store)
+        self.cache = MediaCache(self.store, max_bytes=1000, pin_seconds=0)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _commit(self, name, data):
+        part_path = os.path.join(self.store, f"{name}.part")
+        with open(part_path, "wb") as f:
+            f.write(data)
+        video_path = os.path.join(self.store, name)
+        digest = self.cache.commit(part_path, video_path)
+        old = time.time() - 60
+        os.utime(video_path, (old, old))
+        return video_path, os.path.join(self.cache.hash_dir, f"{digest}.mp4")
+
+    def test_identical_bytes_share_one_inode(self):
+        first, blob = self._commit("vid-a.mp4", b"\1" * 2000)
+        second, _ = self._commit("vid-b.mp4", b"\1" * 2000)
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertTrue(os.path.samefile(first, blob))
+        self.assertFalse(os.path.exists(f"{second}.part"))
+        self.assertEqual(self.cache.stats()["deduplicated"], 1)
+        # Hai URL cùng nội dung được tính là một mục
+        self.cache.max_bytes = 0
+        self.cache.sweep()
+        self.assertEqual(self.cache.stats()["size_bytes"], 2000)
+
+    def test_task_link_survives_eviction_and_orphan_is_removed(self):
+        video_path, blob = self._commit("vid-a.mp4", b"\2" * 2000)
+        task_path = self.cache.link_into(video_path, self.task_dir)
+
+        self.assertEqual(self.cache.sweep(), 2000)
+        self.assertFalse(os.path.exists(video_path))
+        with open(task_path, "rb") as f:
+            self.assertEqual(f.read(), b"\2" * 2000)
+        # Thư mục tác vụ còn trỏ tới nội dung: bản theo nội dung được giữ
+        self.assertTrue(os.path.exists(blob))
+
+        os.remove(task_path)
+        self.assertEqual(os.stat(blob).st_nlink, 1)
+        self.cache.sweep()
+        self.assertFalse(os.path.exists(blob))
+
+    def test_delete_task_keeps_store_copy(self):
+        video_path, _ = self._commit("vid-a.mp4", b"\3" * 2000)
+        task_path = self.cache.link_into(video_path, self.task_dir)
+        state = MemoryState()
+        state.update_task("t1", progress=10)
+
+        with mock.patch.object(video.sm, "state", state), mock.patch.object(
+            video.utils, "task_dir", return_value=os.path.dirname(self.task_dir)
+        ):
+            video.delete_video(SimpleNamespace(headers={}), "t1")
+
+        self.assertFalse(os.path.exists(task_path))
+        self.assertIsNone(state.get_task("t1"))
+        with open(video_path, "rb") as f:
+            self.assertEqual(f.read(), b"\3" * 2000)
+        self.assertEqual(os.stat(video_path).st_nlink, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
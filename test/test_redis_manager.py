@@ -0,0 +1,94 @@
+import json
+import time
+import unittest
+
+import fakeredis
+
+from app.controllers.manager.redis_manager import RedisTaskManager
+from app.models import const
+from app.models.schema import VideoParams
+from app.services import state as sm
+from app.services import task as tm
+
+
+class TestRedisTaskManager(unittest.TestCase):
+    def setUp(self):
+        self.manager = RedisTaskManager(
+            max_concurrent_tasks=1,
+            redis_url="redis://localhost:6379/0",
+            external_workers=True,
+        )
+        self.manager.redis_client = fakeredis.FakeRedis()
+        self.manager.lease_timeout = 60
+        self.manager.max_attempts = 2
+        self.redis = self.manager.redis_client
+        self.worker_id = "worker-test"
+        self.redis.sadd(self.manager.workers_key, self.worker_id)
+
+    def _enqueue(self, task_id: str = "task-1"):
+        self.manager.add_task(
+            tm.start, task_id=task_id, params=VideoParams(video_subject="test")
+        )
+
+    def _expire_leases(self):
+        for job_id in self.redis.zrange(self.manager.leases_key, 0, -1):
+            self.redis.zadd(self.manager.leases_key, {job_id: time.time() - 1})
+
+    def test_enqueue_claim_ack(self):
+        self._enqueue()
+        self.assertEqual(self.redis.llen(self.manager.queue), 1)
+
+        task_info = self.manager.claim(self.worker_id, timeout=1)
+        self.assertIs(task_info["func"], tm.start)
+        self.assertIsInstance(task_info["kwargs"]["params"], VideoParams)
+        self.assertEqual(task_info["kwargs"]["task_id"], "task-1")
+        self.assertTrue(self.manager.is_queue_empty())
+        processing_key = self.manager.processing_key(self.worker_id)
+        self.assertEqual(self.redis.llen(processing_key), 1)
+        self.assertIsNotNone(
+            self.redis.zscore(self.manager.leases_key, task_info["job_id"])
+        )
+
+        self.manager.ack(self.worker_id, task_info)
+        self.assertEqual(self.redis.llen(processing_key), 0)
+        self.assertEqual(self.redis.zcard(self.manager.leases_key), 0)
+
+    def test_extend_leases_keeps_job(self):
+        self._enqueue()
+        task_info = self.manager.claim(self.worker_id, timeout=1)
+        self.manager.extend_leases([task_info["job_id"]])
+        self.assertEqual(self.manager.requeue_expired(), 0)
+        self.assertTrue(self.manager.is_queue_empty())
+
+    def test_expired_lease_is_requeued(self):
+        self._enqueue()
+        task_info = self.manager.claim(self.worker_id, timeout=1)
+        self._expire_leases()
+
+        self.assertEqual(self.manager.requeue_expired(), 1)
+        self.assertEqual(self.redis.llen(self.manager.processing_key(self.worker_id)), 0)
+        self.assertEqual(self.redis.zcard(self.manager.leases_key), 0)
+
+        job = json.loads(self.redis.lindex(self.manager.queue, 0))
+        self.assertEqual(job["job_id"], task_info["job_id"])
+        self.assertEqual(job["attempts"], 1)
+
+    def test_dead_letter_after_max_attempts(self):
+        sm.state.update_task("task-dead", state=const.TASK_STATE_PROCESSING)
+        self._enqueue("task-dead")
+        for _ in range(self.manager.max_attempts):
+            self.assertIsNotNone(self.manager.claim(self.worker_id, timeout=1))
+            self._expire_leases()
+            self.assertEqual(self.manager.requeue_expired(), 1)
+
+        self.assertTrue(self.manager.is_queue_empty())
+        self.assertEqual(self.redis.llen(self.manager.dead_letter_key), 1)
+        job = json.loads(self.redis.lindex(self.manager.dead_letter_key, 0))
+        self.assertEqual(job["attempts"], self.manager.max_attempts)
+        self.assertEqual(
+            sm.state.get_task("task-dead")["state"], const.TASK_STATE_FAILED
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from app.services.search_cache import DiskSearchCache, RedisSearchCache, SearchCache
+
+
+class TestDiskSearchCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_base_class_is_abstract(self):
+        with self.assertRaises(TypeError):
+            SearchCache(ttl=60)
+
+    def test_set_purges_expired_entries_once_per_ttl(self):
+        cache = DiskSearchCache(self.dir.name, ttl=60)
+        cache.set("old", [{"url": "a"}])
+        expired = time.time() - 120
+        os.utime(cache._path("old"), (expired, expired))
+
+        # Vừa dọn lúc khởi động: chưa dọn lại
+        cache.set("new", [{"url": "b"}])
+        self.assertTrue(os.path.exists(cache._path("old")))
+
+        cache._last_purge -= 60
+        cache.set("newer", [{"url": "c"}])
+        self.assertFalse(os.path.exists(cache._path("old")))
+        self.assertEqual(cache.get("new"), [{"url": "b"}])
+
+
+class TestRedisSearchCache(unittest.TestCase):
+    def setUp(self):
+        with mock.patch("redis.StrictRedis", return_value=fakeredis.FakeStrictRedis()):
+            self.cache = RedisSearchCache(host="localhost", port=6379, db=0, password=None, ttl=60)
+
+    def test_lock_released_after_search(self):
+        key = self.cache.make_key("pexels", "cat", "9:16", 5)
+        self.assertEqual(self.cache.search(key, lambda: [{"url": "a"}]), [{"url": "a"}])
+        self.assertFalse(self.cache._redis.exists(f"{self.cache._key(key)}:lock"))
+        self.assertEqual(self.cache.get(key), [{"url": "a"}])
+
+    def test_lock_taken_by_other_worker_is_kept(self):
+        key = self.cache.make_key("pexels", "dog", "9:16", 5)
+        lock_key = f"{self.cache._key(key)}:lock"
+
+        def search():
+            # Khóa của mình hết hạn và worker khác lấy khóa mới
+            self.cache._redis.set(lock_key, "other")
+            return [{"url": "b"}]
+
+        self.cache.search(key, search)
+        self.assertEqual(self.cache._redis.get(lock_key), b"other")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import threading
+import unittest
+
+from app.controllers.manager.memory_manager import InMemoryTaskManager
+from app.services import stage
+
+
+class TestTaskAdmission(unittest.TestCase):
+    def test_io_stages_run_while_render_pool_is_full(self):
+        render_pool = stage.ResourcePool("render-test", cores=1)
+        io_pool = stage.StagePool("io-test", 2)
+        manager = InMemoryTaskManager(max_concurrent_tasks=2)
+        rendering = threading.Event()
+        finish_render = threading.Event()
+        io_done = threading.Event()
+
+        def render_task():
+            with render_pool.slot(cores=1):
+                rendering.set()
+                finish_render.wait(5)
+
+        def waiting_render_task():
+            # render_pool đã đầy: tác vụ này chờ render
+            with render_pool.slot(cores=1):
+                pass
+
+        def io_task():
+            with io_pool.slot():
+                io_done.set()
+
+        manager.add_task(render_task)
+        self.assertTrue(rendering.wait(5))
+        manager.add_task(waiting_render_task)
+        manager.add_task(io_task)
+        try:
+            # Hai tác vụ đầu chờ/chạy render không giữ chỗ: tác vụ I/O vẫn chạy
+            self.assertTrue(io_done.wait(5))
+            self.assertEqual(render_pool.stats()["waiting"], 1)
+        finally:
+            finish_render.set()
+
+    def test_worker_slots_reacquire_without_waiting(self):
+        slots = stage.TaskSlots(1)
+        self.assertTrue(slots.acquire(timeout=0))
+        with stage.task_slot(slots.release, slots.reacquire):
+            with stage.ResourcePool("render-test", cores=1).slot():
+                # Đang render: worker nhận được job khác
+                self.assertTrue(slots.acquire(timeout=0))
+        self.assertEqual(slots.active, 2)
+        self.assertFalse(slots.acquire(timeout=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,231 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from app.models import const
+from app.services.state import MemoryState, RedisState, SQLiteState
+
+
+class TestMemoryState(unittest.TestCase):
+    def test_delete_forgets_version(self):
+        state = MemoryState()
+        state.update_task("t1", progress=10)
+        version = state.task_version("t1")
+        state.delete_task("t1")
+        self.assertNotEqual(state.task_version("t1"), version)
+        self.assertNotIn("t1", state._notifier._versions)
+
+
+class TestRedisState(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.listeners = 0
+
+    def _state(self, progress_interval=0.2):
+        # Mỗi RedisState giả lập một process (API, worker) dùng chung một Redis
+        client = fakeredis.FakeStrictRedis(server=self.server)
+        with mock.patch("redis.StrictRedis", return_value=client):
+            state = RedisState(progress_interval=progress_interval)
+        self.listeners += 1
+        self._wait_subscribed(state, self.listeners)
+        return state
+
+    def _wait_subscribed(self, state, count):
+        # Chờ luồng nghe đăng ký xong (lần đăng ký đầu làm mới cache delta)
+        self._wait(lambda: state._redis.pubsub_numsub(state._events_channel)[0][1] >= count)
+
+    def _state_members(self, state, value):
+        return {m.decode("utf-8") for m in state._redis.zrange(state._state_key(value), 0, -1)}
+
+    def test_progress_within_interval_is_flushed(self):
+        state = self._state(progress_interval=0.2)
+        state.update_task("t1", progress=0)
+        state.update_task("t1", progress=10)
+        state.update_task("t1", progress=20)
+        raw = state._redis.hget(state._task_key("t1"), "progress")
+        self.assertEqual(raw, b"0")
+        # Trong process ghi, giá trị đang chờ được trả về ngay
+        self.assertEqual(state.get_task("t1")["progress"], 20)
+
+        time.sleep(0.6)
+        self.assertEqual(state._redis.hget(state._task_key("t1"), "progress"), b"20")
+
+    def test_state_change_replaces_pending_progress(self):
+        state = self._state(progress_interval=10)
+        state.update_task("t1", progress=0)
+        state.update_task("t1", progress=30)
+        state.update_task("t1", state=const.TASK_STATE_COMPLETE, progress=100)
+        state.flush()
+        task = self._state(progress_interval=10).get_task("t1")
+        self.assertEqual(task["state"], const.TASK_STATE_COMPLETE)
+        self.assertEqual(task["progress"], 100)
+
+    def test_state_index_consistent_across_processes(self):
+        api = self._state()
+        worker = self._state()
+        api.update_task("t1", state=const.TASK_STATE_PROCESSING)
+        worker.update_task("t1", state=const.TASK_STATE_COMPLETE, progress=100)
+        # API chỉ biết state cũ (PROCESSING) trong cache của nó
+        api.update_task("t1", state=const.TASK_STATE_FAILED)
+
+        self.assertEqual(api.get_task("t1")["state"], const.TASK_STATE_FAILED)
+        self.assertEqual(self._state_members(api, const.TASK_STATE_FAILED), {"t1"})
+        self.assertEqual(self._state_members(api, const.TASK_STATE_COMPLETE), set())
+        self.assertEqual(self._state_members(api, const.TASK_STATE_PROCESSING), set())
+
+        tasks, total = api.get_all_tasks(1, 10, state=const.TASK_STATE_FAILED)
+        self.assertEqual(total, 1)
+        self.assertEqual(tasks[0]["task_id"], "t1")
+
+    def _wait(self, predicate, timeout=5):
+        deadline = time.time() + timeout
+        while not predicate():
+            if time.time() > deadline:
+                self.fail("hết thời gian chờ")
+            time.sleep(0.01)
+
+    def test_rewrite_of_cached_state_is_not_dropped(self):
+        api = self._state()
+        worker = self._state()
+        api.update_task("t1", state=const.TASK_STATE_PROCESSING)
+        worker.update_task("t1", state=const.TASK_STATE_FAILED)
+        # Cache của api vẫn là PROCESSING: ghi lại giá trị cũ không được bị bỏ
+        api.update_task("t1", state=const.TASK_STATE_PROCESSING)
+        self.assertEqual(worker.get_task("t1")["state"], const.TASK_STATE_PROCESSING)
+        self.assertEqual(self._state_members(api, const.TASK_STATE_PROCESSING), {"t1"})
+
+    def test_event_from_other_process_invalidates_cache(self):
+        api = self._state()
+        worker = self._state()
+        api.update_task("t1", videos=["a.mp4"])
+        worker.update_task("t1", videos=["b.mp4"])
+        self._wait(lambda: "t1" not in api._written)
+
+        api.update_task("t1", videos=["a.mp4"])
+        self.assertEqual(worker.get_task("t1")["videos"], ["a.mp4"])
+        # Sự kiện do chính process ghi không làm mất cache
+        time.sleep(0.1)
+        self.assertIn("t1", api._written)
+
+    def test_listener_reconnects_after_connection_loss(self):
+        client = fakeredis.FakeStrictRedis(server=self.server)
+        broken = mock.Mock()
+        broken.listen.side_effect = ConnectionError("mất kết nối")
+        pubsubs = [broken]
+        real_pubsub = client.pubsub
+
+        def pubsub(**kwargs):
+            return pubsubs.pop() if pubsubs else real_pubsub(**kwargs)
+
+        client.pubsub = pubsub
+        with mock.patch("redis.StrictRedis", return_value=client), mock.patch.object(
+            RedisState, "_listen_backoff", (0.01, 0.05)
+        ):
+            api = RedisState()
+        self._wait_subscribed(api, 1)
+        self.assertTrue(broken.close.called)
+
+        version = api.task_version("t1")
+        self._state().update_task("t1", state=const.TASK_STATE_COMPLETE)
+        self._wait(lambda: api.task_version("t1") > version)
+
+    def test_zero_interval_writes_progress_without_flusher(self):
+        client = fakeredis.FakeStrictRedis(server=self.server)
+        with mock.patch("redis.StrictRedis", return_value=client), mock.patch(
+            "threading.Thread.start", autospec=True, side_effect=lambda t: None
+        ) as start:
+            state = RedisState(progress_interval=0)
+        # Chỉ luồng nghe sự kiện được khởi động
+        self.assertEqual([t._target for (t,), _ in start.call_args_list], [state._listen_events])
+        state.update_task("t1", progress=10)
+        state.update_task("t1", progress=20)
+        self.assertEqual(state._redis.hget(state._task_key("t1"), "progress"), b"20")
+
+    def test_scripts_only_touch_declared_keys(self):
+        api = self._state()
+        declared = set()
+        script = api._update_script
+
+        def update(keys, args):
+            declared.update(keys)
+            return script(keys=keys, args=args)
+
+        api._update_script = update
+        api.update_task("t1", state=const.TASK_STATE_PROCESSING)
+        # State ngoài các hằng số vẫn có chỉ mục riêng
+        api.update_task("t1", state=7)
+        self.assertEqual(self._state_members(api, 7), {"t1"})
+        self.assertEqual(self._state_members(api, const.TASK_STATE_PROCESSING), set())
+        touched = {k.decode("utf-8") for k in api._redis.keys("*")}
+        self.assertLessEqual(touched, declared)
+
+        api.delete_task("t1")
+        self.assertEqual(api._redis.keys("*"), [])
+
+    def test_delete_removes_indexes_and_pending(self):
+        api = self._state(progress_interval=10)
+        worker = self._state()
+        api.update_task("t1", progress=0)
+        worker.update_task("t1", state=const.TASK_STATE_COMPLETE, progress=100)
+        api.update_task("t1", progress=50)
+        api.delete_task("t1")
+        api.flush()
+
+        self.assertIsNone(api.get_task("t1"))
+        self.assertEqual(api._redis.zcard(api._created_key), 0)
+        self.assertEqual(self._state_members(api, const.TASK_STATE_COMPLETE), set())
+
+
+class TestSQLiteState(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        # progress_interval lớn: chỉ flush khi test gọi
+        self.state = SQLiteState(os.path.join(self.dir.name, "state.db"), progress_interval=3600)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _stored_progress(self, task_id):
+        row = self.state._conn().execute(
+            "SELECT progress FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return row[0]
+
+    def test_progress_is_batched(self):
+        self.state.update_task("t1", progress=0)
+        self.state.update_task("t1", progress=40)
+        self.assertEqual(self._stored_progress("t1"), 0)
+        self.assertEqual(self.state.get_task("t1")["progress"], 40)
+        self.state.flush()
+        self.assertEqual(self._stored_progress("t1"), 40)
+
+    def test_failed_flush_keeps_pending(self):
+        self.state.update_task("t1", progress=0)
+        self.state.update_task("t1", progress=40)
+        self.state._SQL_UPDATE_PROGRESS = "UPDATE missing_table SET x = ?"
+        with self.assertRaises(Exception):
+            self.state.flush()
+        self.assertIn("t1", self.state._pending_progress)
+
+        del self.state._SQL_UPDATE_PROGRESS
+        self.state.flush()
+        self.assertEqual(self._stored_progress("t1"), 40)
+        self.assertEqual(self.state._pending_progress, {})
+
+    def test_zero_interval_writes_progress_directly(self):
+        with mock.patch("threading.Thread.start") as start:
+            state = SQLiteState(os.path.join(self.dir.name, "direct.db"), progress_interval=0)
+        start.assert_not_called()
+        state.update_task("t1", progress=0)
+        state.update_task("t1", progress=40)
+        self.assertEqual(state._pending_progress, {})
+        row = state._conn().execute("SELECT progress FROM tasks WHERE task_id = 't1'").fetchone()
+        self.assertEqual(row[0], 40)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+import wave
+from types import SimpleNamespace
+from unittest import mock
+
+from app.services import subtitle
+
+_WORDS_PER_SECOND = 1
+
+
+class FakeAlignModel:
+    """Model giả: "nhận dạng" các từ đầu của prompt, mỗi giây một từ."""
+
+    def __init__(self):
+        self.prompts = []
+
+    def transcribe(self, audio, **kwargs):
+        prompt = kwargs.get("initial_prompt") or ""
+        self.prompts.append(prompt)
+        seconds = len(audio) / subtitle._SAMPLE_RATE
+        words = prompt.split()[: int(seconds * _WORDS_PER_SECOND)]
+        timed = [
+            SimpleNamespace(word=f" {word}", start=i + 0.1, end=i + 0.8)
+            for i, word in enumerate(words)
+        ]
+        segments = [SimpleNamespace(words=timed, end=seconds)]
+        return iter(segments), SimpleNamespace(duration=seconds)
+
+
+class TestCreateAligned(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        # 70 giây im lặng: VAD không thấy tiếng nói nên chia cửa sổ 30 + 30 + 10 giây
+        self.audio_file = os.path.join(self.dir.name, "audio.wav")
+        with wave.open(self.audio_file, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(subtitle._SAMPLE_RATE)
+            f.writeframes(b"\0\0" * subtitle._SAMPLE_RATE * 70)
+        self.script = " ".join(f"Câu số {i} có năm từ, rồi dừng." for i in range(10))
+        self.model = FakeAlignModel()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_each_window_gets_its_script_slice(self):
+        subtitle_file = os.path.join(self.dir.name, "audio.srt")
+        with mock.patch.object(subtitle.pool, "get_model", return_value=self.model):
+            result = subtitle.create_aligned(self.audio_file, self.script, subtitle_file)
+
+        self.assertEqual(result, subtitle_file)
+        words = self.script.split()
+        self.assertEqual(len(self.model.prompts), 3)
+        # Mỗi cửa sổ 30 giây nhận dạng 30 từ, cửa sổ sau bắt đầu từ từ thứ 31
+        self.assertTrue(self.model.prompts[0].startswith(" ".join(words[:30])))
+        self.assertTrue(self.model.prompts[1].startswith(" ".join(words[30:60])))
+        self.assertTrue(self.model.prompts[2].startswith(" ".join(words[60:70])))
+
+        with open(subtitle_file, encoding="utf-8") as f:
+            blocks = f.read().strip().split("\n\n")
+        texts = " ".join(block.split("\n", 2)[2] for block in blocks)
+        # SRT giữ nguyên từ của kịch bản
+        self.assertEqual(texts.split(), [w.strip(",.") for w in words if w.strip(",.")])
+        # Từ ở cửa sổ thứ hai được dời 30 giây
+        self.assertIn("00:00:30,", "\n".join(blocks))
+
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_runs_must_be_positive(self):
+        with mock.patch.object(subtitle.pool, "get_model") as get_model:
+            with self.assertRaises(ValueError):
+                subtitle.benchmark("audio.wav", runs=0)
+        get_model.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+import unittest
+from concurrent.futures import CancelledError
+
+from app.services.tts_service import TTSService
+
+
+class TestTTSServiceShutdown(unittest.TestCase):
+    def test_shutdown_resolves_pending_jobs(self):
+        service = TTSService("test-tts", concurrency=1)
+        started = threading.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(60)
+
+        running = service.submit(slow, "chạy")
+        # Job thứ hai đang chờ semaphore
+        waiting = service.submit(slow, "chờ")
+        self.assertTrue(started.wait(5))
+
+        service.shutdown()
+        for future in (running, waiting):
+            with self.assertRaises(CancelledError):
+                future.result(timeout=5)
+        self.assertEqual(service.stats()["active"], 0)
+        self.assertEqual(service.stats()["queued"], 0)
+
+        # Dịch vụ khởi động lại được sau khi dừng
+        async def quick():
+            return "ok"
+
+        self.assertEqual(service.submit(quick).result(timeout=5), "ok")
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
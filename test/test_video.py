@@ -0,0 +1,82 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+
+from app.controllers.v1 import video
+from app.models import const
+from app.services.state import RedisState
+
+
+class TestWatchTask(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.api = self._state()
+        self.worker = self._state()
+        # Chờ luồng nghe của cả hai đăng ký kênh sự kiện
+        while self.api._redis.pubsub_numsub(self.api._events_channel)[0][1] < 2:
+            time.sleep(0.01)
+        patches = [
+            mock.patch.object(video.sm, "state", self.api),
+            mock.patch.object(video, "_EVENT_POLL_INTERVAL", 0.01),
+            # Không đọc lại định kỳ: chỉ sự kiện pub/sub khiến stream đọc lại task
+            mock.patch.object(video, "_EVENT_RESYNC_INTERVAL", 3600),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _state(self):
+        client = fakeredis.FakeStrictRedis(server=self.server)
+        with mock.patch("redis.StrictRedis", return_value=client):
+            return RedisState(progress_interval=0)
+
+    def _watch(self, steps):
+        connection = SimpleNamespace(base_url="http://localhost/")
+
+        async def collect():
+            events = []
+            async for event, data in video._watch_task(connection, "t1"):
+                if data is None:
+                    continue
+                events.append((event, data.get("state"), data.get("progress")))
+                if steps:
+                    # Worker (process khác) cập nhật sau khi stream đã gửi sự kiện
+                    steps.pop(0)()
+            return events
+
+        return asyncio.run(asyncio.wait_for(collect(), timeout=10))
+
+    def test_stream_reports_changes_and_closes_on_terminal_state(self):
+        self.worker.update_task("t1", progress=10)
+        events = self._watch(
+            [
+                lambda: self.worker.update_task("t1", progress=60),
+                lambda: self.worker.update_task(
+                    "t1", state=const.TASK_STATE_COMPLETE, progress=100
+                ),
+            ]
+        )
+        self.assertEqual(
+            events,
+            [
+                ("task", const.TASK_STATE_PROCESSING, 10),
+                ("task", const.TASK_STATE_PROCESSING, 60),
+                ("task", const.TASK_STATE_COMPLETE, 100),
+            ],
+        )
+
+    def test_stream_reports_deleted_task(self):
+        self.worker.update_task("t1", progress=10)
+        events = self._watch([lambda: self.worker.delete_task("t1")])
+        self.assertEqual(
+            events,
+            [("task", const.TASK_STATE_PROCESSING, 10), ("deleted", None, None)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
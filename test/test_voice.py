@@ -0,0 +1,262 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from edge_tts import SubMaker
+
+from app.services import alignment, tts_cache, tts_service, voice
+
+# 6000 byte MP3 48 kbit/s = 1 giây = 10_000_000 tick (100ns)
+_CHUNK_BYTES = 6000
+_CHUNK_TICKS = 10_000_000
+
+
+class FakeEdge:
+    """Luồng edge-tts giả: mỗi từ một WordBoundary, audio dài _CHUNK_BYTES."""
+
+    def __init__(self, fail_once=(), empty=()):
+        self.fail_once = set(fail_once)
+        self.empty = set(empty)
+        self.calls = {}
+
+    async def stream(self, text, voice_name, rate):
+        self.calls[text] = self.calls.get(text, 0) + 1
+        if text in self.fail_once and self.calls[text] == 1:
+            raise ConnectionError("mất kết nối")
+        if text in self.empty:
+            return
+        for i, word in enumerate(text.split()):
+            yield {"type": "WordBoundary", "offset": i * 1_000_000, "duration": 500_000, "text": word}
+        yield {"type": "audio", "data": b"\0" * _CHUNK_BYTES}
+
+
+class TestEdgeChunkStitching(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.voice_file = os.path.join(self.dir.name, "audio.mp3")
+        patches = [
+            mock.patch.object(voice.tts_cache, "cache", None),
+            mock.patch.object(voice, "_tts_chunk_chars", 15),
+            mock.patch.object(tts_service.edge_service, "backoff", 0),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _synthesize(self, edge, text):
+        with mock.patch.object(voice, "_edge_stream", edge.stream):
+            return voice.azure_tts_v1(text, "vi-VN-HoaiMyNeural-Female", 1.0, self.voice_file)
+
+    def test_offsets_follow_mp3_byte_offsets(self):
+        edge = FakeEdge()
+        sub_maker = self._synthesize(edge, "Một hai ba. Bốn năm. Sáu bảy tám.")
+
+        self.assertEqual(len(edge.calls), 3)
+        self.assertEqual(sub_maker.subs, ["Một", "hai", "ba.", "Bốn", "năm.", "Sáu", "bảy", "tám."])
+        starts = [start for start, _ in sub_maker.offset]
+        self.assertEqual(
+            starts,
+            [
+                0, 1_000_000, 2_000_000,
+                _CHUNK_TICKS, _CHUNK_TICKS + 1_000_000,
+                2 * _CHUNK_TICKS, 2 * _CHUNK_TICKS + 1_000_000, 2 * _CHUNK_TICKS + 2_000_000,
+            ],
+        )
+        self.assertEqual(os.path.getsize(self.voice_file), 3 * _CHUNK_BYTES)
+
+    def test_retried_chunk_keeps_its_position(self):
+        edge = FakeEdge(fail_once={"Bốn năm."})
+        sub_maker = self._synthesize(edge, "Một hai ba. Bốn năm. Sáu bảy tám.")
+
+        self.assertEqual(edge.calls["Bốn năm."], 2)
+        self.assertEqual(sub_maker.subs[3:5], ["Bốn", "năm."])
+        self.assertEqual(sub_maker.offset[3][0], _CHUNK_TICKS)
+        self.assertEqual(sub_maker.offset[5][0], 2 * _CHUNK_TICKS)
+        self.assertEqual(os.path.getsize(self.voice_file), 3 * _CHUNK_BYTES)
+
+    def test_empty_chunk_fails_synthesis(self):
+        edge = FakeEdge(empty={"Bốn năm."})
+        self.assertIsNone(self._synthesize(edge, "Một hai ba. Bốn năm. Sáu bảy tám."))
+        # đoạn rỗng được thử lại đủ số lần rồi mới bỏ
+        self.assertEqual(edge.calls["Bốn năm."], tts_service.edge_service.max_attempts)
+        self.assertFalse(os.path.exists(self.voice_file))
+
+    def test_empty_chunk_does_not_shift_timeline(self):
+        first, second = SubMaker(), SubMaker()
+        first.create_sub((0, 500_000), "Một")
+        second.create_sub((0, 500_000), "Hai")
+        merged = voice._merge_sub_makers(
+            [(b"\0" * _CHUNK_BYTES, first), (b"", SubMaker()), (b"\0" * _CHUNK_BYTES, second)]
+        )
+        self.assertEqual(merged.subs, ["Một", "Hai"])
+        self.assertEqual(merged.offset, [(0, 500_000), (_CHUNK_TICKS, _CHUNK_TICKS + 500_000)])
+
+
+class TestEdgeSentenceCache(TestEdgeChunkStitching):
+    def setUp(self):
+        super().setUp()
+        cache = tts_cache.TTSCache(os.path.join(self.dir.name, "cache"))
+        patch = mock.patch.object(voice.tts_cache, "cache", cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_edit_resynthesizes_only_changed_sentence(self):
+        edge = FakeEdge()
+        self._synthesize(edge, "Một. Hai. Ba bốn năm sáu.")
+        self.assertEqual(sorted(edge.calls), ["Ba bốn năm sáu.", "Hai.", "Một."])
+
+        edited = FakeEdge()
+        sub_maker = self._synthesize(edited, "Một. Hai sửa. Ba bốn năm sáu.")
+        self.assertEqual(edited.calls, {"Hai sửa.": 1})
+        self.assertEqual(sub_maker.subs, ["Một.", "Hai", "sửa.", "Ba", "bốn", "năm", "sáu."])
+        self.assertEqual(
+            [start for start, _ in sub_maker.offset],
+            [0, _CHUNK_TICKS, _CHUNK_TICKS + 1_000_000]
+            + [2 * _CHUNK_TICKS + i * 1_000_000 for i in range(4)],
+        )
+        self.assertEqual(tts_cache.cache.hits["sentence"], 2)
+
+    def test_evicted_audio_is_a_miss(self):
+        edge = FakeEdge()
+        self._synthesize(edge, "Một. Hai.")
+        cache = tts_cache.cache
+        key = cache.make_key("Một.", "vi-VN-HoaiMyNeural", 1.0, "azure-tts-v1", kind="sentence")
+        audio_path, _ = cache._paths(key)
+        # Mục bị xóa audio ngay sau khi đọc json
+        os.remove(audio_path)
+        self.assertIsNone(cache.load(key, os.path.join(self.dir.name, "out.mp3"), kind="sentence"))
+        self.assertEqual(cache.hits["sentence"], 0)
+
+        again = FakeEdge()
+        sub_maker = self._synthesize(again, "Một. Hai.")
+        self.assertEqual(again.calls, {"Một.": 1})
+        self.assertEqual(sub_maker.subs, ["Một.", "Hai."])
+
+
+class TestPodcastTurns(unittest.TestCase):
+    dialogue = "Read aloud in a warm\nAn: Xin chào.\nBình: Chào bạn.\n"
+
+    def test_parse_instruction_and_turns(self):
+        self.assertEqual(voice.parse_podcast_instruction(self.dialogue, "An", "Bình"), "Read aloud in a warm")
+        self.assertEqual(
+            voice.parse_podcast_turns(self.dialogue, "An", "Bình"),
+            [(1, "Xin chào."), (2, "Chào bạn.")],
+        )
+        self.assertEqual(voice.parse_podcast_instruction("An: Xin chào.", "An", "Bình"), "")
+
+    def test_instruction_reaches_every_turn_payload(self):
+        payloads = []
+
+        def fake_fetch(url, payload):
+            payloads.append(payload)
+            return b"\0" * 48000
+
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(
+            voice, "_fetch_pcm", side_effect=fake_fetch
+        ), mock.patch.object(voice, "encode_pcm_to_mp3", return_value=2.0):
+            sub_maker = voice.get_audio_podcast_turns(
+                turns=voice.parse_podcast_turns(self.dialogue, "An", "Bình"),
+                host1="An",
+                host2="Bình",
+                voice1="v1",
+                voice2="v2",
+                voice_file=os.path.join(d, "audio.mp3"),
+                gemini_key="key",
+                instruction=voice.parse_podcast_instruction(self.dialogue, "An", "Bình"),
+            )
+
+        self.assertIsNotNone(sub_maker)
+        scripts = sorted((p["voice"], p["script"]) for p in payloads)
+        self.assertEqual(
+            scripts,
+            [
+                ("v1", "Read aloud in a warm\nXin chào."),
+                ("v2", "Read aloud in a warm\nChào bạn."),
+            ],
+        )
+
+
+    def _turns(self, voice_file, fetch):
+        with mock.patch.object(voice, "_fetch_pcm", side_effect=fetch), mock.patch.object(
+            voice, "encode_pcm_to_mp3", return_value=3.0
+        ) as encode, mock.patch.object(voice.time, "sleep"):
+            sub_maker = voice.get_audio_podcast_turns(
+                turns=voice.parse_podcast_turns(self.dialogue, "An", "Bình"),
+                host1="An",
+                host2="Bình",
+                voice1="v1",
+                voice2="v2",
+                voice_file=voice_file,
+                gemini_key="key",
+            )
+        return sub_maker, encode
+
+    def test_turn_offsets_and_speaker_timings(self):
+        # PCM 24 kHz 16 bit mono: 48000 byte = 1 giây
+        lengths = {"v1": 48000, "v2": 96000}
+        with tempfile.TemporaryDirectory() as d:
+            voice_file = os.path.join(d, "audio.mp3")
+            sub_maker, _ = self._turns(voice_file, lambda url, p: b"\0" * lengths[p["voice"]])
+
+            self.assertEqual(sub_maker.subs, ["Xin chào", "Chào bạn"])
+            (first_start, first_end), (second_start, second_end) = sub_maker.offset
+            self.assertGreaterEqual(first_start, 0)
+            self.assertLessEqual(first_end, 10_000_000)
+            # Lượt thứ hai bắt đầu sau toàn bộ PCM của lượt đầu
+            self.assertGreaterEqual(second_start, 10_000_000)
+            self.assertLessEqual(second_end, 30_000_000)
+
+            with open(alignment.speaker_timing_file(voice_file), encoding="utf-8") as f:
+                speakers = json.load(f)
+        self.assertEqual(
+            speakers,
+            [
+                {"host": 1, "speaker": "An", "start": 0.0, "end": 1.0, "text": "Xin chào."},
+                {"host": 2, "speaker": "Bình", "start": 1.0, "end": 3.0, "text": "Chào bạn."},
+            ],
+        )
+
+    def test_turn_failing_three_times_fails_podcast(self):
+        calls = {"v1": 0, "v2": 0}
+
+        def fetch(url, payload):
+            calls[payload["voice"]] += 1
+            if payload["voice"] == "v2":
+                raise RuntimeError("500 - lỗi")
+            return b"\0" * 48000
+
+        with tempfile.TemporaryDirectory() as d:
+            voice_file = os.path.join(d, "audio.mp3")
+            sub_maker, encode = self._turns(voice_file, fetch)
+            self.assertFalse(os.path.exists(alignment.speaker_timing_file(voice_file)))
+
+        self.assertIsNone(sub_maker)
+        self.assertEqual(calls, {"v1": 1, "v2": 3})
+        encode.assert_not_called()
+
+    def test_raw_fallback_removes_stale_speaker_timings(self):
+        with tempfile.TemporaryDirectory() as d:
+            voice_file = os.path.join(d, "audio.mp3")
+            alignment.save_speaker_timings(voice_file, [{"host": 1, "start": 0, "end": 1}])
+            with mock.patch.object(voice, "stream_pcm_to_mp3", return_value=2.0):
+                sub_maker = voice.get_audio_podcast_raw(
+                    dialogue_tts=self.dialogue,
+                    dialogue_subtitle="Xin chào. Chào bạn.",
+                    host1="An",
+                    host2="Bình",
+                    voice1="v1",
+                    voice2="v2",
+                    voice_file=voice_file,
+                    gemini_key="key",
+                )
+            self.assertIsNotNone(sub_maker)
+            self.assertEqual(alignment.load_speaker_timings(voice_file), [])
+
+
+if __name__ == "__main__":
+    unittest.main()